@@ -0,0 +1,393 @@
+import io
+import os
+import struct
+import tempfile
+import threading
+import wave
+
+# Recordings are kept in memory up to this size (~17 minutes of 16-bit mono 16 kHz audio);
+# longer recordings spill to a temporary WAV file that grows chunk by chunk.
+MAX_MEMORY_BYTES = int(os.environ.get("MIND_GUARDIAN_AUDIO_MEMORY_BYTES", str(32 * 1024 * 1024)))
+INITIAL_SECONDS = 30
+# Recordings are resampled to this rate as they are captured; speech recognizers work at 16 kHz
+SPEECH_RATE = int(os.environ.get("MIND_GUARDIAN_SPEECH_RATE", "16000"))
+
+# Voice activity detection: a frame is speech when its energy is this many dB above the noise floor,
+# estimated from the quietest frames. A clip without a clearly quieter stretch (continuous speech, a
+# steady tone) has no floor of its own; it is measured against a floor passed in from earlier audio,
+# or only against VAD_MIN_SPEECH_DB. Silences longer than VAD_MAX_SILENCE_MS are cut down to it.
+VAD_FRAME_MS = 30
+VAD_THRESHOLD_DB = float(os.environ.get("MIND_GUARDIAN_VAD_THRESHOLD_DB", "10"))
+VAD_MIN_SPEECH_DB = 30.0 # Absolute floor (dBFS re. 1 LSB) so digital silence never counts as speech
+VAD_PADDING_MS = 150 # Kept around every speech run so word onsets and endings are not clipped
+VAD_MAX_SILENCE_MS = int(os.environ.get("MIND_GUARDIAN_VAD_MAX_SILENCE_MS", "600"))
+VAD_BLOCK_FRAMES = 2048 # Frame energies are computed this many frames (~1 minute) at a time
+
+# NumPy is imported on first use by import_numpy()
+np = None
+
+
+def wav_header(sample_rate, sample_width, channels, data_bytes):
+    """44-byte RIFF/WAVE header for `data_bytes` of little-endian PCM."""
+    byte_rate = sample_rate * sample_width * channels
+    block_align = sample_width * channels
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_bytes, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, block_align, sample_width * 8,
+        b"data", data_bytes,
+    )
+
+
+def wav_data_range(path):
+    """(offset, length) in bytes of the PCM samples in the data chunk of the WAV file at `path`."""
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise ValueError(f"Not a WAV file: {path}")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in {path}")
+            chunk_id, size = header[:4], struct.unpack("<I", header[4:])[0]
+            if chunk_id == b"data":
+                offset = f.tell()
+                return offset, min(size, os.fstat(f.fileno()).st_size - offset)
+            f.seek(size + (size & 1), io.SEEK_CUR) # Chunks are padded to an even size
+
+
+class WavBufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file object that presents a WAV header followed by PCM held in a
+    memoryview. Lets wave / SpeechRecognition read an in-memory recording as if it were a
+    file, without joining the chunks into a new bytes object or writing it to disk.
+    """
+    def __init__(self, header: bytes, pcm: memoryview):
+        self._header = header
+        self._pcm = pcm
+        self._size = len(header) + len(pcm)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        target = memoryview(buffer).cast("B")
+        written = 0
+        header_length = len(self._header)
+        while written < len(target) and self._position < self._size:
+            if self._position < header_length:
+                source = memoryview(self._header)[self._position:]
+            else:
+                source = self._pcm[self._position - header_length:]
+            count = min(len(source), len(target) - written)
+            target[written:written + count] = source[:count]
+            written += count
+            self._position += count
+        return written
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(0, min(offset, self._size))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class AudioCaptureBuffer:
+    """
+    Bounded-memory sink for one recording. Chunks are copied into a preallocated bytearray
+    that grows geometrically up to `max_memory_bytes`; beyond that the audio so far is spilled
+    to a uniquely named temporary WAV file and later chunks are appended to it directly, so a
+    long voice note never holds more than `max_memory_bytes` in RAM.
+    """
+    def __init__(self, sample_rate, sample_width=2, channels=1, max_memory_bytes=MAX_MEMORY_BYTES, spill_dir=None):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_dir = spill_dir
+        self.spill_path = None
+        self._buffer = bytearray(min(max_memory_bytes, sample_rate * sample_width * channels * INITIAL_SECONDS))
+        self._length = 0
+        self._wave_writer = None
+        self._finished = False
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._length
+
+    @property
+    def duration_seconds(self) -> float:
+        return self._length / float(self.sample_rate * self.sample_width * self.channels)
+
+    @property
+    def spilled(self) -> bool:
+        return self.spill_path is not None
+
+    def write(self, data: bytes):
+        """Appends one chunk of PCM (called from the recording thread)."""
+        with self._lock:
+            if self._finished:
+                return
+            if self._wave_writer is None and self._length + len(data) > len(self._buffer):
+                self._grow_or_spill(self._length + len(data))
+            if self._wave_writer is not None:
+                self._wave_writer.writeframesraw(data)
+            else:
+                self._buffer[self._length:self._length + len(data)] = data
+            self._length += len(data)
+
+    def finish(self):
+        """Marks the recording complete; a spilled file gets its final WAV header."""
+        with self._lock:
+            self._finished = True
+            if self._wave_writer is not None:
+                self._wave_writer.close() # Patches the RIFF/data sizes in the header
+                self._wave_writer = None
+
+    def pcm_view(self) -> memoryview:
+        """Zero-copy view of the recorded PCM (in-memory recordings only)."""
+        if self.spilled:
+            raise ValueError("Recording was spilled to disk; use open_wav().")
+        return memoryview(self._buffer)[:self._length]
+
+    def open_wav(self):
+        """
+        Returns something sr.AudioFile / wave.open can read: a zero-copy reader over the in-memory
+        PCM, or the path of the spilled WAV file.
+        """
+        if self.spilled:
+            return self.spill_path
+        header = wav_header(self.sample_rate, self.sample_width, self.channels, self._length)
+        return WavBufferReader(header, self.pcm_view())
+
+    def speech_pcm(self):
+        """
+        The recording with silence removed by detect_speech(), as (pcm_bytes, stats). A spilled
+        recording is memory-mapped rather than read, so only its speech is copied into memory.
+        """
+        if not self.spilled:
+            return trim_silence(self.pcm_view(), self.sample_rate)
+        import_numpy()
+        offset, length = wav_data_range(self.spill_path)
+        if length < 2:
+            return trim_silence(b"", self.sample_rate)
+        samples = np.memmap(self.spill_path, dtype="<i2", mode="r", offset=offset, shape=(length // 2,))
+        try:
+            return trim_silence(samples, self.sample_rate)
+        finally:
+            del samples # Unmaps the file, so discard() can delete it (Windows)
+
+    def speech_wav(self):
+        """
+        Like open_wav(), but with silence removed by detect_speech(). Returns (reader, stats);
+        reader is None when the recording contains no speech.
+        """
+        speech, stats = self.speech_pcm()
+        if not speech:
+            return None, stats
+        header = wav_header(self.sample_rate, self.sample_width, 1, len(speech))
+        return WavBufferReader(header, memoryview(speech)), stats
+
+    def discard(self):
+        """Releases the memory and deletes the spill file, if any."""
+        self.finish()
+        self._buffer = bytearray()
+        self._length = 0
+        if self.spill_path:
+            try:
+                os.remove(self.spill_path)
+            except OSError:
+                pass
+            self.spill_path = None
+
+    def _grow_or_spill(self, needed):
+        if needed <= self.max_memory_bytes:
+            # Geometric growth keeps the number of reallocations logarithmic in the recording length
+            new_size = min(self.max_memory_bytes, max(needed, 2 * len(self._buffer)))
+            self._buffer.extend(bytes(new_size - len(self._buffer)))
+            return
+        fd, self.spill_path = tempfile.mkstemp(prefix="mind_guardian_recording_", suffix=".wav", dir=self.spill_dir)
+        os.close(fd)
+        print(f"Recording exceeded {self.max_memory_bytes} bytes; spilling to {self.spill_path}")
+        self._wave_writer = wave.open(self.spill_path, "wb")
+        self._wave_writer.setnchannels(self.channels)
+        self._wave_writer.setsampwidth(self.sample_width)
+        self._wave_writer.setframerate(self.sample_rate)
+        self._wave_writer.writeframesraw(memoryview(self._buffer)[:self._length])
+        self._buffer = bytearray() # The in-memory copy is no longer needed
+
+
+def import_numpy():
+    """Imports NumPy on first use, so importing this module stays cheap for the GUI."""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+class StreamingResampler:
+    """
+    Converts 16-bit PCM chunks from the microphone rate to the speech rate as they arrive.
+    Each chunk is low-pass filtered (windowed-sinc FIR, so content above the new Nyquist
+    frequency does not alias into the speech band) and linearly interpolated at the output
+    sample positions, all vectorized. Filter history and the fractional read position carry
+    over between chunks, so the output is continuous no matter how the input is split.
+    Multi-channel input is mixed down to mono.
+    """
+    def __init__(self, input_rate, output_rate=None, channels=1, taps=63):
+        import_numpy()
+        self.input_rate = input_rate
+        self.output_rate = output_rate or SPEECH_RATE
+        self.channels = channels
+        self.step = input_rate / float(self.output_rate) # Input samples per output sample
+        if self.step > 1.0:
+            cutoff = 0.9 * 0.5 / self.step # Fraction of the input rate, a little under the output Nyquist
+            positions = np.arange(taps) - (taps - 1) / 2.0
+            kernel = 2 * cutoff * np.sinc(2 * cutoff * positions) * np.hamming(taps)
+            self._kernel = (kernel / kernel.sum()).astype(np.float32)
+        else:
+            self._kernel = None # Upsampling or same rate: interpolation alone is enough
+        self._history = np.zeros(0 if self._kernel is None else taps - 1, dtype=np.float32)
+        self._tail = np.zeros(0, dtype=np.float32) # Filtered samples not yet consumed by interpolation
+        self._position = 0.0 # Next output position, relative to the start of _tail
+
+    def process(self, data: bytes) -> bytes:
+        """Resamples one chunk; returns the 16-bit PCM output it completes (may be empty)."""
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32)
+        if self.channels > 1:
+            samples = samples[:len(samples) - len(samples) % self.channels].reshape(-1, self.channels).mean(axis=1)
+        if self._kernel is not None:
+            padded = np.concatenate((self._history, samples))
+            self._history = padded[len(padded) - len(self._history):]
+            samples = np.convolve(padded, self._kernel, mode="valid")
+        signal = np.concatenate((self._tail, samples))
+        if len(signal) < 2:
+            self._tail = signal
+            return b""
+
+        # Output positions that have both neighbours available in this chunk
+        count = int(np.floor((len(signal) - 1 - self._position) / self.step)) + 1
+        if count <= 0:
+            self._tail = signal
+            return b""
+        positions = self._position + self.step * np.arange(count)
+        left = positions.astype(np.int64)
+        fraction = (positions - left).astype(np.float32)
+        right = np.minimum(left + 1, len(signal) - 1)
+        output = signal[left] + (signal[right] - signal[left]) * fraction
+
+        next_position = self._position + self.step * count
+        keep_from = min(int(np.floor(next_position)), len(signal))
+        self._tail = signal[keep_from:]
+        self._position = next_position - keep_from
+        return np.clip(np.rint(output), -32768, 32767).astype("<i2").tobytes()
+
+
+def as_samples(pcm):
+    """16-bit mono PCM (bytes-like, or an int16 array such as a memmap) as an int16 array, without copying."""
+    import_numpy()
+    return pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype="<i2")
+
+
+def estimate_noise_floor(energy_db, threshold_db=VAD_THRESHOLD_DB):
+    """
+    The 10th percentile of the frame energies, or None when the loudest tenth of the frames is
+    not `threshold_db` above it: then the clip has no silence to measure a floor from, and a
+    floor taken from it would leave no frame counted as speech.
+    """
+    floor = float(np.percentile(energy_db, 10))
+    return floor if float(np.percentile(energy_db, 90)) - floor > threshold_db else None
+
+
+def detect_speech(pcm, sample_rate, frame_ms=VAD_FRAME_MS, threshold_db=VAD_THRESHOLD_DB,
+                  padding_ms=VAD_PADDING_MS, max_silence_ms=VAD_MAX_SILENCE_MS, noise_floor_db=None):
+    """
+    Energy-based voice activity detection over 16-bit mono PCM. Returns a list of
+    (start, end) sample ranges to keep, in order. Frame energies are computed in one
+    vectorized pass; the noise floor is estimated from them (estimate_noise_floor), so no
+    part of the recording has to be set aside for calibration. `noise_floor_db` is a floor
+    measured on earlier audio of the same recording; the lower of the two is used.
+    """
+    return _speech_segments(pcm, sample_rate, frame_ms, threshold_db, padding_ms, max_silence_ms, noise_floor_db)[0]
+
+
+def _speech_segments(pcm, sample_rate, frame_ms, threshold_db, padding_ms, max_silence_ms, noise_floor_db):
+    """detect_speech(), also returning the clip's own noise floor and loudest frame energy (dB)."""
+    samples = as_samples(pcm)
+    frame = max(1, sample_rate * frame_ms // 1000)
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        return [], None, None
+    # In blocks, so a long (memory-mapped) recording never gets a float copy of all its samples
+    energy_db = np.empty(frame_count, dtype=np.float32)
+    for first in range(0, frame_count, VAD_BLOCK_FRAMES):
+        last = min(first + VAD_BLOCK_FRAMES, frame_count)
+        frames = samples[first * frame:last * frame].reshape(last - first, frame).astype(np.float32)
+        energy_db[first:last] = 10 * np.log10(np.mean(frames * frames, axis=1) + 1.0)
+    own_floor_db = estimate_noise_floor(energy_db, threshold_db)
+    floors = [floor for floor in (own_floor_db, noise_floor_db) if floor is not None]
+    bar_db = max(min(floors) + threshold_db, VAD_MIN_SPEECH_DB) if floors else VAD_MIN_SPEECH_DB
+    active = energy_db > bar_db
+    peak_db = float(energy_db.max())
+    if not active.any():
+        return [], own_floor_db, peak_db
+
+    # Widen every speech run by the padding (a dilation done with a cumulative sum)
+    pad = padding_ms // frame_ms
+    counts = np.concatenate(([0], np.cumsum(active)))
+    low = np.clip(np.arange(frame_count) - pad, 0, frame_count)
+    high = np.clip(np.arange(frame_count) + pad + 1, 0, frame_count)
+    keep = (counts[high] - counts[low]) > 0
+
+    # Run boundaries of kept frames; gaps shorter than max_silence are bridged
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], keep.astype(np.int8), [0]))))
+    runs = edges.reshape(-1, 2)
+    max_gap = max_silence_ms // frame_ms
+    segments = [list(runs[0])]
+    for start, end in runs[1:]:
+        if start - segments[-1][1] <= max_gap:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+    last_sample = len(samples)
+    return [(int(start) * frame, min(int(end) * frame, last_sample)) for start, end in segments], own_floor_db, peak_db
+
+
+def trim_silence(pcm, sample_rate, **vad_options):
+    """
+    Returns (speech_pcm, stats): the speech segments of `pcm` joined with a short pause
+    between them (long silences are cut down rather than removed, so words stay separate).
+    stats["noise_floor_db"] is the clip's own floor (None if it had none), to pass on as
+    `noise_floor_db` for the next part of a recording.
+    """
+    samples = as_samples(pcm)
+    options = dict(frame_ms=VAD_FRAME_MS, threshold_db=VAD_THRESHOLD_DB, padding_ms=VAD_PADDING_MS,
+                   max_silence_ms=VAD_MAX_SILENCE_MS, noise_floor_db=None)
+    options.update(vad_options)
+    segments, own_floor_db, peak_db = _speech_segments(samples, sample_rate, **options)
+    pause = np.zeros(sample_rate * options["padding_ms"] // 1000, dtype="<i2")
+    pieces = []
+    for start, end in segments:
+        if pieces:
+            pieces.append(pause)
+        pieces.append(samples[start:end])
+    speech = np.concatenate(pieces).tobytes() if pieces else b""
+    stats = {
+        "recorded_seconds": len(samples) / float(sample_rate),
+        "speech_seconds": len(speech) / 2.0 / sample_rate,
+        "segments": len(segments),
+        "noise_floor_db": own_floor_db,
+        "peak_db": peak_db, # Loudest frame; None for clips shorter than a frame
+    }
+    return speech, stats
@@ -1,15 +1,668 @@
-import kagglehub
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
-# Import necessary libraries for quantization
-try:
-    import bitsandbytes
-    import accelerate
-    print("bitsandbytes and accelerate imported successfully.")
-except ImportError:
-    bitsandbytes = None
-    accelerate = None
-    print("bitsandbytes or accelerate not found. Quantization may not work.")
+import copy
+import gc
+import hashlib
+import inspect
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+import metrics
+import profiling
+from chunking import chunk_text
+from cpu_inference import load_cpu_model
+from image_pipeline import ImageError, ImagePipeline, LRUCache, PreparedImage
+from memory_manager import (
+    IDLE_UNLOAD_SECONDS, MEMORY_BUDGET_BYTES, ModelMemoryManager, ModelReloadError, model_bytes, resident_bytes,
+)
+from model_registry import ModelRegistry, has_safetensors
+from process_pool import export_shared_snapshot, load_shared_model
+from response_cache import ResponseCache, make_cache_key
+
+# Heavy dependencies are imported on first use by import_dependencies(), so importing this
+# module (and with it the GUI) stays fast and the window can paint before torch is loaded.
+torch = None
+AutoTokenizer = None
+AutoModelForCausalLM = None
+TextIteratorStreamer = None
+StoppingCriteriaList = None
+BaseModelOutputWithPooling = None
+bitsandbytes = None
+accelerate = None
+_dependencies_lock = threading.Lock()
+
+
+def import_dependencies():
+    """Imports torch, transformers and the optional quantization libraries once."""
+    global torch, AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer, StoppingCriteriaList, BaseModelOutputWithPooling
+    global bitsandbytes, accelerate
+    with _dependencies_lock:
+        if torch is not None:
+            return
+        with profiling.phase("backend dependency imports"):
+            transformers = profiling.timed_import("transformers")
+            AutoTokenizer = transformers.AutoTokenizer
+            AutoModelForCausalLM = transformers.AutoModelForCausalLM
+            TextIteratorStreamer = transformers.TextIteratorStreamer
+            StoppingCriteriaList = transformers.StoppingCriteriaList
+            BaseModelOutputWithPooling = profiling.timed_import("transformers.modeling_outputs").BaseModelOutputWithPooling
+            # Import necessary libraries for quantization
+            try:
+                bitsandbytes = profiling.timed_import("bitsandbytes")
+                accelerate = profiling.timed_import("accelerate")
+                print("bitsandbytes and accelerate imported successfully.")
+            except ImportError:
+                bitsandbytes = None
+                accelerate = None
+                print("bitsandbytes or accelerate not found. Quantization may not work.")
+            # Assigned last: a non-None torch marks the imports as complete
+            torch = profiling.timed_import("torch")
+
+
+GEMMA_MODEL_HANDLE = "google/gemma-3n/transformers/gemma-3n-e2b"
+
+# Deterministic (greedy) generation makes cached replies valid, so it also turns on the response cache
+DETERMINISTIC_GENERATION = os.environ.get("MIND_GUARDIAN_DETERMINISTIC") == "1"
+RESPONSE_CACHE_SIZE = int(os.environ.get("MIND_GUARDIAN_CACHE_SIZE", "256"))
+RESPONSE_CACHE_DIR = os.environ.get("MIND_GUARDIAN_CACHE_DIR") or None # None keeps the cache in memory only
+# Optional draft model for speculative (assisted) decoding: a registered handle or a local checkpoint
+# directory of a small model sharing Gemma's tokenizer. Unset disables speculative decoding.
+DRAFT_MODEL = os.environ.get("MIND_GUARDIAN_DRAFT_MODEL") or None
+
+UNAVAILABLE_MESSAGE = "Sorry, the AI service is currently unavailable."
+
+# Instruction prompts for each analysis type; the user's text is inserted at {text}.
+PROMPT_TEMPLATES = {
+    "journal": "Provide a gentle, non-judgemental reflection on the following journal entry, identifying potential thought patterns in a supportive way.\n\nJournal Entry: {text}\n\nReflection:",
+    "audio_transcript": "Analyze the following audio transcript to infer the emotional state and respond empathetically.\n\nAudio Transcript: {text}\n\nEmotional State Analysis:",
+    "moment": "Analyze the following visual moment description and ask a gentle, open-ended question to help the user explore the feeling connected to this moment.\n\nVisual Moment Description: {text}\n\nQuestion:",
+    # Map step for long inputs: each chunk is summarized on its own before the final reflection
+    "chunk_summary": "Summarize the following part of a longer personal text in a few sentences, keeping the feelings, events and thoughts it describes.\n\nPart: {text}\n\nSummary:",
+}
+# Analyses that can take a photo, used instead of PROMPT_TEMPLATES when one is attached. {image} becomes
+# the model's image token sequence, which the vision encoder's output replaces in the embeddings.
+IMAGE_PROMPT_TEMPLATES = {
+    "moment": "Look at the following photo of a moment and its description, and ask a gentle, open-ended question to help the user explore the feeling connected to this moment.\n\nPhoto:{image}Moment Description: {text}\n\nQuestion:",
+}
+# Vision encoder outputs kept per photo (256 x hidden size each, ~1 MB for Gemma 3n E2B), so asking again
+# about the same photo with another description only runs the language model
+VISION_CACHE_SIZE = int(os.environ.get("MIND_GUARDIAN_VISION_CACHE_SIZE", "32"))
+
+# Inputs over MAX_DIRECT_TOKENS are not put into one prompt: prefill cost grows with the square of the
+# prompt length and long entries can exceed the context window. They are split into chunks of about
+# CHUNK_TOKENS at paragraph and sentence boundaries, the chunks are summarized in one batched pass, and
+# the reflection is written from the summaries (repeated while the summaries are still too long, at most
+# MAX_REDUCE_LEVELS times and only while each level shrinks the text; what is left over is truncated).
+MAX_DIRECT_TOKENS = int(os.environ.get("MIND_GUARDIAN_MAX_DIRECT_TOKENS", "1024"))
+CHUNK_TOKENS = int(os.environ.get("MIND_GUARDIAN_CHUNK_TOKENS", "512"))
+MAX_REDUCE_LEVELS = int(os.environ.get("MIND_GUARDIAN_MAX_REDUCE_LEVELS", "3"))
+
+GENERATION_KWARGS = dict(
+    max_new_tokens=200,
+    do_sample=True,
+    temperature=0.7,
+    top_k=50,
+    top_p=0.95,
+    num_return_sequences=1,
+)
+
+# Per-analysis limits on top of the generation kwargs. Generation of a request ends at the first of:
+# its token budget, its wall-clock deadline (seconds from the start of its generate call) or one of
+# its stop strings appearing in the reply. Replies cut by the budget or the deadline end in TRUNCATED_MARKER.
+GENERATION_PROFILES = {
+    "journal": dict(max_new_tokens=200, deadline_seconds=30.0, stop_strings=()),
+    "audio_transcript": dict(max_new_tokens=160, deadline_seconds=30.0, stop_strings=()),
+    # One open-ended question is all a moment needs
+    "moment": dict(max_new_tokens=64, deadline_seconds=10.0, stop_strings=("?",)),
+    "chunk_summary": dict(max_new_tokens=96, deadline_seconds=30.0, stop_strings=()),
+}
+DEFAULT_PROFILE = dict(max_new_tokens=200, deadline_seconds=None, stop_strings=())
+# Scales every deadline (e.g. 3 on a slow CPU); 0 disables deadlines
+DEADLINE_SCALE = float(os.environ.get("MIND_GUARDIAN_DEADLINE_SCALE", "1"))
+TRUNCATED_MARKER = " [...]"
+
+# Entry embeddings (MindGuardian.embed) mean-pool the hidden states of the layer at this fraction of the
+# model's depth: middle-to-late layers carry the meaning of a text, the last ones mostly the next token
+EMBEDDING_LAYER_FRACTION = 0.66
+EMBEDDING_MAX_TOKENS = 512
+# Analyses whose prompt gets the user's similar past entries, when MindGuardian.related_entries is set
+CONTEXT_ANALYSES = ("journal", "audio_transcript")
+
+# Greedy decoding: the same prompt always yields the same reply
+DETERMINISTIC_GENERATION_KWARGS = dict(
+    max_new_tokens=200,
+    do_sample=False,
+    num_return_sequences=1,
+)
+
+
+# Stop reasons after which a streamed reply is whole: stream_* generators return their stop reason
+# (the StopIteration value), which is one of GenerationResult's, "cached", "cancelled" or "error"
+COMPLETE_STOP_REASONS = ("eos", "stop_string", "cached")
+
+
+def drain_stream(stream, outcome: dict):
+    """Yields the deltas of a stream_* generator, then stores its stop reason in outcome["stop_reason"]."""
+    outcome["stop_reason"] = yield from stream
+
+
+def is_cacheable(response) -> bool:
+    """
+    A reply cut by a deadline depends on machine load, and one cut by cancellation on timing, so
+    neither must be served again from the cache.
+    """
+    return getattr(response, "stop_reason", None) not in ("deadline", "cancelled")
+
+
+class GenerationRequest:
+    """
+    A prompt waiting in the InferenceScheduler queue, resolved through its future.
+    Setting `cancel_event` (a threading.Event) drops the request if it is still queued and
+    stops its generation at the next decoding step if it is running. `image` is a PreparedImage
+    whose image tokens in the prompt are filled in by the vision encoder.
+    """
+    def __init__(self, prompt: str, streamer=None, analysis_type=None, cancel_event=None, image=None):
+        self.prompt = prompt
+        self.streamer = streamer
+        self.image = image
+        self.analysis_type = analysis_type
+        self.cancel_event = cancel_event
+        self.profile = GENERATION_PROFILES.get(analysis_type, DEFAULT_PROFILE)
+        self.stop_reason = None # Set during generation: eos, stop_string, budget, deadline or cancelled
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+
+class EmbeddingRequest:
+    """Texts waiting in the InferenceScheduler queue to be embedded; the future resolves to a float32 array."""
+    streamer = None
+    image = None
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class GenerationResult(str):
+    """
+    Reply text (a str, so callers can treat it as one) that also records why generation ended,
+    whether the reply was cut short, and how many tokens of the budget an early stop saved.
+    """
+    def __new__(cls, text, stop_reason=None, tokens_saved=0):
+        truncated = stop_reason in ("budget", "deadline")
+        result = super().__new__(cls, text + TRUNCATED_MARKER if truncated and text else text)
+        result.stop_reason = stop_reason
+        result.truncated = truncated
+        result.tokens_saved = tokens_saved
+        return result
+
+
+class RequestStoppingCriteria:
+    """
+    Stopping criterion evaluating each row's own stop conditions after every decoding step:
+    end of sequence, cancellation, token budget, deadline and stop strings. A row is finished as
+    soon as one fires, and the reason is recorded on its request.
+    """
+    TAIL_TOKENS = 4 # Stop strings are searched in the new tokens plus a few before them
+
+    def __init__(self, requests, tokenizer, prompt_length, eos_token_ids, started):
+        self.requests = requests
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.eos_token_ids = eos_token_ids
+        self._checked_length = prompt_length # Assisted decoding can append several tokens per step
+        self.deadlines = [
+            started + request.profile["deadline_seconds"] * DEADLINE_SCALE
+            if request.profile["deadline_seconds"] and DEADLINE_SCALE > 0 else None
+            for request in requests
+        ]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        now = time.perf_counter()
+        done = []
+        for row, request in enumerate(self.requests):
+            if request.stop_reason is None:
+                last_token = int(input_ids[row, -1])
+                stop_strings = request.profile["stop_strings"]
+                if last_token in self.eos_token_ids:
+                    request.stop_reason = "eos"
+                elif request.cancelled:
+                    request.stop_reason = "cancelled"
+                elif generated >= request.profile["max_new_tokens"]:
+                    request.stop_reason = "budget"
+                elif self.deadlines[row] is not None and now >= self.deadlines[row]:
+                    request.stop_reason = "deadline"
+                elif stop_strings:
+                    tail_start = max(self.prompt_length, self._checked_length - self.TAIL_TOKENS + 1)
+                    tail = self.tokenizer.decode(input_ids[row, tail_start:], skip_special_tokens=True)
+                    if any(stop in tail for stop in stop_strings):
+                        request.stop_reason = "stop_string"
+            done.append(request.stop_reason is not None)
+        self._checked_length = input_ids.shape[1]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class TimingStreamer:
+    """
+    Streamer that timestamps the first generated token, splitting a generate call into
+    prefill and decode. generate calls put() once with the prompt, then once per decoding
+    step; every call is forwarded to the wrapped streamer, if any.
+    """
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.first_token_at = None
+        self._puts = 0
+
+    def put(self, value):
+        self._puts += 1
+        if self._puts == 2:
+            self.first_token_at = time.perf_counter()
+        if self.inner is not None:
+            self.inner.put(value)
+
+    def end(self):
+        if self.inner is not None:
+            self.inner.end()
+
+
+class PrefixCache:
+    """
+    Prefilled past-key-values for the constant instruction prefix of each analysis type
+    (its PROMPT_TEMPLATES entry up to the last line break before {text}). A request starts
+    from a copy of the cached state, so prefill only runs over the user's text and the rest.
+    """
+    def __init__(self, model, tokenizer, device):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.hits = 0
+        self._entries = {} # analysis_type -> (prefix_text, prefix_ids, past_key_values)
+        self._disabled = set()
+
+    def prefill(self, analysis_type: str):
+        """Tokenizes and runs the model over the instruction prefix of `analysis_type` once."""
+        template = PROMPT_TEMPLATES[analysis_type]
+        head = template.split("{text}")[0]
+        # "Journal Entry: " and the like stay out of the prefix: their trailing space merges with
+        # the first word of the text ("Ġcalm"), so it cannot be tokenized apart from it
+        prefix_text = head[:head.rfind("\n") + 1]
+        # Only the tokens the prefix shares with a whole prompt are cached; tokenizers may still
+        # merge across the line break (e.g. trailing whitespace in byte-level BPE)
+        prefix_ids = self.tokenizer(prefix_text).input_ids
+        sample_ids = self.tokenizer(template.format(text="x")).input_ids
+        shared = 0
+        while shared < min(len(prefix_ids), len(sample_ids)) and prefix_ids[shared] == sample_ids[shared]:
+            shared += 1
+        if not shared:
+            raise ValueError("the prefix shares no tokens with the prompts")
+        prefix_ids = torch.tensor([sample_ids[:shared]], device=self.device)
+        # no_grad rather than inference_mode: generate later updates copies of this cache in place
+        with torch.no_grad():
+            outputs = self.model(input_ids=prefix_ids, use_cache=True)
+        self._entries[analysis_type] = (prefix_text, prefix_ids, outputs.past_key_values)
+
+    def prefill_all(self):
+        for analysis_type in PROMPT_TEMPLATES:
+            try:
+                self.prefill(analysis_type)
+            except Exception as e:
+                print(f"Prefix cache unavailable for '{analysis_type}': {e}")
+                self.disable(analysis_type)
+
+    def disable(self, analysis_type: str):
+        self._disabled.add(analysis_type)
+        self._entries.pop(analysis_type, None)
+
+    def build_inputs(self, analysis_type, prompt: str):
+        """Returns generate kwargs that resume from the cached prefix, or None if it cannot be used."""
+        if analysis_type not in PROMPT_TEMPLATES or analysis_type in self._disabled:
+            return None
+        if analysis_type not in self._entries:
+            self.prefill(analysis_type)
+        prefix_text, prefix_ids, past_key_values = self._entries[analysis_type]
+        if not prompt.startswith(prefix_text):
+            return None
+
+        # The whole prompt is tokenized (cheap next to prefill), so the model sees exactly the ids it
+        # would without the cache; the cached state covers their first prefix_ids.shape[1] tokens
+        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(self.device)
+        length = prefix_ids.shape[1]
+        if input_ids.shape[1] <= length or not torch.equal(input_ids[0, :length], prefix_ids[0]):
+            return None
+        self.hits += 1
+        return {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            # generate extends the cache in place, so every request works on its own copy
+            "past_key_values": copy.deepcopy(past_key_values),
+        }
+
+
+class InferenceScheduler:
+    """
+    Owns the model and tokenizer and runs every generate call on a single worker thread.
+    Requests submitted from any thread within `batch_window` seconds of each other are
+    grouped into one left-padded, batched generate call. Streaming requests run alone,
+    since a streamer follows a single sequence, and so do requests with a photo. Requests
+    dispatched on their own resume from the PrefixCache entry of their analysis type and, given
+    an `assistant_model`, are decoded speculatively: the draft proposes tokens and the model
+    verifies them in one pass. Vision encoder outputs are kept in `vision_cache` by photo digest.
+    """
+    def __init__(self, model, tokenizer, device, generation_kwargs=None, max_batch_size=8, batch_window=0.02,
+                 assistant_model=None, vision_cache=None):
+        self.model = model
+        self.vision_cache = vision_cache if vision_cache is not None else LRUCache(VISION_CACHE_SIZE)
+        # Older transformers only take pixel_values, and run the vision encoder on every generate call
+        self.accepts_image_features = "mm_encoder_outputs" in inspect.signature(model.forward).parameters
+        self.assistant_model = assistant_model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.generation_kwargs = generation_kwargs or GENERATION_KWARGS
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+
+        # Decoder-only models must be padded on the left so every row continues from its own prompt
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self.dtype = str(getattr(model, "dtype", "unknown")).replace("torch.", "")
+        eos_token_id = getattr(getattr(model, "generation_config", None), "eos_token_id", None)
+        eos_token_ids = eos_token_id if isinstance(eos_token_id, (list, tuple)) else [eos_token_id]
+        self.eos_token_ids = {token_id for token_id in eos_token_ids + [tokenizer.eos_token_id] if token_id is not None}
+        self.prefix_cache = PrefixCache(model, tokenizer, device)
+        self.stats = {"batches": 0, "requests": 0, "generated_tokens": 0, "generate_seconds": 0.0, "tokens_saved": 0}
+        if assistant_model is not None:
+            # Forward passes of both models are counted to derive the draft's acceptance rate
+            self.speculative_stats = {"calls": 0, "tokens": 0, "seconds": 0.0, "target_forwards": 0,
+                                      "draft_proposed": 0, "draft_accepted": 0}
+            self._forward_counts = {"target": 0, "draft": 0}
+            self._hooks = [
+                model.register_forward_hook(lambda *args: self._count_forward("target")),
+                assistant_model.register_forward_hook(lambda *args: self._count_forward("draft")),
+            ]
+        self._queue = queue.Queue()
+        self._deferred = [] # Streaming requests that arrived while a batch was being collected
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt: str, analysis_type=None, cancel_event=None, image=None) -> Future:
+        """Queues a prompt for (possibly batched) generation; the future resolves to the reply text."""
+        return self._enqueue(GenerationRequest(prompt, analysis_type=analysis_type, cancel_event=cancel_event, image=image))
+
+    def submit_stream(self, prompt: str, streamer, analysis_type=None, cancel_event=None, image=None) -> Future:
+        """
+        Queues a prompt whose tokens are pushed to `streamer`; the future resolves when generation ends
+        (with CancelledError if `cancel_event` was set first).
+        """
+        return self._enqueue(GenerationRequest(prompt, streamer=streamer, analysis_type=analysis_type,
+                                               cancel_event=cancel_event, image=image))
+
+    def submit_embedding(self, texts) -> Future:
+        """Queues texts to embed; the future resolves to a float32 array with one mean-pooled hidden state per text."""
+        return self._enqueue(EmbeddingRequest(list(texts)))
+
+    def tokens_per_second(self) -> float:
+        if not self.stats["generate_seconds"]:
+            return 0.0
+        return self.stats["generated_tokens"] / self.stats["generate_seconds"]
+
+    def speculative_report(self) -> dict:
+        """Draft acceptance rate and assisted decode throughput (empty without a draft model)."""
+        if self.assistant_model is None:
+            return {}
+        stats = self.speculative_stats
+        return {
+            "assisted_calls": stats["calls"],
+            "acceptance_rate": stats["draft_accepted"] / stats["draft_proposed"] if stats["draft_proposed"] else 0.0,
+            "tokens_per_target_forward": stats["tokens"] / stats["target_forwards"] if stats["target_forwards"] else 0.0,
+            "assisted_tokens_per_second": stats["tokens"] / stats["seconds"] if stats["seconds"] else 0.0,
+            "overall_tokens_per_second": self.tokens_per_second(),
+        }
+
+    def _count_forward(self, which):
+        self._forward_counts[which] += 1
+
+    def shutdown(self):
+        """Stops the worker after the requests already queued have been served."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join(timeout=5.0)
+            # The models outlive the scheduler when they are offloaded and reloaded
+            for hook in getattr(self, "_hooks", ()):
+                hook.remove()
+
+    def _enqueue(self, request):
+        if self._closed:
+            raise RuntimeError("Inference scheduler has been shut down.")
+        self._queue.put(request)
+        return request.future
+
+    def _run(self):
+        # Prefill the instruction prefixes before serving, while the worker is otherwise idle
+        self.prefix_cache.prefill_all()
+        stopping = False
+        while True:
+            if self._deferred:
+                first = self._deferred.pop(0)
+            elif stopping:
+                break
+            else:
+                first = self._queue.get()
+                if first is None:
+                    break
+            if isinstance(first, EmbeddingRequest):
+                self._embed(first)
+                continue
+            if first.streamer is not None or first.image is not None:
+                self._dispatch([first])
+                continue
+            batch, stopping = self._collect_batch(first)
+            self._dispatch(batch)
+
+    def _collect_batch(self, first):
+        """Gathers text-only, non-streaming requests that arrive within the batching window after `first`."""
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            if request.streamer is not None or request.image is not None or isinstance(request, EmbeddingRequest):
+                self._deferred.append(request)
+                continue
+            batch.append(request)
+        return batch, False
+
+    def _dispatch(self, batch):
+        # Requests cancelled while they were queued never reach the model
+        for request in [request for request in batch if request.cancelled]:
+            self._cancel(request, stage="queued")
+            batch.remove(request)
+        if not batch:
+            return
+        started = time.perf_counter()
+        streamer = batch[0].streamer
+        labels = {
+            "analysis": (batch[0].analysis_type or "none") if len(batch) == 1 else "batched",
+            "batch_size": len(batch),
+            "device": self.device,
+            "dtype": self.dtype,
+        }
+        for request in batch:
+            metrics.REGISTRY.observe("queue_wait", started - request.enqueued_at, **labels)
+        try:
+            new_tokens = None
+            # Left padding would shift the user text away from a cached prefix, so only
+            # requests dispatched alone resume from the prefix cache
+            image = batch[0].image
+            if len(batch) == 1 and image is None:
+                analysis_type = batch[0].analysis_type
+                with metrics.REGISTRY.span("tokenize", **labels):
+                    inputs = self.prefix_cache.build_inputs(analysis_type, batch[0].prompt)
+                metrics.REGISTRY.increment("prefix_cache_lookups", result="hit" if inputs is not None else "miss", **labels)
+                if inputs is not None:
+                    try:
+                        new_tokens = self._generate(inputs, streamer, labels, batch)
+                    except Exception as e:
+                        print(f"Prefix cache disabled for '{analysis_type}': {e}")
+                        self.prefix_cache.disable(analysis_type)
+                        if streamer is not None:
+                            raise # Part of the reply may already have been streamed
+            if new_tokens is None:
+                with metrics.REGISTRY.span("tokenize", **labels):
+                    inputs = self.tokenizer(
+                        [request.prompt for request in batch], return_tensors="pt", padding=True
+                    ).to(self.device)
+                if image is not None:
+                    inputs.update(self._image_inputs(image, labels))
+                new_tokens = self._generate(inputs, streamer, labels, batch)
+            with metrics.REGISTRY.span("postprocess", **labels):
+                responses = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        except Exception as e:
+            metrics.REGISTRY.increment("generation_errors", **labels)
+            for request in batch:
+                if request.streamer is not None:
+                    request.streamer.end() # Unblock the consumer iterating the streamer
+                request.future.set_exception(e)
+            return
+
+        row_tokens = (new_tokens != self.tokenizer.pad_token_id).sum(dim=1).tolist()
+        output_tokens = int(sum(row_tokens))
+        metrics.REGISTRY.increment("input_tokens", int(inputs["attention_mask"].sum()), **labels)
+        metrics.REGISTRY.increment("output_tokens", output_tokens, **labels)
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        self.stats["generated_tokens"] += output_tokens
+        self.stats["generate_seconds"] += time.perf_counter() - started
+        for request, response, generated in zip(batch, responses, row_tokens):
+            if request.cancelled:
+                self._cancel(request, stage="generating")
+                continue
+            budget = min(request.profile["max_new_tokens"], self.generation_kwargs.get("max_new_tokens", 200))
+            if request.stop_reason is None:
+                # generate's own length limit ended the row before the criteria saw it
+                request.stop_reason = "budget" if generated >= budget else "eos"
+            tokens_saved = max(0, budget - generated) if request.stop_reason in ("stop_string", "deadline") else 0
+            analysis = request.analysis_type or "none"
+            metrics.REGISTRY.increment("generation_stops", analysis=analysis, reason=request.stop_reason)
+            if tokens_saved:
+                self.stats["tokens_saved"] += tokens_saved
+                metrics.REGISTRY.increment("tokens_saved", tokens_saved, analysis=analysis, reason=request.stop_reason)
+            request.future.set_result(GenerationResult(response.strip(), request.stop_reason, tokens_saved))
+
+    def _image_inputs(self, image, labels):
+        """generate kwargs for a photo: its cached vision encoder output, or its pixels on older transformers."""
+        def pixel_values():
+            return torch.from_numpy(image.pixel_values).unsqueeze(0).to(self.device, self.model.dtype)
+
+        if not self.accepts_image_features:
+            return {"pixel_values": pixel_values()}
+        features = self.vision_cache.get(image.digest)
+        metrics.REGISTRY.increment("vision_cache_lookups", result="hit" if features is not None else "miss", **labels)
+        if features is None:
+            with metrics.REGISTRY.span("vision_encode", **labels), torch.no_grad():
+                features = self.model.get_image_features(pixel_values(), return_dict=True).pooler_output
+            features = features.to("cpu") # Kept off the GPU, and valid across model unloads
+            self.vision_cache.put(image.digest, features)
+        return {"mm_encoder_outputs": {"image": BaseModelOutputWithPooling(pooler_output=features.to(self.device))}}
+
+    def _embed(self, request):
+        """Runs one forward pass over the request's texts and mean-pools a middle-to-late layer's hidden states."""
+        labels = {"batch_size": len(request.texts), "device": self.device, "dtype": self.dtype}
+        metrics.REGISTRY.observe("queue_wait", time.perf_counter() - request.enqueued_at, analysis="embedding", **labels)
+        try:
+            with metrics.REGISTRY.span("embed", **labels):
+                inputs = self.tokenizer(request.texts, return_tensors="pt", padding=True, truncation=True,
+                                        max_length=EMBEDDING_MAX_TOKENS, return_special_tokens_mask=True).to(self.device)
+                # Special tokens (BOS, padding) say nothing about the text and BOS states have outsized norms
+                mask = (inputs.pop("special_tokens_mask") == 0) & (inputs["attention_mask"] == 1)
+                with torch.inference_mode():
+                    hidden_states = self.model(**inputs, output_hidden_states=True).hidden_states
+                    hidden = hidden_states[round((len(hidden_states) - 1) * EMBEDDING_LAYER_FRACTION)].float()
+                    weights = mask.unsqueeze(-1).float()
+                    pooled = (hidden * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1.0)
+            request.future.set_result(pooled.cpu().numpy())
+        except Exception as e:
+            metrics.REGISTRY.increment("generation_errors", analysis="embedding", **labels)
+            request.future.set_exception(e)
+
+    def _cancel(self, request, stage):
+        metrics.REGISTRY.increment("generation_cancelled", stage=stage, analysis=request.analysis_type or "none")
+        if stage == "queued" and request.streamer is not None:
+            request.streamer.end() # Unblock the consumer iterating the streamer
+        request.future.set_exception(CancelledError())
+
+    def _generate(self, inputs, streamer, labels, requests=()):
+        """Runs generate, recording prefill (up to the first new token) and decode times under `labels`."""
+        timing = TimingStreamer(streamer)
+        started = time.perf_counter()
+        generation_kwargs = dict(self.generation_kwargs)
+        if requests:
+            # The batch decodes for as long as its largest budget; smaller ones stop their rows early
+            generation_kwargs["max_new_tokens"] = min(
+                generation_kwargs.get("max_new_tokens", 200), max(request.profile["max_new_tokens"] for request in requests)
+            )
+            prompt_length = inputs["input_ids"].shape[1]
+            generation_kwargs["stopping_criteria"] = StoppingCriteriaList([
+                RequestStoppingCriteria(requests, self.tokenizer, prompt_length, self.eos_token_ids, started)
+            ])
+        # Assisted generation verifies one sequence at a time; with sampling it uses speculative
+        # sampling, so replies follow the same distribution as without the draft. The draft is
+        # text-only, so requests with a photo decode without it
+        assisted = self.assistant_model is not None and inputs["input_ids"].shape[0] == 1 \
+            and not any(request.image is not None for request in requests)
+        if assisted:
+            generation_kwargs["assistant_model"] = self.assistant_model
+            forwards_before = dict(self._forward_counts)
+        generated_ids = self.model.generate(
+            **inputs,
+            streamer=timing,
+            pad_token_id=self.tokenizer.pad_token_id,
+            **generation_kwargs,
+        )
+        finished = time.perf_counter()
+        first_token_at = timing.first_token_at or finished
+        metrics.REGISTRY.observe("prefill", first_token_at - started, **labels)
+        metrics.REGISTRY.observe("decode", finished - first_token_at, **labels)
+        if assisted:
+            self._record_assisted(generated_ids.shape[1] - inputs["input_ids"].shape[1], forwards_before, finished - started)
+        # Keep only the newly generated tokens of each row
+        return generated_ids[:, inputs["input_ids"].shape[1]:]
+
+    def _record_assisted(self, new_tokens, forwards_before, seconds):
+        # Every target forward pass verifies the pending draft tokens and contributes one token of its
+        # own, so tokens beyond the number of target passes are draft tokens that were accepted
+        target_forwards = self._forward_counts["target"] - forwards_before["target"]
+        proposed = self._forward_counts["draft"] - forwards_before["draft"]
+        accepted = min(proposed, max(0, new_tokens - target_forwards))
+        stats = self.speculative_stats
+        stats["calls"] += 1
+        stats["tokens"] += new_tokens
+        stats["seconds"] += seconds
+        stats["target_forwards"] += target_forwards
+        stats["draft_proposed"] += proposed
+        stats["draft_accepted"] += accepted
+        metrics.REGISTRY.increment("draft_tokens_proposed", proposed)
+        metrics.REGISTRY.increment("draft_tokens_accepted", accepted)
+        if stats["draft_proposed"]:
+            metrics.REGISTRY.set_gauge("draft_acceptance_rate", stats["draft_accepted"] / stats["draft_proposed"])
 
 
 class MindGuardian:
@@ -17,95 +670,663 @@ class MindGuardian:
     The main class that encapsulates the application's logic,
     using a local Gemma model via transformers.
     """
-    def __init__(self):
+    def __init__(self, deterministic=None, registry=None, model=None, tokenizer=None, cache_responses=None,
+                 max_batch_size=8, draft_model=None, idle_unload_seconds=None, memory_budget_bytes=None):
+        """
+        `model` and `tokenizer` inject pre-built components (e.g. the tiny stand-in model used by
+        benchmark.py) instead of loading Gemma. `cache_responses` defaults to `deterministic`.
+        `max_batch_size` caps how many requests the scheduler folds into one generate call.
+        `draft_model` injects a draft for speculative decoding; otherwise MIND_GUARDIAN_DRAFT_MODEL is loaded.
+        `idle_unload_seconds` and `memory_budget_bytes` override the memory_manager defaults (0 disables).
+        """
         print("Initializing Mind Guardian with local Gemma model...")
+        metrics.configure_from_env()
+        import_dependencies()
         self.tokenizer = None
         self.model = None
+        self.scheduler = None
+        self.draft_model = draft_model
+        self.cpu_config = None # Set when the model is loaded through the CPU inference path
+        self.load_seconds = None
+        self.memory = None # ModelMemoryManager, once a model is loaded
+        self.model_id = None # Identity of the loaded weights and their configuration (see _model_identity)
+        self._registry = registry
+        self._checkpoint_path = None # Gemma checkpoint the model is reloaded from; None for injected models
+        self._draft_from_env = False
+        self._offload_dir = None # Memory-mappable copy of injected models, written on their first unload
+        # Optional callable(text) -> list of the user's similar past entries (e.g. SimilarEntries.related),
+        # added to journal and transcript prompts so reflections can notice recurring patterns
+        self.related_entries = None
+        # Optional callable() -> a value that changes whenever related_entries may answer differently
+        # (e.g. SimilarEntries.version). With it, the cache is checked before the entries are looked up
+        self.related_entries_version = None
+        # Photos for moment analyses: decoded once per content hash by the pipeline (created on first
+        # use), encoded once per content hash by the vision encoder
+        self.image_pipeline = None
+        self._image_pipeline_lock = threading.Lock()
+        self.vision_cache = LRUCache(VISION_CACHE_SIZE)
+        self.image_tokens = None # Text standing for one photo in a prompt; None without a vision encoder
+        self.max_batch_size = max_batch_size
+        self.deterministic = DETERMINISTIC_GENERATION if deterministic is None else deterministic
+        self.generation_kwargs = DETERMINISTIC_GENERATION_KWARGS if self.deterministic else GENERATION_KWARGS
+        # Sampled replies differ on every run, so caching them is only meaningful in deterministic mode
+        cache_responses = self.deterministic if cache_responses is None else cache_responses
+        self.response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_DIR) if cache_responses else None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"Using device: {self.device}")
 
+        if model is not None and tokenizer is not None:
+            self.model = model.to(self.device)
+            self.tokenizer = tokenizer
+            if self.draft_model is not None:
+                self.draft_model = self.draft_model.to(self.device)
+            self.model_id = self._model_identity()
+            self._start_scheduler()
+            self._start_memory_manager(idle_unload_seconds, memory_budget_bytes)
+            print("🤖 Using the provided model and tokenizer.")
+            return
+
         try:
-            # Download the Gemma model using kagglehub
-            print(f"Attempting to download Gemma model from KaggleHub using path: google/gemma-3n/transformers/gemma-3n-e2b ...")
-            GEMMA_PATH = kagglehub.model_download("google/gemma-3n/transformers/gemma-3n-e2b")
-            print(f"Model downloaded to: {GEMMA_PATH}")
-
-            # Load the tokenizer and model using transformers
-            print("Loading tokenizer and model...")
-            # Attempt to load the model with 8-bit quantization for potential speedup
-            # Requires bitsandbytes and accelerate libraries installed.
+            self._load_gemma()
+            self.model_id = self._model_identity()
+            self._start_scheduler()
+            self._start_memory_manager(idle_unload_seconds, memory_budget_bytes)
+            print("🤖 Local Gemma model loaded successfully.")
+
+        except Exception as e:
+            print(f"❌ Critical Error: Failed to download or load the local model with or without quantization. {e}")
+            self.tokenizer = None
+            self.model = None
+            self.scheduler = None
+            metrics.REGISTRY.set_gauge("model_loaded", 0, device=self.device)
+
+    @property
+    def available(self) -> bool:
+        """True once a model was loaded, whether it is resident now or will be reloaded on use."""
+        return self.tokenizer is not None and self.memory is not None
+
+    def _load_gemma(self):
+        """Loads the Gemma model (and the draft, when configured); also used to reload it after an unload."""
+        # Resolve the Gemma checkpoint through the local registry; it only downloads
+        # from KaggleHub when no verified local copy is registered
+        registry = self._registry = self._registry or ModelRegistry()
+        GEMMA_PATH = registry.resolve(GEMMA_MODEL_HANDLE)
+        self._checkpoint_path = GEMMA_PATH
+        # Safetensors checkpoints are memory-mapped on load, so processes on one host share
+        # the page cache instead of each reading a private copy of the weights
+        load_kwargs = dict(local_files_only=True, low_cpu_mem_usage=True)
+        if has_safetensors(GEMMA_PATH):
+            load_kwargs["use_safetensors"] = True
+
+        # Load the tokenizer and model using transformers
+        print("Loading tokenizer and model...")
+        # Attempt to load the model with 8-bit quantization for potential speedup
+        # Requires bitsandbytes and accelerate libraries installed.
+        load_started = time.perf_counter()
+        with profiling.phase("model load"):
             if bitsandbytes and accelerate and torch.cuda.is_available():
                 print("Attempting to load model with 8-bit quantization...")
                 self.model = AutoModelForCausalLM.from_pretrained(
                     GEMMA_PATH,
                     load_in_8bit=True, # Enable 8-bit quantization
-                    torch_dtype=torch.float16 # Often used with 8-bit loading
+                    torch_dtype=torch.float16, # Often used with 8-bit loading
+                    **load_kwargs
                 ).to(self.device)
                 print("Model loaded with 8-bit quantization.")
+            elif self.device == "cpu":
+                # CPU-only hosts: int8 dynamic quantization or the fastest float dtype, with pinned threads
+                self.model, self.cpu_config = load_cpu_model(AutoModelForCausalLM, GEMMA_PATH, load_kwargs)
+                print(f"Model loaded for CPU inference. {self.cpu_config.describe()}")
             else:
-                print("bitsandbytes, accelerate, or CUDA not available. Loading model without 8-bit quantization.")
+                print("bitsandbytes or accelerate not available. Loading model without 8-bit quantization.")
                 # Load without quantization if libraries or CUDA are not available
                 # Keep torch_dtype=torch.bfloat16 as before, or consider torch.float32
-                self.model = AutoModelForCausalLM.from_pretrained(GEMMA_PATH, torch_dtype=torch.bfloat16).to(self.device)
+                self.model = AutoModelForCausalLM.from_pretrained(GEMMA_PATH, torch_dtype=torch.bfloat16, **load_kwargs).to(self.device)
                 print("Model loaded without quantization.")
 
-            self.tokenizer = AutoTokenizer.from_pretrained(GEMMA_PATH)
-            print("🤖 Local Gemma model loaded successfully.")
+        if self.draft_model is None and DRAFT_MODEL:
+            self.draft_model = self._load_draft_model(DRAFT_MODEL, registry, load_kwargs)
+            self._draft_from_env = self.draft_model is not None
+        self.load_seconds = time.perf_counter() - load_started
+
+        if self.tokenizer is None:
+            with profiling.phase("tokenizer load"):
+                self.tokenizer = AutoTokenizer.from_pretrained(GEMMA_PATH, local_files_only=True)
 
+    def _model_identity(self) -> str:
+        """
+        What cached replies are keyed on besides the prompt: the checkpoint's contents (its registry
+        fingerprint; for injected models their class, config and a sample of their weights) plus the
+        device and dtype or quantization it runs in. Computed once, before the model is ever unloaded.
+        """
+        if self._checkpoint_path is not None:
+            weights = self._registry.fingerprint(GEMMA_MODEL_HANDLE) or os.path.abspath(self._checkpoint_path)
+            weights = f"{GEMMA_MODEL_HANDLE}@{weights}"
+        else:
+            digest = hashlib.sha256(self.model.config.to_json_string(use_diff=False).encode("utf-8"))
+            for name, tensor in self.model.state_dict().items():
+                if torch.is_tensor(tensor) and tensor.numel():
+                    digest.update(f"{name}{tensor.detach().flatten()[:8].float().tolist()}".encode("utf-8"))
+            weights = f"{type(self.model).__name__}@{digest.hexdigest()}"
+        if self.cpu_config is not None:
+            mode = self.cpu_config.mode
+        elif getattr(self.model, "is_loaded_in_8bit", False):
+            mode = "int8"
+        else:
+            mode = str(self.model.dtype).replace("torch.", "")
+        return f"{weights}/{self.device}-{mode}"
+
+    def _load_draft_model(self, handle, registry, load_kwargs):
+        """Loads the speculative decoding draft; returns None (plain decoding) if it is unusable."""
+        try:
+            with profiling.phase("draft model load"):
+                path = handle if os.path.isdir(handle) else registry.resolve(handle)
+                load_kwargs = dict(load_kwargs)
+                if has_safetensors(path):
+                    load_kwargs["use_safetensors"] = True
+                else:
+                    load_kwargs.pop("use_safetensors", None)
+                if self.device == "cpu":
+                    draft, _ = load_cpu_model(AutoModelForCausalLM, path, load_kwargs)
+                else:
+                    draft = AutoModelForCausalLM.from_pretrained(path, torch_dtype=self.model.dtype, **load_kwargs).to(self.device)
         except Exception as e:
-            print(f"❌ Critical Error: Failed to download or load the local model with or without quantization. {e}")
-            self.tokenizer = None
-            self.model = None
+            print(f"Draft model {handle} could not be loaded; decoding without it. {e}")
+            return None
+        # Assisted decoding compares token ids directly, so both models must share one vocabulary
+        target_vocab = self.model.get_output_embeddings().weight.shape[0]
+        draft_vocab = draft.get_output_embeddings().weight.shape[0]
+        if draft_vocab != target_vocab:
+            print(f"Draft model {handle} has a different vocabulary ({draft_vocab} vs {target_vocab}); decoding without it.")
+            return None
+        print(f"Speculative decoding enabled with draft model {handle}.")
+        return draft
+
+    def _start_scheduler(self):
+        # From here on all generation goes through the scheduler, which owns the model
+        self.scheduler = InferenceScheduler(
+            self.model, self.tokenizer, self.device, self.generation_kwargs, max_batch_size=self.max_batch_size,
+            assistant_model=self.draft_model, vision_cache=self.vision_cache,
+        )
+        self.image_tokens = self._image_token_sequence()
+        metrics.REGISTRY.set_gauge("model_loaded", 1, device=self.device, dtype=self.scheduler.dtype)
+        if self.load_seconds is not None:
+            metrics.REGISTRY.set_gauge("model_load_seconds", self.load_seconds, device=self.device, dtype=self.scheduler.dtype)
+
+    def _image_token_sequence(self):
+        """The image token sequence of the model's processor (Gemma 3n), or None when it cannot see photos."""
+        config = self.model.config
+        token_ids = [getattr(config, name, None) for name in ("boi_token_id", "image_token_id", "eoi_token_id")]
+        if not hasattr(self.model, "get_image_features") or None in token_ids:
+            return None
+        begin, image, end = self.tokenizer.convert_ids_to_tokens(token_ids)
+        return f"\n\n{begin}{image * getattr(config, 'vision_soft_tokens_per_image', 256)}{end}\n\n"
+
+    @property
+    def supports_images(self) -> bool:
+        return self.image_tokens is not None
+
+    def prepare_image(self, path):
+        """Decodes, downscales and normalizes a photo into a PreparedImage; meant for a worker thread."""
+        with self._image_pipeline_lock:
+            if self.image_pipeline is None:
+                self.image_pipeline = ImagePipeline(**self._image_settings())
+        return self.image_pipeline.prepare(path)
+
+    def _image_settings(self) -> dict:
+        """Normalization from the checkpoint's image processor config, when it has one."""
+        for name in ("preprocessor_config.json", "processor_config.json"):
+            path = os.path.join(self._checkpoint_path, name) if self._checkpoint_path else None
+            if path and os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                config = config.get("image_processor", config)
+                if "image_mean" in config and "image_std" in config:
+                    return {"mean": config["image_mean"], "std": config["image_std"]}
+        return {}
+
+    def _start_memory_manager(self, idle_unload_seconds, memory_budget_bytes):
+        budget = MEMORY_BUDGET_BYTES if memory_budget_bytes is None else memory_budget_bytes
+        footprint = model_bytes(self.model)
+        if budget and footprint > budget:
+            print(f"The model alone takes {footprint / 2**20:.0f} MiB, over the {budget / 2**20:.0f} MiB memory budget; "
+                  f"it will be unloaded whenever it is idle.")
+        self.memory = ModelMemoryManager(
+            self._unload_model, self._reload_model,
+            # On a GPU the budget applies to VRAM, which is what unloading frees there
+            measure=torch.cuda.memory_allocated if self.device == "cuda" else resident_bytes,
+            idle_timeout=IDLE_UNLOAD_SECONDS if idle_unload_seconds is None else idle_unload_seconds,
+            budget_bytes=budget,
+        )
+
+    def _offloads_to_cpu(self) -> bool:
+        # On a GPU, moving the weights to CPU RAM frees the VRAM and makes the reload a plain copy back;
+        # bitsandbytes 8-bit models cannot be moved, so they are unloaded like CPU models
+        return self.device == "cuda" and not getattr(self.model, "is_loaded_in_8bit", False)
+
+    def _reloads_from_snapshot(self) -> bool:
+        # Injected models have no checkpoint to reload from, and reloading an int8 CPU model from its
+        # checkpoint would mean a float load at ~2x the model's size plus quantizing again: both are
+        # written once to a snapshot that can be memory-mapped (see process_pool.load_shared_model)
+        return self._checkpoint_path is None or bool(self.cpu_config and self.cpu_config.quantized)
+
+    def _unload_model(self):
+        """Called by the memory manager while no analysis is running."""
+        self.scheduler.shutdown() # The scheduler and its prefix cache hold references to the model
+        self.scheduler = None
+        if self._offloads_to_cpu():
+            self.model.to("cpu")
+            if self.draft_model is not None:
+                self.draft_model.to("cpu")
+            torch.cuda.empty_cache()
+            return
+        if self._reloads_from_snapshot() and self._offload_dir is None:
+            self._offload_dir = tempfile.mkdtemp(prefix="mind_guardian_offload_")
+            export_shared_snapshot(self.model, self.tokenizer, self._offload_dir)
+            if self.draft_model is not None:
+                export_shared_snapshot(self.draft_model, self.tokenizer, os.path.join(self._offload_dir, "draft"))
+        self.model = None
+        if self._reloads_from_snapshot() or self._draft_from_env:
+            self.draft_model = None # An injected draft kept alongside a float Gemma checkpoint stays resident
+        gc.collect()
+
+    def _reload_model(self):
+        """Called by the memory manager on the first analysis after an unload."""
+        with profiling.phase("model reload"):
+            if self.model is not None: # Offloaded to CPU RAM
+                self.model.to(self.device)
+                if self.draft_model is not None:
+                    self.draft_model.to(self.device)
+            elif self._reloads_from_snapshot():
+                self.model = load_shared_model(self._offload_dir).to(self.device)
+                draft_dir = os.path.join(self._offload_dir, "draft")
+                if os.path.isdir(draft_dir):
+                    self.draft_model = load_shared_model(draft_dir).to(self.device)
+            else:
+                self._load_gemma()
+        self._start_scheduler()
+
+    def close(self):
+        """Stops the inference scheduler worker and the memory manager."""
+        if self.memory:
+            self.memory.close()
+        if self.scheduler:
+            self.scheduler.shutdown()
+        if self._offload_dir:
+            shutil.rmtree(self._offload_dir, ignore_errors=True)
+            self._offload_dir = None
 
 
     def analyze_journal(self, journal_text: str) -> str:
-        if not self.model or not self.tokenizer:
-            return "Sorry, the AI service is currently unavailable."
-        prompt = f"Provide a gentle, non-judgemental reflection on the following journal entry, identifying potential thought patterns in a supportive way.\n\nJournal Entry: {journal_text}\n\nReflection:"
-        return self._generate_response(prompt)
+        if not self.available:
+            return UNAVAILABLE_MESSAGE
+        return self._analyze("journal", journal_text)
 
 
     def analyze_audio_transcript(self, transcript_text: str) -> str:
-        if not self.model or not self.tokenizer:
-            return "Sorry, the AI service is currently unavailable."
-        prompt = f"Analyze the following audio transcript to infer the emotional state and respond empathetically.\n\nAudio Transcript: {transcript_text}\n\nEmotional State Analysis:"
-        return self._generate_response(prompt)
+        if not self.available:
+            return UNAVAILABLE_MESSAGE
+        return self._analyze("audio_transcript", transcript_text)
 
 
-    def analyze_moment(self, moment_description: str) -> str:
-        if not self.model or not self.tokenizer:
-            return "Sorry, the AI service is currently unavailable."
-        prompt = f"Analyze the following visual moment description and ask a gentle, open-ended question to help the user explore the feeling connected to this moment.\n\nVisual Moment Description: {moment_description}\n\nQuestion:"
-        return self._generate_response(prompt)
+    def analyze_moment(self, moment_description: str, image=None) -> str:
+        """`image` is an optional photo of the moment: a path or a PreparedImage from prepare_image()."""
+        if not self.available:
+            return UNAVAILABLE_MESSAGE
+        return self._analyze("moment", moment_description, image)
 
-    def _generate_response(self, prompt: str) -> str:
-        """Helper method to generate text using the loaded transformers model."""
+    def analyze_batch(self, analysis_type: str, texts) -> list:
+        """
+        Analyzes many texts of one type at once. All prompts are queued together, so the scheduler
+        folds consecutive ones into batched generate calls; results come back in input order.
+        """
+        texts = list(texts)
+        if not self.available:
+            return [UNAVAILABLE_MESSAGE] * len(texts)
+
+        results = [None] * len(texts)
+        keys = [self._cache_key(analysis_type, text) for text in texts] if self.response_cache else None
+        misses = []
+        for i, text in enumerate(texts):
+            cached = self.response_cache.get(keys[i]) if keys else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                misses.append(i)
+        if not misses:
+            return results # Answered from the cache without touching (or reloading) the model
         try:
-            if not self.model or not self.tokenizer:
-                 return "AI model not loaded."
-
-            # Tokenize the prompt
-            input_ids = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-
-            # Generate response
-            generated_ids = self.model.generate(
-                **input_ids,
-                max_new_tokens=200,
-                do_sample=True,
-                temperature=0.7,
-                top_k=50,
-                top_p=0.95,
-                num_return_sequences=1,
-            )
+            with self.memory.in_use():
+                condensed = self._condense(analysis_type, [texts[i] for i in misses])
+                futures = {i: self.scheduler.submit(self._build_prompt(analysis_type, text), analysis_type)
+                           for i, (text, _) in zip(misses, condensed)}
+                for i, future in futures.items():
+                    try:
+                        results[i] = future.result()
+                        if keys and is_cacheable(results[i]):
+                            self.response_cache.put(keys[i], results[i])
+                    except Exception as e:
+                        results[i] = f"An error occurred during text generation: {e}"
+        except Exception as e: # Reloading the model or summarizing long inputs failed
+            for i in misses:
+                results[i] = f"An error occurred during text generation: {e}"
+        return results
+
+    def embed(self, texts):
+        """Embeddings of `texts` from the model's hidden states (float32 NumPy array, one row per text)."""
+        with self.memory.in_use():
+            return self.scheduler.submit_embedding(texts).result()
+
+    def count_tokens(self, texts) -> list:
+        """Token count of each text on its own (no special tokens)."""
+        return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    def plan_input(self, text: str) -> dict:
+        """
+        How an input will be analyzed, without generating: {"strategy": "direct"} or {"strategy": "map_reduce",
+        "chunks": n} for inputs over MAX_DIRECT_TOKENS, plus "input_tokens".
+        """
+        tokens = self.count_tokens([text])[0]
+        if tokens <= MAX_DIRECT_TOKENS:
+            return {"strategy": "direct", "input_tokens": tokens}
+        return {"strategy": "map_reduce", "input_tokens": tokens, "chunks": len(chunk_text(text, self.count_tokens, CHUNK_TOKENS))}
+
+    def _condense(self, analysis_type: str, texts, cancel_event=None) -> list:
+        """
+        (text for the final prompt, plan) for each input. Inputs over MAX_DIRECT_TOKENS are replaced by
+        summaries of their chunks; the chunks of all of them are queued together, so the scheduler
+        summarizes them in batched generate calls. Raises if a summary fails or is cancelled.
+        """
+        texts = list(texts)
+        tokens = self.count_tokens(texts)
+        plans = [{"strategy": "direct", "input_tokens": count} for count in tokens]
+        long_inputs = [i for i, count in enumerate(tokens) if count > MAX_DIRECT_TOKENS]
+        if long_inputs:
+            with self.memory.in_use():
+                self._summarize_long_inputs(analysis_type, texts, tokens, plans, long_inputs, cancel_event)
+        for i, plan in enumerate(plans):
+            if plan["strategy"] == "map_reduce":
+                texts[i] = f"(A long text, summarized part by part.)\n\n{texts[i]}"
+            metrics.REGISTRY.increment("analysis_strategy", analysis=analysis_type, strategy=plan["strategy"])
+        return list(zip(texts, plans))
+
+    def _summarize_long_inputs(self, analysis_type, texts, tokens, plans, long_inputs, cancel_event):
+        """Map step of _condense: replaces texts[i] of every long input by its chunk summaries, in place."""
+        levels = 0
+        previous = {i: tokens[i] for i in long_inputs} # Token count of each input before the current level
+        while long_inputs:
+            levels += 1
+            chunks = {i: chunk_text(texts[i], self.count_tokens, CHUNK_TOKENS) for i in long_inputs}
+            with metrics.REGISTRY.span("map_summaries", analysis=analysis_type, level=levels):
+                futures = {i: [self.scheduler.submit(self._build_prompt("chunk_summary", chunk), "chunk_summary", cancel_event)
+                               for chunk in chunks[i]] for i in long_inputs}
+                for i in long_inputs:
+                    summaries = [future.result().strip() for future in futures[i]]
+                    texts[i] = "\n\n".join(f"Part {number} of {len(summaries)}: {summary}" for number, summary in enumerate(summaries, 1))
+                    if levels == 1:
+                        plans[i] = {"strategy": "map_reduce", "input_tokens": tokens[i], "chunks": len(chunks[i])}
+                        metrics.REGISTRY.increment("long_input_chunks", len(chunks[i]), analysis=analysis_type)
+                    plans[i]["levels"] = levels
+            # The summaries of a very long input can themselves be too long; they are reduced again while
+            # that makes progress, and cut to MAX_DIRECT_TOKENS once it does not
+            still_long = self.count_tokens([texts[i] for i in long_inputs])
+            reduced = []
+            for i, count in zip(long_inputs, still_long):
+                if count <= MAX_DIRECT_TOKENS:
+                    continue
+                if levels < MAX_REDUCE_LEVELS and count < previous[i]:
+                    reduced.append(i)
+                else:
+                    texts[i] = self._truncate_tokens(texts[i], MAX_DIRECT_TOKENS)
+                    plans[i]["truncated"] = True
+                    metrics.REGISTRY.increment("long_input_truncations", analysis=analysis_type)
+                previous[i] = count
+            long_inputs = reduced
+
+    def _truncate_tokens(self, text: str, limit: int) -> str:
+        """The first `limit` tokens of `text`."""
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+        return self.tokenizer.decode(ids[:limit])
+
+    # Streaming variants: each yields the reflection as text deltas while it is decoded, and returns
+    # the stop reason (see COMPLETE_STOP_REASONS). Error messages are yielded as text too, so only the
+    # stop reason tells a whole reply apart. Setting `cancel_event` stops generation early.
+
+    def stream_journal(self, journal_text: str, cancel_event=None):
+        return self._stream_analysis("journal", journal_text, cancel_event)
+
+    def stream_audio_transcript(self, transcript_text: str, cancel_event=None):
+        return self._stream_analysis("audio_transcript", transcript_text, cancel_event)
+
+    def stream_moment(self, moment_description: str, cancel_event=None, image=None):
+        return self._stream_analysis("moment", moment_description, cancel_event, image)
+
+    def _analyze(self, analysis_type: str, text: str, image=None) -> str:
+        version = self._context_version(analysis_type)
+        context = self._related_context(analysis_type, text) if version is None else None
+        with metrics.REGISTRY.span("analysis", analysis=analysis_type, mode="blocking") as labels:
+            try:
+                image = self._resolve_image(analysis_type, image)
+            except ImageError as e:
+                return f"An error occurred while reading the photo: {e}"
+            if not self.response_cache:
+                labels["cache"] = "off"
+                if context is None:
+                    context = self._related_context(analysis_type, text)
+                try:
+                    prompt, plan = self._prepare_prompt(analysis_type, text, context, labels, image=image)
+                except Exception as e:
+                    return f"An error occurred during text generation: {e}"
+                response = self._generate_response(prompt, analysis_type, image)
+                if isinstance(response, GenerationResult):
+                    response.plan = plan # Reports the chosen strategy to callers of analyze_*
+                return response
+
+            computed = []
+            def compute():
+                computed.append(True)
+                prompt_context = self._related_context(analysis_type, text) if context is None else context
+                prompt, plan = self._prepare_prompt(analysis_type, text, prompt_context, labels, image=image)
+                with self.memory.in_use():
+                    response = self.scheduler.submit(prompt, analysis_type, image=image).result()
+                response.plan = plan
+                return response
+
+            try:
+                # Identical requests already generating are coalesced onto the first one
+                key = self._cache_key(analysis_type, text, context or (), image, version)
+                response = self.response_cache.get_or_compute(key, compute, cacheable=is_cacheable)
+            except Exception as e:
+                labels["cache"] = "miss"
+                return f"An error occurred during text generation: {e}"
+            labels["cache"] = "miss" if computed else "hit"
+            metrics.REGISTRY.increment("response_cache_lookups", analysis=analysis_type, result=labels["cache"])
+            return response
+
+    def _stream_analysis(self, analysis_type: str, text: str, cancel_event=None, image=None):
+        if not self.available:
+            yield UNAVAILABLE_MESSAGE
+            return "error"
+        version = self._context_version(analysis_type)
+        context = self._related_context(analysis_type, text) if version is None else None
+        with metrics.REGISTRY.span("analysis", analysis=analysis_type, mode="stream") as labels:
+            try:
+                image = self._resolve_image(analysis_type, image)
+            except ImageError as e:
+                yield f"An error occurred while reading the photo: {e}"
+                return "error"
+            if not self.response_cache:
+                labels["cache"] = "off"
+                if context is None:
+                    context = self._related_context(analysis_type, text)
+                prompt, stop_reason = yield from self._stream_prepare_prompt(analysis_type, text, context, labels, cancel_event, image)
+                if prompt is None:
+                    return stop_reason
+                return (yield from self._stream_response(prompt, analysis_type, cancel_event=cancel_event, image=image))
+
+            key = self._cache_key(analysis_type, text, context or (), image, version)
+            cached = self.response_cache.get(key)
+            labels["cache"] = "hit" if cached is not None else "miss"
+            metrics.REGISTRY.increment("response_cache_lookups", analysis=analysis_type, result=labels["cache"])
+            if cached is not None:
+                yield cached
+                # Replies read back from the disk tier are plain strings; a cut one still ends in the marker
+                return getattr(cached, "stop_reason", None) or ("budget" if cached.endswith(TRUNCATED_MARKER) else "cached")
+            if context is None:
+                context = self._related_context(analysis_type, text)
+            prompt, stop_reason = yield from self._stream_prepare_prompt(analysis_type, text, context, labels, cancel_event, image)
+            if prompt is None:
+                return stop_reason
+            return (yield from self._stream_response(
+                prompt, analysis_type, on_complete=lambda response: self.response_cache.put(key, response),
+                cancel_event=cancel_event, image=image,
+            ))
+
+    def _resolve_image(self, analysis_type: str, image):
+        """The PreparedImage to send with the prompt, or None for a text-only analysis."""
+        if image is None:
+            return None
+        if analysis_type not in IMAGE_PROMPT_TEMPLATES or not self.supports_images:
+            print("The loaded model cannot see photos; analyzing the description only.")
+            return None
+        return image if isinstance(image, PreparedImage) else self.prepare_image(image)
 
-            # Decode the generated text
-            response = self.tokenizer.decode(generated_ids[0], skip_special_tokens=True)
+    def _prepare_prompt(self, analysis_type: str, text: str, context=(), labels=None, cancel_event=None, image=None):
+        """(prompt, plan) for one input, condensing it first if it is long (see _condense)."""
+        condensed, plan = self._condense(analysis_type, [text], cancel_event)[0]
+        if labels is not None:
+            labels["strategy"] = plan["strategy"]
+        return self._build_prompt(analysis_type, condensed, context, image is not None), plan
 
-            # Post-process the response to remove the original prompt
-            if response.startswith(prompt):
-                 response = response[len(prompt):].strip()
+    def _stream_prepare_prompt(self, analysis_type, text, context, labels, cancel_event, image=None):
+        """_prepare_prompt for streams: returns (prompt, None), or yields the error and returns (None, stop reason)."""
+        try:
+            return self._prepare_prompt(analysis_type, text, context, labels, cancel_event, image)[0], None
+        except CancelledError:
+            return None, "cancelled"
+        except Exception as e:
+            yield f"An error occurred during text generation: {e}"
+            return None, "error"
 
-            return response.strip()
+    def _context_version(self, analysis_type: str):
+        """
+        related_entries_version() when this analysis gets similar past entries and their retrieval is
+        versioned, else None. The version stands in for the entries in the cache key, so a cache hit
+        skips the embedding pass (which could also reload a model the memory manager unloaded).
+        """
+        if self.related_entries is None or self.related_entries_version is None or analysis_type not in CONTEXT_ANALYSES:
+            return None
+        try:
+            return self.related_entries_version()
+        except Exception as e:
+            print(f"Similar past entries unavailable: {e}")
+            return None
 
+    def _related_context(self, analysis_type: str, text: str) -> list:
+        """Similar past entries for the prompt, or [] when retrieval is off or fails."""
+        if self.related_entries is None or analysis_type not in CONTEXT_ANALYSES:
+            return []
+        try:
+            return list(self.related_entries(text))
         except Exception as e:
-            return f"An error occurred during text generation: {e}"
\ No newline at end of file
+            print(f"Similar past entries unavailable: {e}")
+            return []
+
+    def _build_prompt(self, analysis_type: str, text: str, context=(), image=False) -> str:
+        if image:
+            prompt = IMAGE_PROMPT_TEMPLATES[analysis_type].format(text=text, image=self.image_tokens)
+        else:
+            prompt = PROMPT_TEMPLATES[analysis_type].format(text=text)
+        if context:
+            # Past entries go between the text and the final "Reflection:" line, so the instruction
+            # prefix before the text is unchanged and still resumes from the PrefixCache
+            body, _, answer = prompt.rpartition("\n\n")
+            past = "\n".join(f"- {entry}" for entry in context)
+            prompt = f"{body}\n\nEarlier entries by the same person, for noticing recurring patterns:\n{past}\n\n{answer}"
+        return prompt
+
+    def _cache_key(self, analysis_type: str, text: str, context=(), image=None, context_version=None) -> str:
+        profile = GENERATION_PROFILES.get(analysis_type, DEFAULT_PROFILE)
+        params = dict(self.generation_kwargs, profile=profile)
+        if context:
+            params["context"] = list(context)
+        if context_version is not None:
+            params["context_version"] = context_version
+        if image is not None:
+            params["image"] = image.digest
+        return make_cache_key(analysis_type, text, self.model_id, params)
+
+    def inference_report(self) -> dict:
+        """The chosen inference configuration with its load time and the measured decode throughput."""
+        report = {
+            "device": self.device,
+            "load_seconds": self.load_seconds,
+            "tokens_per_second": self.scheduler.tokens_per_second() if self.scheduler else 0.0,
+            "tokens_saved_by_early_stops": self.scheduler.stats["tokens_saved"] if self.scheduler else 0,
+        }
+        if self.cpu_config:
+            report["cpu"] = self.cpu_config.as_dict()
+        if self.scheduler and self.scheduler.assistant_model is not None:
+            report["speculative"] = self.scheduler.speculative_report()
+        if self.memory:
+            report["memory"] = self.memory.report()
+        return report
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the response cache (empty when deterministic mode is off)."""
+        return self.response_cache.stats() if self.response_cache else {}
+
+    def _generate_response(self, prompt: str, analysis_type=None, image=None) -> str:
+        """Helper method to generate text using the loaded transformers model."""
+        try:
+            with self.memory.in_use():
+                # The scheduler may batch this prompt with concurrent requests from other tabs;
+                # it returns only the newly generated text, so the prompt needs no stripping here.
+                return self.scheduler.submit(prompt, analysis_type, image=image).result()
+
+        except Exception as e:
+            return f"An error occurred during text generation: {e}"
+
+    def _stream_response(self, prompt: str, analysis_type=None, on_complete=None, cancel_event=None, image=None):
+        """
+        Generator yielding decoded text deltas as the model produces tokens, returning the stop reason.
+        `on_complete` receives the full reply once generation finishes without error or cancellation.
+        The model stays resident until the generator is exhausted or closed.
+        """
+        try:
+            with self.memory.in_use():
+                return (yield from self._stream_resident(prompt, analysis_type, on_complete, cancel_event, image))
+        except ModelReloadError as e:
+            yield f"An error occurred during text generation: {e}"
+            return "error"
+
+    def _stream_resident(self, prompt, analysis_type, on_complete, cancel_event, image=None):
+        # skip_prompt keeps the echoed prompt out of the stream, so no post-processing is needed
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        # The scheduler thread runs model.generate while this generator drains the streamer
+        future = self.scheduler.submit_stream(prompt, streamer, analysis_type, cancel_event, image)
+
+        submitted_at = time.perf_counter()
+        started = False
+        for delta in streamer:
+            if not started:
+                # Drop the leading whitespace the model emits after the "Reflection:" style suffix
+                delta = delta.lstrip()
+                started = bool(delta)
+                if started:
+                    metrics.REGISTRY.observe("time_to_first_token", time.perf_counter() - submitted_at, analysis=analysis_type or "none")
+            if delta:
+                yield delta
+
+        if isinstance(future.exception(), CancelledError):
+            return "cancelled" # A partial reply is not cached
+        error = future.exception()
+        if error:
+            yield f"\nAn error occurred during text generation: {error}"
+            return "error"
+        result = future.result()
+        if getattr(result, "truncated", False):
+            yield TRUNCATED_MARKER
+        if on_complete and is_cacheable(result):
+            on_complete(result)
+        return result.stop_reason
@@ -0,0 +1,152 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+# Bulk offline analysis of journal archives.
+#
+#   python batch.py entries.jsonl reflections.jsonl
+#   python batch.py export.csv reflections.jsonl --text-field body --id-field uuid
+#
+# Input is streamed: entries are read one window at a time, sorted by token length inside
+# the window so each generate batch pads little, and analyzed in batches. Results are appended
+# to the output JSONL as each batch finishes. After every window a checkpoint records how many
+# input entries are done and the output size at that point; rerunning the same command resumes
+# from there, so memory stays flat and an interrupted run loses at most one window of work.
+
+
+def read_entries(path, text_field="text", id_field="id"):
+    """Yields (index, id, text) for every non-empty entry of a JSONL or CSV file, lazily."""
+    if path.lower().endswith(".csv"):
+        csv.field_size_limit(sys.maxsize) # Journal entries can exceed the default 128 KiB
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for index, row in enumerate(csv.DictReader(f)):
+                yield index, row.get(id_field) or str(index), row.get(text_field) or ""
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    yield index, str(index), ""
+                    continue
+                record = json.loads(line)
+                yield index, str(record.get(id_field, index)), record.get(text_field) or ""
+
+
+def windows(entries, size):
+    """Splits the entry stream into lists of at most `size` entries."""
+    iterator = iter(entries)
+    while True:
+        window = list(islice(iterator, size))
+        if not window:
+            return
+        yield window
+
+
+def length_sorted_batches(guardian, window, batch_size):
+    """Buckets the entries of a window into batches of similar token length."""
+    entries = [entry for entry in window if entry[2].strip()]
+    if not entries:
+        return []
+    lengths = guardian.count_tokens(text for _, _, text in entries)
+    ordered = [entry for _, entry in sorted(zip(lengths, entries), key=lambda pair: pair[0])]
+    return [ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+
+class Checkpoint:
+    """Progress of a run: input entries fully processed and the output size at that point."""
+    def __init__(self, path):
+        self.path = path
+        self.entries_done = 0
+        self.output_bytes = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.entries_done = state["entries_done"]
+            self.output_bytes = state["output_bytes"]
+
+    def save(self, entries_done, output_bytes):
+        self.entries_done = entries_done
+        self.output_bytes = output_bytes
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries_done": entries_done, "output_bytes": output_bytes}, f)
+        os.replace(tmp_path, self.path)
+
+
+def run(args, guardian):
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint")
+    if checkpoint.entries_done:
+        print(f"Resuming after {checkpoint.entries_done} entries.")
+
+    # Drop anything written after the last checkpoint (a partially finished window)
+    output = open(args.output, "a+b")
+    output.truncate(checkpoint.output_bytes)
+    output.seek(checkpoint.output_bytes)
+
+    entries = islice(read_entries(args.input, args.text_field, args.id_field), checkpoint.entries_done, None)
+    started = time.perf_counter()
+    processed = 0
+    # Counted here: guardian.scheduler is None while the model is unloaded and starts afresh on each reload
+    reflection_tokens = 0
+    batches = 0
+    entries_done = checkpoint.entries_done
+    try:
+        for window in windows(entries, args.window):
+            for batch in length_sorted_batches(guardian, window, args.batch_size):
+                reflections = guardian.analyze_batch(args.analysis, [text for _, _, text in batch])
+                for (index, entry_id, _), reflection in zip(batch, reflections):
+                    record = {"id": entry_id, "index": index, "analysis": args.analysis, "reflection": reflection}
+                    output.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                output.flush()
+                processed += len(batch)
+                reflection_tokens += sum(guardian.count_tokens(reflections))
+                batches += 1
+
+            entries_done += len(window)
+            os.fsync(output.fileno())
+            checkpoint.save(entries_done, output.tell())
+
+            elapsed = time.perf_counter() - started
+            tokens_per_second = reflection_tokens / elapsed if elapsed else 0.0
+            print(f"{entries_done} entries done | {processed / elapsed:.2f} entries/s | "
+                  f"{tokens_per_second:.1f} reflection tokens/s | {batches} batches")
+    finally:
+        output.close()
+    print(f"Finished: {entries_done} entries, results in {args.output}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a journal archive (JSONL or CSV) in bulk.")
+    parser.add_argument("input", help="JSONL with one entry per line, or CSV with a header row.")
+    parser.add_argument("output", help="JSONL file the reflections are appended to.")
+    parser.add_argument("--analysis", choices=["journal", "audio_transcript", "moment"], default="journal")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--batch-size", type=int, default=8, help="Entries per generate call.")
+    parser.add_argument("--window", type=int, default=256,
+                        help="Entries read, length-sorted and checkpointed together (bounds memory).")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint).")
+    parser.add_argument("--model", choices=["gemma", "tiny"], default="gemma",
+                        help="'tiny' uses the benchmark stand-in model, for offline dry runs.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    from backend import MindGuardian
+    if args.model == "tiny":
+        from benchmark import build_tiny_model
+        model, tokenizer = build_tiny_model()
+        guardian = MindGuardian(model=model, tokenizer=tokenizer, max_batch_size=args.batch_size)
+    else:
+        guardian = MindGuardian(max_batch_size=args.batch_size)
+    if not guardian.model:
+        raise SystemExit("Model failed to load.")
+    try:
+        run(args, guardian)
+    finally:
+        guardian.close()
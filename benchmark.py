@@ -0,0 +1,366 @@
+import argparse
+import json
+import math
+import platform
+import random
+import resource
+import subprocess
+import time
+import wave
+
+from backend import MindGuardian, PROMPT_TEMPLATES
+
+# Benchmark harness for the analysis pipeline. It drives the streaming forms of
+# analyze_journal / analyze_audio_transcript / analyze_moment over a synthetic corpus
+# and writes machine-readable JSON that can be diffed between commits:
+#
+#   python benchmark.py --model tiny --output before.json
+#   python benchmark.py --model tiny --output after.json --compare before.json
+#
+# The audio suite measures the voice capture pipeline instead (no model needed):
+#
+#   python benchmark.py --suite audio --audio-seconds 60
+
+ANALYSIS_STREAMS = {
+    "journal": "stream_journal",
+    "audio_transcript": "stream_audio_transcript",
+    "moment": "stream_moment",
+}
+
+CORPUS_WORDS = (
+    "today i felt tired anxious calm hopeful overwhelmed grateful work family friend walk "
+    "sleep morning evening meeting deadline call message worried happy quiet noisy rain sun "
+    "coffee dinner thought remember maybe again always never little much better worse"
+).split()
+
+
+def build_corpus(lengths, samples_per_length, seed=0):
+    """Deterministic pseudo-journal entries of `lengths` words each."""
+    rng = random.Random(seed)
+    corpus = []
+    for length in lengths:
+        for _ in range(samples_per_length):
+            words = [rng.choice(CORPUS_WORDS) for _ in range(length)]
+            # Sentence breaks every ~12 words so the text looks like prose to the tokenizer
+            text = " ".join(word + ("." if i % 12 == 11 else "") for i, word in enumerate(words))
+            corpus.append((length, text))
+    return corpus
+
+
+def build_tiny_model(seed=0, num_hidden_layers=2, tokenizer=None):
+    """
+    A tiny, randomly initialized Llama-style causal LM and a byte-level BPE tokenizer trained
+    in memory on the prompt templates. Same interface as the Gemma checkpoint, no download.
+    Passing `tokenizer` reuses it (e.g. for a one-layer draft model sharing the vocabulary).
+    """
+    if tokenizer is not None:
+        return _tiny_llama(tokenizer, seed, num_hidden_layers), tokenizer
+
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    special_tokens = ["<pad>", "<bos>", "<eos>"]
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=1024, special_tokens=special_tokens, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    training_text = list(PROMPT_TEMPLATES.values()) + [text for _, text in build_corpus([64], 32, seed)]
+    tokenizer.train_from_iterator(training_text, trainer)
+    bos_id = tokenizer.token_to_id("<bos>")
+    tokenizer.post_processor = processors.TemplateProcessing(single="<bos> $A", special_tokens=[("<bos>", bos_id)])
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<bos>", eos_token="<eos>", pad_token="<pad>"
+    )
+
+    return _tiny_llama(tokenizer, seed, num_hidden_layers), tokenizer
+
+
+def _tiny_llama(tokenizer, seed, num_hidden_layers):
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=128,
+        intermediate_size=256,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure_prefill(guardian, prompt):
+    """Wall time of a single forward pass over the full prompt."""
+    import torch
+
+    inputs = guardian.tokenizer(prompt, return_tensors="pt").to(guardian.device)
+    started = time.perf_counter()
+    with torch.no_grad():
+        guardian.model(**inputs)
+    return time.perf_counter() - started, int(inputs["input_ids"].shape[1])
+
+
+def measure_call(guardian, analysis_type, text):
+    # The benchmark runs calls one at a time, so the direct forward pass does not
+    # contend with the scheduler, which is idle in between
+    prefill_seconds, prompt_tokens = measure_prefill(guardian, guardian._build_prompt(analysis_type, text))
+    plan = guardian.plan_input(text) # Long inputs are summarized in chunks first (map-reduce)
+
+    stream = getattr(guardian, ANALYSIS_STREAMS[analysis_type])
+    started = time.perf_counter()
+    first_token_at = None
+    chunks = []
+    for delta in stream(text):
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        chunks.append(delta)
+    finished = time.perf_counter()
+
+    output_tokens = len(guardian.tokenizer("".join(chunks), add_special_tokens=False)["input_ids"])
+    decode_seconds = finished - first_token_at if first_token_at else 0.0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "prefill_seconds": prefill_seconds,
+        "ttft_seconds": (first_token_at or finished) - started,
+        "decode_tokens_per_second": (output_tokens - 1) / decode_seconds if output_tokens > 1 and decode_seconds > 0 else 0.0,
+        "e2e_seconds": finished - started,
+        "strategy": plan["strategy"],
+        "chunks": plan.get("chunks", 0),
+    }
+
+
+def summarize(samples):
+    latencies = [sample["e2e_seconds"] for sample in samples]
+    mean = lambda key: sum(sample[key] for sample in samples) / len(samples)
+    return {
+        "calls": len(samples),
+        "prompt_tokens_mean": mean("prompt_tokens"),
+        "output_tokens_mean": mean("output_tokens"),
+        "prefill_seconds_mean": mean("prefill_seconds"),
+        "ttft_seconds_mean": mean("ttft_seconds"),
+        "decode_tokens_per_second_mean": mean("decode_tokens_per_second"),
+        "chunks_mean": mean("chunks"),
+        "e2e_seconds_p50": percentile(latencies, 0.50),
+        "e2e_seconds_p95": percentile(latencies, 0.95),
+        "e2e_seconds_p99": percentile(latencies, 0.99),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    if args.model == "tiny":
+        model, tokenizer = build_tiny_model(args.seed)
+        draft = build_tiny_model(args.seed, num_hidden_layers=1, tokenizer=tokenizer)[0] if args.draft else None
+        guardian = MindGuardian(deterministic=True, model=model, tokenizer=tokenizer, cache_responses=False, draft_model=draft)
+    else:
+        guardian = MindGuardian(deterministic=True, cache_responses=False)
+    if not guardian.model:
+        raise SystemExit("Model failed to load; nothing to benchmark.")
+
+    corpus = build_corpus(args.lengths, args.samples, args.seed)
+    # One untimed call per analysis type warms up kernels and the prefix cache
+    for analysis_type in args.analyses:
+        measure_call(guardian, analysis_type, corpus[0][1])
+
+    results = {}
+    for analysis_type in args.analyses:
+        by_length = {}
+        for length, text in corpus:
+            sample = measure_call(guardian, analysis_type, text)
+            by_length.setdefault(length, []).append(sample)
+            print(f"{analysis_type:>16} {length:>5} words: e2e {sample['e2e_seconds']:.3f}s, ttft {sample['ttft_seconds']:.3f}s"
+                  f" ({sample['strategy']}{', %d chunks' % sample['chunks'] if sample['chunks'] else ''})")
+        all_samples = [sample for samples in by_length.values() for sample in samples]
+        results[analysis_type] = {
+            "overall": summarize(all_samples),
+            "by_input_words": {str(length): summarize(samples) for length, samples in by_length.items()},
+        }
+
+    guardian.close()
+    import torch
+    return {
+        "meta": {
+            "model": args.model,
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "device": guardian.device,
+            "generation_kwargs": guardian.generation_kwargs,
+            "lengths": args.lengths,
+            "samples_per_length": args.samples,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "inference": guardian.inference_report(),
+        "results": results,
+    }
+
+
+def synthesize_speech(seconds, rate, seed=0):
+    """Speech-like 16-bit mono PCM: voiced harmonics under a syllable-rate envelope, plus noise."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / float(rate)
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * (rng.random(len(t)) > 0.0005)
+    signal = 6000 * voiced * envelope + 300 * rng.standard_normal(len(t))
+    return np.clip(signal, -32768, 32767).astype("<i2").tobytes()
+
+
+def measure_capture(pcm, input_rate, output_rate, chunk_frames=1024):
+    """Feeds `pcm` through the recording pipeline chunk by chunk and times the handoff to transcription."""
+    from audio_capture import AudioCaptureBuffer, StreamingResampler
+
+    resampler = StreamingResampler(input_rate, output_rate) if output_rate != input_rate else None
+    capture = AudioCaptureBuffer(output_rate, 2, 1)
+    chunk_bytes = chunk_frames * 2
+    started = time.perf_counter()
+    for offset in range(0, len(pcm), chunk_bytes):
+        data = pcm[offset:offset + chunk_bytes]
+        capture.write(resampler.process(data) if resampler else data)
+    capture.finish()
+    capture_seconds = time.perf_counter() - started
+
+    # Transcription reads the whole recording back as WAV; with SpeechRecognition installed,
+    # time its AudioFile/record step too, which is what gets encoded and sent to the recognizer
+    started = time.perf_counter()
+    source = capture.open_wav()
+    reader = wave.open(source, "rb")
+    reader.readframes(reader.getnframes())
+    reader.close()
+    handoff_seconds = time.perf_counter() - started
+    transcribe_prep_seconds = None
+    try:
+        import speech_recognition as sr
+    except ImportError:
+        sr = None
+    if sr is not None:
+        started = time.perf_counter()
+        with sr.AudioFile(capture.open_wav()) as audio_source:
+            sr.Recognizer().record(audio_source)
+        transcribe_prep_seconds = time.perf_counter() - started
+
+    audio_seconds = len(pcm) / 2.0 / input_rate
+    result = {
+        "stored_rate": output_rate,
+        "stored_bytes_per_minute": capture.nbytes * 60.0 / audio_seconds,
+        "capture_cpu_seconds_per_minute": capture_seconds * 60.0 / audio_seconds,
+        "realtime_factor": audio_seconds / capture_seconds if capture_seconds else 0.0,
+        "handoff_seconds_per_minute": handoff_seconds * 60.0 / audio_seconds,
+    }
+    if transcribe_prep_seconds is not None:
+        result["transcribe_prep_seconds_per_minute"] = transcribe_prep_seconds * 60.0 / audio_seconds
+    capture.discard()
+    return result
+
+
+def run_audio_benchmark(args):
+    from audio_capture import SPEECH_RATE
+
+    input_rate = args.input_rate
+    pcm = synthesize_speech(args.audio_seconds, input_rate, args.seed)
+    results = {}
+    for label, output_rate in (("capture_native", input_rate), ("capture_speech_rate", SPEECH_RATE)):
+        samples = [measure_capture(pcm, input_rate, output_rate) for _ in range(args.samples)]
+        # Keep the fastest run of each timing; sizes are identical across runs
+        overall = {key: (max if key == "realtime_factor" else min)(sample[key] for sample in samples) for key in samples[0]}
+        results[label] = {"overall": overall}
+        print(f"{label:>20}: {overall['stored_bytes_per_minute'] / 1e6:.2f} MB/min stored, "
+              f"{overall['realtime_factor']:.0f}x realtime, handoff {overall['handoff_seconds_per_minute'] * 1000:.1f} ms/min")
+    native, speech = results["capture_native"]["overall"], results["capture_speech_rate"]["overall"]
+    print(f"Resampling to {SPEECH_RATE} Hz stores {native['stored_bytes_per_minute'] / speech['stored_bytes_per_minute']:.2f}x fewer bytes per minute.")
+    return {
+        "meta": {
+            "suite": "audio",
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "input_rate": input_rate,
+            "speech_rate": SPEECH_RATE,
+            "audio_seconds": args.audio_seconds,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+
+
+def compare(current, baseline):
+    """Prints the relative change of every overall metric against a previous results file."""
+    print(f"\nComparison against {baseline['meta'].get('revision')} (negative latency change is better):")
+    for analysis_type, result in current["results"].items():
+        previous = baseline.get("results", {}).get(analysis_type)
+        if not previous:
+            continue
+        for metric, value in result["overall"].items():
+            old = previous["overall"].get(metric)
+            if isinstance(old, (int, float)) and old:
+                print(f"  {analysis_type:>16} {metric:<32} {old:10.4f} -> {value:10.4f} ({(value - old) / old:+.1%})")
+    print(f"  {'peak_rss_mb':>49} {baseline['peak_rss_mb']:10.1f} -> {current['peak_rss_mb']:10.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Mind Guardian analysis pipeline.")
+    parser.add_argument("--suite", choices=["model", "audio"], default="model",
+                        help="'audio' benchmarks voice capture and resampling instead of generation.")
+    parser.add_argument("--model", choices=["tiny", "gemma"], default="tiny",
+                        help="'tiny' uses a randomly initialized stand-in model that runs offline.")
+    parser.add_argument("--draft", action="store_true",
+                        help="With --model tiny, decode speculatively with a one-layer draft "
+                             "(for gemma, set MIND_GUARDIAN_DRAFT_MODEL instead).")
+    parser.add_argument("--analyses", nargs="+", choices=list(ANALYSIS_STREAMS), default=list(ANALYSIS_STREAMS))
+    parser.add_argument("--lengths", nargs="+", type=int, default=[16, 64, 256, 1024],
+                        help="Input lengths in words.")
+    parser.add_argument("--samples", type=int, default=5, help="Inputs per length.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--input-rate", type=int, default=44100, help="Microphone rate, as gui.RATE (audio suite).")
+    parser.add_argument("--audio-seconds", type=float, default=60.0, help="Length of the synthetic recording (audio suite).")
+    parser.add_argument("--output", help="Write JSON results to this file.")
+    parser.add_argument("--compare", help="Previous JSON results to diff against.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_audio_benchmark(args) if args.suite == "audio" else run_benchmark(args)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
@@ -0,0 +1,61 @@
+import re
+
+# Splitting long entries into chunks the model can summarize on their own. Chunks break at paragraph
+# boundaries where possible, then at sentence ends, and only split inside a sentence (between words)
+# when one sentence alone is over the budget. Token counts come from the model's tokenizer in a couple
+# of batched calls, so splitting stays linear in the length of the text.
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+def split_sentences(paragraph: str) -> list:
+    return [sentence for sentence in SENTENCE_END.split(paragraph.strip()) if sentence]
+
+
+def split_words(text: str, tokens: int, budget: int) -> list:
+    """Splits a run-on text into pieces of about `budget` tokens, between words."""
+    words = text.split()
+    per_piece = max(1, int(len(words) * budget * 0.9 / max(tokens, 1))) # 10% margin: tokens per word vary
+    return [" ".join(words[start:start + per_piece]) for start in range(0, len(words), per_piece)]
+
+
+def chunk_text(text: str, count_tokens, budget: int) -> list:
+    """
+    Chunks of `text` of at most ~`budget` tokens each, in order. `count_tokens(texts)` returns the
+    token count of each text (MindGuardian.count_tokens).
+    """
+    paragraphs = [paragraph.strip() for paragraph in PARAGRAPH_BREAK.split(text) if paragraph.strip()]
+    if not paragraphs:
+        return []
+    paragraph_tokens = count_tokens(paragraphs)
+
+    # Units are (text, tokens, separator before it); oversized paragraphs are broken into sentences
+    oversized = [paragraph for paragraph, tokens in zip(paragraphs, paragraph_tokens) if tokens > budget]
+    sentences = {paragraph: split_sentences(paragraph) for paragraph in oversized}
+    flat = [sentence for paragraph in oversized for sentence in sentences[paragraph]]
+    sentence_tokens = iter(count_tokens(flat) if flat else [])
+    units = []
+    for paragraph, tokens in zip(paragraphs, paragraph_tokens):
+        if tokens <= budget:
+            units.append((paragraph, tokens, "\n\n"))
+            continue
+        for index, sentence in enumerate(sentences[paragraph]):
+            separator = "\n\n" if index == 0 else " "
+            tokens = next(sentence_tokens)
+            if tokens <= budget:
+                units.append((sentence, tokens, separator))
+            else:
+                for piece_index, piece in enumerate(split_words(sentence, tokens, budget)):
+                    units.append((piece, min(tokens, budget), separator if piece_index == 0 else " "))
+
+    # Greedy packing: consecutive units share a chunk while they fit
+    chunks, current, current_tokens = [], "", 0
+    for unit, tokens, separator in units:
+        if current and current_tokens + tokens + 1 > budget:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current = f"{current}{separator}{unit}" if current else unit
+        current_tokens += tokens + (1 if current_tokens else 0)
+    if current:
+        chunks.append(current)
+    return chunks
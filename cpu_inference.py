@@ -0,0 +1,122 @@
+import os
+import time
+
+# CPU inference mode: "auto" picks int8 dynamic quantization when the host supports it,
+# otherwise the fastest float dtype; "int8", "bf16" and "fp32" force a configuration.
+CPU_MODE = os.environ.get("MIND_GUARDIAN_CPU_MODE", "auto")
+CPU_THREADS = int(os.environ.get("MIND_GUARDIAN_CPU_THREADS", "0")) # 0 = one per available physical core
+
+
+class CpuInferenceConfig:
+    """The CPU configuration chosen at load time, reported alongside the measured load time."""
+    def __init__(self, mode, dtype, threads, interop_threads, quantized):
+        self.mode = mode
+        self.dtype = dtype
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.quantized = quantized
+        self.load_seconds = None
+
+    def as_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "dtype": self.dtype,
+            "threads": self.threads,
+            "interop_threads": self.interop_threads,
+            "quantized": self.quantized,
+            "load_seconds": self.load_seconds,
+        }
+
+    def describe(self) -> str:
+        weights = "int8 dynamic quantized linear layers" if self.quantized else f"{self.dtype} weights"
+        load_time = f", loaded in {self.load_seconds:.1f}s" if self.load_seconds is not None else ""
+        return f"CPU mode '{self.mode}': {weights}, {self.threads} intra-op / {self.interop_threads} inter-op threads{load_time}"
+
+
+def cpu_flags() -> set:
+    """Instruction-set flags of the host CPU (Linux only; empty elsewhere)."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def available_physical_cores() -> int:
+    """Cores this process may run on, counting hyper-threaded siblings once."""
+    try:
+        logical = len(os.sched_getaffinity(0))
+    except AttributeError: # Not available on macOS/Windows
+        logical = os.cpu_count() or 1
+    siblings = cores = None
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("siblings"):
+                    siblings = int(line.split(":", 1)[1])
+                elif line.startswith("cpu cores"):
+                    cores = int(line.split(":", 1)[1])
+                if siblings and cores:
+                    break
+    except (OSError, ValueError):
+        pass
+    threads_per_core = siblings // cores if siblings and cores else 1
+    return max(1, logical // max(1, threads_per_core))
+
+
+def best_float_dtype(flags=None) -> str:
+    """bf16 only pays off with native bf16 support (AVX512-BF16/AMX); otherwise fp32 is fastest on CPU."""
+    flags = cpu_flags() if flags is None else flags
+    if "avx512_bf16" in flags or "amx_bf16" in flags:
+        return "bf16"
+    return "fp32"
+
+
+def configure_threads(threads=CPU_THREADS):
+    """Pins torch intra-op/inter-op thread pools to the available cores; returns the counts used."""
+    import torch
+
+    threads = threads or available_physical_cores()
+    torch.set_num_threads(threads)
+    interop_threads = min(2, threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Can only be set before the first inter-op parallel work; keep whatever is in place
+        interop_threads = torch.get_num_interop_threads()
+    return threads, interop_threads
+
+
+def int8_supported() -> bool:
+    import torch
+
+    engines = torch.backends.quantized.supported_engines
+    return any(engine in engines for engine in ("x86", "fbgemm", "qnnpack"))
+
+
+def choose_config(mode=CPU_MODE) -> CpuInferenceConfig:
+    if mode == "auto":
+        mode = "int8" if int8_supported() else best_float_dtype()
+    threads, interop_threads = configure_threads()
+    # Dynamic quantization converts fp32 linear layers, so the int8 mode loads in fp32 first
+    dtype = "fp32" if mode == "int8" else mode
+    return CpuInferenceConfig(mode, dtype, threads, interop_threads, quantized=(mode == "int8"))
+
+
+def load_cpu_model(model_class, path, load_kwargs, mode=CPU_MODE):
+    """Loads `path` with `model_class` for CPU inference; returns (model, CpuInferenceConfig)."""
+    import torch
+
+    config = choose_config(mode)
+    started = time.perf_counter()
+    torch_dtype = torch.bfloat16 if config.dtype == "bf16" else torch.float32
+    model = model_class.from_pretrained(path, torch_dtype=torch_dtype, **load_kwargs)
+    if config.quantized:
+        # Quantized weights are private to this process, unlike the memory-mapped float weights
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    config.load_seconds = time.perf_counter() - started
+    return model, config
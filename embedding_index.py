@@ -0,0 +1,245 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import metrics
+from audio_capture import import_numpy
+from worker_pool import SerialQueue
+
+# Similar past entries for the prompt. Every saved entry is embedded once (mean-pooled hidden states of the
+# loaded model, see MindGuardian.embed), projected to EMBEDDING_DIM dimensions with a fixed random
+# projection and stored as int8 in memory-mapped files. A search first ranks all entries by the Hamming
+# distance between sign bits (32 bytes per entry at 256 dimensions, the signs of a random projection
+# approximate the angle between embeddings), then scores the best RERANK_CANDIDATES exactly on their int8
+# vectors, so a query reads ~3 MB at 100k entries instead of the full index.
+EMBEDDING_DIR = os.environ.get("MIND_GUARDIAN_EMBEDDING_DIR") or os.path.join(os.path.expanduser("~"), ".mind_guardian", "embeddings")
+EMBEDDING_DIM = 256 # Multiple of 64, so the sign bits pack into whole uint64 words
+PROJECTION_SEED = 1234 # Changing it invalidates every stored vector
+RERANK_CANDIDATES = 256
+# How many similar past entries go into journal and transcript prompts; 0 (the default) leaves prompts unchanged
+SIMILAR_ENTRIES = int(os.environ.get("MIND_GUARDIAN_SIMILAR_ENTRIES", "0"))
+CONTEXT_WORDS = 60 # Each past entry is shortened to this many words in the prompt
+INDEX_BATCH = 16 # Entries embedded per forward pass while catching up
+
+ROW_DTYPE = [("id", "<i8"), ("inverse_norm", "<f4"), ("vector", "i1", (EMBEDDING_DIM,))]
+
+
+def popcount_rows(words):
+    """Set bits per row of a uint64 array."""
+    np = import_numpy()
+    if hasattr(np, "bitwise_count"): # NumPy >= 2.0
+        return np.bitwise_count(words).sum(axis=1, dtype=np.uint32)
+    table = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+    return table[words.view(np.uint8)].sum(axis=1, dtype=np.uint32)
+
+
+class EmbeddingIndex:
+    """
+    Append-only vector index in `directory`: codes.u8 holds the packed sign bits of every entry and
+    rows.bin its id, int8 vector and inverse norm; meta.json records the encoder, the projection and
+    how many rows are complete. Both files are memory-mapped read-only for searching and remapped
+    after appends. Vectors from a different `encoder` are incompatible, so a mismatch starts afresh.
+    """
+    def __init__(self, directory=EMBEDDING_DIR, encoder="default"):
+        np = import_numpy()
+        self.directory = directory
+        self.encoder = encoder
+        self.code_words = EMBEDDING_DIM // 64
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._codes_path = os.path.join(directory, "codes.u8")
+        self._rows_path = os.path.join(directory, "rows.bin")
+        self._lock = threading.Lock()
+        self._projection = None
+        self._maps = None # (count, codes, rows) mapped at that count
+        os.makedirs(directory, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        if meta.get("encoder") != encoder or meta.get("dim") != EMBEDDING_DIM or meta.get("seed") != PROJECTION_SEED:
+            if meta:
+                print(f"Embedding index was built with {meta.get('encoder')}; rebuilding it for {encoder}.")
+            meta = {}
+        self.count = meta.get("count", 0)
+        self.last_id = meta.get("last_id", 0) # Highest entry id indexed; entries are added in id order
+        self.source_dim = meta.get("source_dim")
+        # Rows past `count` are from an append that was interrupted before meta.json was updated
+        for path, row_bytes in ((self._codes_path, self.code_words * 8), (self._rows_path, np.dtype(ROW_DTYPE).itemsize)):
+            with open(path, "ab") as f:
+                f.truncate(self.count * row_bytes)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, ids, embeddings):
+        """Appends entries `ids` (ascending, above last_id) with their float embeddings (one row each)."""
+        np = import_numpy()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not len(ids):
+            return
+        with self._lock:
+            if self.source_dim is None:
+                self.source_dim = embeddings.shape[1]
+            codes, rows = self._encode(embeddings)
+            rows["id"] = ids
+            with open(self._codes_path, "ab") as f:
+                f.write(codes.tobytes())
+            with open(self._rows_path, "ab") as f:
+                f.write(rows.tobytes())
+            self.count += len(ids)
+            self.last_id = max(self.last_id, int(max(ids)))
+            self._write_meta()
+        metrics.REGISTRY.set_gauge("embedding_index_entries", self.count)
+
+    def search(self, embedding, k=5, exclude=()):
+        """The `k` most similar entries to `embedding` as [(id, cosine similarity)], best first."""
+        np = import_numpy()
+        started = time.perf_counter()
+        with self._lock:
+            if not self.count:
+                return []
+            count, codes, rows = self._mapped()
+            query_codes, query_rows = self._encode(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+        wanted = k + len(exclude)
+        if count > RERANK_CANDIDATES:
+            distances = popcount_rows(codes ^ query_codes)
+            candidates = np.sort(np.argpartition(distances, RERANK_CANDIDATES)[:RERANK_CANDIDATES]) # Sorted reads from the map
+        else:
+            candidates = np.arange(count)
+        selected = rows[candidates]
+        query = query_rows["vector"][0].astype(np.float32) * query_rows["inverse_norm"][0]
+        scores = (selected["vector"].astype(np.float32) @ query) * selected["inverse_norm"]
+        best = np.argsort(-scores)[:wanted]
+        results = [(int(selected["id"][i]), float(scores[i])) for i in best if int(selected["id"][i]) not in exclude][:k]
+        metrics.REGISTRY.observe("embedding_search", time.perf_counter() - started)
+        return results
+
+    def _encode(self, embeddings):
+        """Projects, quantizes and sign-hashes float embeddings; returns (uint64 codes, rows without ids)."""
+        np = import_numpy()
+        if self._projection is None:
+            rng = np.random.default_rng(PROJECTION_SEED)
+            self._projection = rng.standard_normal((self.source_dim, EMBEDDING_DIM)).astype(np.float32)
+        projected = embeddings @ self._projection
+        scale = 127.0 / np.maximum(np.abs(projected).max(axis=1, keepdims=True), 1e-12)
+        vectors = np.rint(projected * scale).astype(np.int8)
+        rows = np.zeros(len(vectors), dtype=ROW_DTYPE)
+        rows["vector"] = vectors
+        rows["inverse_norm"] = 1.0 / np.maximum(np.linalg.norm(vectors.astype(np.float32), axis=1), 1e-12)
+        codes = np.packbits(vectors > 0, axis=1).view(np.uint64)
+        return codes, rows
+
+    def _mapped(self):
+        """Read-only maps of the complete rows, remapped when rows were added since. Caller holds the lock."""
+        np = import_numpy()
+        if self._maps is None or self._maps[0] != self.count:
+            codes = np.memmap(self._codes_path, dtype=np.uint64, mode="r", shape=(self.count, self.code_words))
+            rows = np.memmap(self._rows_path, dtype=ROW_DTYPE, mode="r", shape=(self.count,))
+            self._maps = (self.count, codes, rows)
+        return self._maps
+
+    def _write_meta(self):
+        meta = {"encoder": self.encoder, "dim": EMBEDDING_DIM, "seed": PROJECTION_SEED, "source_dim": self.source_dim,
+                "count": self.count, "last_id": self.last_id}
+        temporary = self._meta_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temporary, self._meta_path)
+
+
+class SimilarEntries:
+    """
+    Keeps an EmbeddingIndex of a HistoryStore's entries up to date and finds the past entries closest
+    to a new one. `embed(texts)` returns one embedding per text (MindGuardian.embed). Committed records
+    are embedded on background tasks of `pool` (a WorkerPool; a thread of their own when None), never
+    on the history writer; start() also catches up on records saved before. related() is what MindGuardian.related_entries expects, version() what
+    MindGuardian.related_entries_version expects.
+    """
+    RECENT_EMBEDDINGS = 32 # The entry just analyzed is embedded for retrieval and reused when it is saved
+
+    def __init__(self, history, embed, index, k=SIMILAR_ENTRIES, pool=None):
+        self.history = history
+        self.embed = embed
+        self.index = index
+        self.k = k
+        self._recent = collections.OrderedDict() # text -> embedding
+        self._recent_lock = threading.Lock()
+        self._pending = SerialQueue(self._index, pool, name="embedding-index")
+
+    def start(self):
+        self.history.add_listener(self._pending.put)
+        self._pending.put(None) # Catch up on the records saved before
+
+    def close(self):
+        """Indexes the records committed so far (on the calling thread once the pool is shut down)."""
+        if not self._pending.join(timeout=10.0):
+            print("Embedding index: still indexing after 10.0s.")
+
+    def version(self) -> str:
+        """Changes whenever related() may answer differently: an entry was indexed or k changed."""
+        return f"{self.k}:{len(self.index)}:{self.index.last_id}"
+
+    def related(self, text: str) -> list:
+        """Up to k past entries most similar to `text`, each as "date: entry", most similar first."""
+        if not self.k or not len(self.index):
+            return []
+        with metrics.REGISTRY.span("related_entries"):
+            embedding = self._embeddings([text])[0]
+            matches = self.index.search(embedding, self.k + 1) # One spare in case `text` itself was saved before
+            records = {record["id"]: record for record in self.history.get([entry_id for entry_id, _ in matches])}
+        entries = []
+        for entry_id, _ in matches:
+            record = records.get(entry_id)
+            if record and " ".join(record["text"].split()) != " ".join(text.split()):
+                words = record["text"].split()
+                shortened = " ".join(words[:CONTEXT_WORDS]) + (" ..." if len(words) > CONTEXT_WORDS else "")
+                entries.append(f"{time.strftime('%Y-%m-%d', time.localtime(record['created_at']))}: {shortened}")
+        return entries[:self.k]
+
+    def sync(self):
+        """Embeds the history's records newer than the index, INDEX_BATCH per forward pass; returns how many."""
+        added = 0
+        while True:
+            records, cursor = self.history.after(self.index.last_id, limit=INDEX_BATCH)
+            self._add(records)
+            added += len(records)
+            if cursor is None:
+                return added
+
+    def _add(self, records):
+        records = [record for record in records if record["id"] > self.index.last_id]
+        if records:
+            self.index.add([record["id"] for record in records], self._embeddings([record["text"] for record in records]))
+
+    def _embeddings(self, texts):
+        """Embeddings of `texts`, reusing the ones computed recently."""
+        np = import_numpy()
+        with self._recent_lock:
+            found = {text: self._recent[text] for text in texts if text in self._recent}
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            for text, embedding in zip(missing, self.embed(missing)):
+                found[text] = embedding
+            with self._recent_lock:
+                for text in missing:
+                    self._recent[text] = found[text]
+                while len(self._recent) > self.RECENT_EMBEDDINGS:
+                    self._recent.popitem(last=False)
+        return np.stack([found[text] for text in texts])
+
+    def _index(self, records):
+        if records is None:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Could not index past entries: {e}")
+            return
+        try:
+            if records[0]["id"] > self.index.last_id + 1:
+                self.sync() # Earlier records are missing; fetch everything after the index in order
+            else:
+                self._add(records)
+        except Exception as e:
+            print(f"Could not index {len(records)} entr{'y' if len(records) == 1 else 'ies'}: {e}")
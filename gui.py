@@ -1,34 +1,54 @@
 import tkinter as tk
 from tkinter import ttk
-import threading
 import queue
 import os
+import functools
+import threading
 from tkinter import filedialog
 
 # Imports needed for audio recording
-import pyaudio
-import wave
 import time # Import time for potential delays
 
-# Import for speech recognition (requires local installation: pip install SpeechRecognition)
-try:
-    import speech_recognition as sr
-    print("SpeechRecognition imported successfully.")
-except ImportError:
-    sr = None
-    print("SpeechRecognition not found. Audio transcription functionality will not work.")
+import profiling
+from audio_capture import AudioCaptureBuffer, SPEECH_RATE, StreamingResampler
+from embedding_index import SIMILAR_ENTRIES, EmbeddingIndex, SimilarEntries
+from history_store import HistoryStore
+from image_pipeline import ImageError
+from mood_analytics import EMOTIONS, MoodAnalytics
+from speech_to_text import FINAL_WAIT_SECONDS, ChunkedTranscriber, SpeechEngineError, create_engine
+from worker_pool import BACKGROUND, INTERACTIVE, CancellationToken, PoolFullError, WorkerPool
+
+# Import the backend logic (cheap: torch and transformers are only imported when MindGuardian is created)
+from backend import COMPLETE_STOP_REASONS, EMBEDDING_LAYER_FRACTION, GEMMA_MODEL_HANDLE, MindGuardian, drain_stream
+
+# pyaudio (and the speech engine, see speech_to_text.py) are imported on first use, so the window paints without waiting for them
+pyaudio = None
 
 
-# Import the backend logic
-from backend import MindGuardian
+def import_pyaudio():
+    """Imports pyaudio on first use; returns None if it is not installed."""
+    global pyaudio
+    if pyaudio is None:
+        try:
+            pyaudio = profiling.timed_import("pyaudio")
+        except ImportError:
+            print("pyaudio not found. Audio recording will not work.")
+    return pyaudio
+
 
 # Define audio recording parameters (adjust as needed)
-FORMAT = pyaudio.paInt16  # 16-bit resolution
+SAMPLE_WIDTH = 2          # 16-bit resolution (pyaudio.paInt16)
 CHANNELS = 1              # 1 channel (mono)
-RATE = 44100              # 44.1kHz sampling rate
+RATE = 44100              # 44.1kHz microphone sampling rate (resampled to SPEECH_RATE while recording)
 CHUNK = 1024              # 1024 samples per chunk
 RECORD_SECONDS = 5        # Duration of recording (can be adjusted)
-WAVE_OUTPUT_FILENAME = "temp_recording.wav" # Temporary file to save recording
+
+# Trends tab periods: label -> (bucket, days shown)
+TREND_PERIODS = {
+    "Last 30 days (daily)": ("day", 30),
+    "Last 12 weeks (weekly)": ("week", 84),
+    "Last year (weekly)": ("week", 365),
+}
 
 
 class MindGuardianGUI(tk.Tk):
@@ -41,61 +61,154 @@ class MindGuardianGUI(tk.Tk):
         style.theme_use('clam')
 
         self.guardian = None # Initialize guardian to None
+        # initialize_backend can outlive on_closing's pool shutdown; whichever runs second closes the backend
+        self._backend_lock = threading.Lock()
+        self._closing = False
         self.result_queue = queue.Queue()
 
+        # Every finished analysis is saved to the local history (writes are batched off the UI thread)
+        try:
+            self.history = HistoryStore()
+        except Exception as e:
+            print(f"❌ History is disabled: {e}")
+            self.history = None
+        self._history_records = {} # id -> record, for the pages loaded in the History tab
+        self._history_query = ""
+        self._history_cursor = None # Keyset cursor of the next History page; None when there is none
+        self.analytics = None # MoodAnalytics, created on the pool (it imports NumPy) once history is available
+        self.similar_entries = None # SimilarEntries feeding past entries into prompts (MIND_GUARDIAN_SIMILAR_ENTRIES > 0)
+
         self.status_label = tk.Label(self, text="Loading AI model, please wait...", fg="blue")
         self.status_label.pack(pady=10)
 
         self.setup_gui_structure()
         self.disable_analysis_buttons()
 
-        backend_thread = threading.Thread(target=self.initialize_backend)
-        backend_thread.start()
+        # One bounded pool runs backend loading, transcription, indexing and analyses. Recording runs on
+        # PyAudio's callback thread; the backend's scheduler, the history writer and the memory watcher
+        # keep one long-lived thread each, stopped by on_closing.
+        self.pool = WorkerPool()
+        self.pool.submit(self.initialize_backend, priority=BACKGROUND, name="backend-init")
+        if self.history:
+            self.pool.submit(self.initialize_analytics, priority=BACKGROUND, name="analytics-init")
 
         self.check_queue()
 
         # Audio recording attributes
         self._is_recording = False
-        self._frames = []
+        self._capture = None # AudioCaptureBuffer the stream callback writes into
+        self._resampler = None # StreamingResampler from RATE to SPEECH_RATE for the current recording
         self._audio = None # PyAudio instance
         self._stream = None # PyAudio stream
-        self._recording_thread = None
-        self._last_recorded_audio_path = None # Store the path to the last recording
+        self._last_recording = None # Finished AudioCaptureBuffer handed to transcription
+        self._transcriber = None # ChunkedTranscriber working on the current/last recording
         # Removed _playback_obj attribute
 
         # Moment Analysis attributes
         self.loaded_image_path = None
+        self.loaded_image = None # PreparedImage of loaded_image_path, once the pool has decoded it
+
+        # Speech-to-text engine and PyAudio instances are created on first use
+        self._stt_engine = None
+        self._audio_initialized = False
+
+        # Closing the window runs the teardown (pool, history, analytics, backend) whichever script started it
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # Speech Recognition recognizer instance
-        self._recognizer = sr.Recognizer() if sr else None
-        if not self._recognizer:
-             print("Speech recognition is disabled due to missing library.")
 
-        # Initialize PyAudio instance here
+    def _ensure_audio(self):
+        """Initializes PyAudio the first time audio is needed; returns the instance or None."""
+        if not self._audio_initialized:
+            self._audio_initialized = True
+            if import_pyaudio():
+                try:
+                    with profiling.phase("PyAudio init"):
+                        self._audio = pyaudio.PyAudio()
+                    print("PyAudio initialized successfully.")
+                except Exception as e:
+                    print(f"❌ PyAudio Initialization Error: {e}. Audio recording/playback will be disabled.")
+                    self._audio = None # Ensure it's None if initialization fails
+        return self._audio
+
+    def _ensure_stt_engine(self):
+        """Creates the configured speech-to-text engine the first time it is needed; returns it or None."""
+        if self._stt_engine is None:
+            try:
+                self._stt_engine = create_engine()
+                print(f"Speech-to-text engine: {self._stt_engine.name} ({self._stt_engine.language})")
+            except SpeechEngineError as e:
+                print(f"❌ Speech recognition is disabled: {e}")
+        return self._stt_engine
+
+
+    def submit_task(self, key, fn, *args, output_widget=None, button=None):
+        """
+        Runs fn(*args, token) on the worker pool at interactive priority, where token is the task's
+        CancellationToken. Returns the Task, or None if the pool refused it (shown in output_widget).
+        """
+        token = CancellationToken()
         try:
-            self._audio = pyaudio.PyAudio()
-            print("PyAudio initialized successfully.")
-        except Exception as e:
-            print(f"❌ PyAudio Initialization Error: {e}. Audio recording/playback will be disabled.")
-            self._audio = None # Ensure it's None if initialization fails
+            return self.pool.submit(fn, *args, token, priority=INTERACTIVE, key=key, name=key, token=token)
+        except PoolFullError as e:
+            print(f"Task '{key}' not started: {e}")
+            if output_widget is not None:
+                self.update_output(output_widget, f"Busy: {e} Please try again in a moment.", button)
+            return None
 
 
     def initialize_backend(self):
         """Initializes the MindGuardian backend in a separate thread."""
         try:
-            self.guardian = MindGuardian()
-            if not self.guardian or not self.guardian.model:
+            with profiling.phase("backend init"):
+                guardian = MindGuardian()
+            with self._backend_lock:
+                if self._closing:
+                    print("Window closed while the backend was loading; closing it.")
+                    guardian.close()
+                    return
+                self.guardian = guardian
+            profiling.mark("backend ready")
+            profiling.print_report()
+            if not self.guardian or not self.guardian.available:
                  error_message = "Failed to load the local AI model. Analysis features are disabled."
                  print(f"❌ Critical Error: {error_message}")
                  self.after(0, self.update_status_and_buttons, error_message, False)
             else:
                  print("DEBUG: MindGuardian backend initialized successfully.")
+                 # The backend unloads the model when idle; the status label follows it
+                 self.guardian.memory.add_listener(lambda state: self.after(0, self.show_model_state, state))
+                 self.start_similar_entries()
                  self.after(0, self.update_status_and_buttons, "AI model loaded. Ready for analysis.", True)
         except Exception as e:
             error_message = f"Failed to initialize MindGuardian backend: {e}"
             print(f"❌ Critical Error: {error_message}")
             self.after(0, self.update_status_and_buttons, error_message, False)
 
+    def initialize_analytics(self):
+        """Loads the saved mood features and scores the history records added since. Runs on the pool."""
+        try:
+            analytics = MoodAnalytics()
+            analytics.attach(self.history)
+            added = analytics.sync()
+            print(f"Mood analytics: {len(analytics)} entries ({added} new).")
+            self.analytics = analytics
+        except Exception as e:
+            print(f"❌ Mood trends are disabled: {e}")
+
+    def start_similar_entries(self):
+        """Indexes the history's entries with the model's embeddings and lets prompts include similar past entries."""
+        if not (self.history and SIMILAR_ENTRIES > 0):
+            return
+        try:
+            index = EmbeddingIndex(encoder=f"{GEMMA_MODEL_HANDLE}@{EMBEDDING_LAYER_FRACTION}")
+            self.similar_entries = SimilarEntries(self.history, self.guardian.embed, index, pool=self.pool)
+            self.similar_entries.start() # Catches up on past entries on the pool
+            self.guardian.related_entries = self.similar_entries.related
+            self.guardian.related_entries_version = self.similar_entries.version
+            print(f"Similar past entries: {len(index)} indexed, {SIMILAR_ENTRIES} added to each prompt.")
+        except Exception as e:
+            print(f"❌ Similar past entries are disabled: {e}")
+
     def update_status_and_buttons(self, message, enable_buttons):
         """Updates the status label and button states from the main GUI thread."""
         self.status_label.config(text=message, fg="green" if enable_buttons else "red")
@@ -105,6 +218,17 @@ class MindGuardianGUI(tk.Tk):
             self.disable_analysis_buttons()
 
 
+    def show_model_state(self, state):
+        """Shows whether the model is warm, cold (unloaded while idle) or reloading. Runs on the GUI thread."""
+        if state == "reloading":
+            self.status_label.config(text="Reloading AI model...", fg="blue")
+        elif state == "cold":
+            self.status_label.config(text="AI model unloaded while idle. It reloads on the next analysis.", fg="gray")
+        else:
+            seconds = self.guardian.memory.stats["last_reload_seconds"]
+            self.status_label.config(text=f"AI model loaded (reloaded in {seconds:.1f}s). Ready for analysis.", fg="green")
+
+
     def setup_gui_structure(self):
         """Creates the notebook and tab frames."""
         notebook = ttk.Notebook(self)
@@ -125,6 +249,26 @@ class MindGuardianGUI(tk.Tk):
         notebook.add(moment_frame, text="Moment Analysis")
         self.create_moment_tab(moment_frame)
 
+        # --- History Tab ---
+        history_frame = ttk.Frame(notebook, padding="10")
+        notebook.add(history_frame, text="History")
+        self.create_history_tab(history_frame)
+        # The first page is (re)loaded whenever the tab is opened
+
+        # --- Trends Tab ---
+        trends_frame = ttk.Frame(notebook, padding="10")
+        notebook.add(trends_frame, text="Trends")
+        self.create_trends_tab(trends_frame)
+
+        # History reloads its first page and Trends redraws whenever their tab is opened
+        def on_tab_changed(event):
+            selected = event.widget.select()
+            if selected == str(history_frame):
+                self.load_history()
+            elif selected == str(trends_frame):
+                self.show_trends()
+        notebook.bind("<<NotebookTabChanged>>", on_tab_changed)
+
 
     def create_journal_tab(self, parent_frame):
         """Adds widgets to the Journal Analysis tab."""
@@ -185,6 +329,113 @@ class MindGuardianGUI(tk.Tk):
         self.moment_result_output = tk.Text(parent_frame, height=10, width=50, state='disabled', wrap="word")
         self.moment_result_output.pack(expand=True, fill="both", pady=(0, 10))
 
+    def create_history_tab(self, parent_frame):
+        """Adds widgets to the History tab: search, a paged list of past analyses and the selected one in full."""
+        search_frame = ttk.Frame(parent_frame)
+        search_frame.pack(fill="x", pady=(0, 5))
+        self.history_search_input = ttk.Entry(search_frame)
+        self.history_search_input.pack(side=tk.LEFT, expand=True, fill="x")
+        self.history_search_input.bind("<Return>", lambda event: self.load_history())
+        ttk.Button(search_frame, text="Search", command=self.load_history).pack(side=tk.LEFT, padx=(5, 0))
+
+        self.history_list = ttk.Treeview(parent_frame, columns=("date", "kind", "entry"), show="headings", height=8)
+        for column, heading, width in (("date", "Date", 120), ("kind", "Type", 110), ("entry", "Entry", 300)):
+            self.history_list.heading(column, text=heading)
+            self.history_list.column(column, width=width, stretch=(column == "entry"))
+        self.history_list.pack(expand=True, fill="both")
+        self.history_list.bind("<<TreeviewSelect>>", lambda event: self.show_history_record())
+
+        self.history_more_button = ttk.Button(parent_frame, text="Load more", state='disabled',
+                                              command=lambda: self.load_history(more=True))
+        self.history_more_button.pack(pady=5)
+
+        self.history_detail_output = tk.Text(parent_frame, height=8, width=50, state='disabled', wrap="word")
+        self.history_detail_output.pack(expand=True, fill="both")
+
+    def load_history(self, more=False):
+        """Fetches the first page of history (or the next one with more=True) for the current search on the pool."""
+        if not self.history:
+            self.update_output(self.history_detail_output, "History is unavailable.", None)
+            return
+        query = self._history_query if more else self.history_search_input.get().strip()
+        before = self._history_cursor if more else None
+        self.submit_task("history", self._fetch_history, query, before, more, output_widget=self.history_detail_output)
+
+    def _fetch_history(self, query, before, append, token=None):
+        records, cursor = self.history.search(query, before=before)
+        self.after(0, self.show_history_page, query, records, cursor, append)
+
+    def show_history_page(self, query, records, cursor, append):
+        """Fills the History list with a fetched page. Runs on the GUI thread."""
+        if not append:
+            self.history_list.delete(*self.history_list.get_children())
+            self._history_records.clear()
+            self.update_output(self.history_detail_output, "" if records else "No entries found.", None)
+        self._history_query = query
+        self._history_cursor = cursor
+        for record in records:
+            self._history_records[record["id"]] = record
+            date = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["created_at"]))
+            preview = " ".join(record["text"].split())[:80]
+            self.history_list.insert("", tk.END, iid=str(record["id"]), values=(date, record["kind"], preview))
+        self.history_more_button.config(state='normal' if cursor is not None else 'disabled')
+
+    def show_history_record(self):
+        """Shows the selected entry with its reflection."""
+        selection = self.history_list.selection()
+        if selection:
+            record = self._history_records[int(selection[0])]
+            self.update_output(self.history_detail_output, f"{record['text']}\n\n— Reflection —\n{record['analysis']}", None)
+
+
+    def create_trends_tab(self, parent_frame):
+        """Adds widgets to the Trends tab: a period selector, a mood chart and a summary of the period."""
+        self.trend_period = ttk.Combobox(parent_frame, state="readonly", values=list(TREND_PERIODS))
+        self.trend_period.set(next(iter(TREND_PERIODS)))
+        self.trend_period.pack(anchor="w", pady=(0, 5))
+        self.trend_period.bind("<<ComboboxSelected>>", lambda event: self.show_trends())
+
+        self.trend_canvas = tk.Canvas(parent_frame, height=220, background="white", highlightthickness=0)
+        self.trend_canvas.pack(expand=True, fill="both")
+        self.trend_canvas.bind("<Configure>", lambda event: self.show_trends())
+
+        self.trend_summary_label = tk.Label(parent_frame, text="", justify=tk.LEFT, anchor="w")
+        self.trend_summary_label.pack(fill="x", pady=(5, 0))
+
+    def show_trends(self):
+        """Draws mean mood (valence) per day or week of the selected period. Queries take milliseconds, so this runs on the GUI thread."""
+        canvas = self.trend_canvas
+        canvas.delete("all")
+        if not self.analytics:
+            self.trend_summary_label.config(text="Mood trends are not available yet." if self.history else "History is unavailable.")
+            return
+        bucket, days = TREND_PERIODS[self.trend_period.get()]
+        end = time.time() + 86400 # Through the end of today
+        start = end - days * 86400
+        trend = self.analytics.trend(bucket, start, end)
+        summary = self.analytics.summary(start, end)
+        if not summary["count"]:
+            self.trend_summary_label.config(text="No analyses in this period yet.")
+            return
+
+        width, height = max(canvas.winfo_width(), 1), max(canvas.winfo_height(), 1)
+        middle = height / 2
+        canvas.create_line(0, middle, width, middle, fill="gray")
+        slot = width / len(trend["date"])
+        for index, (date, valence) in enumerate(zip(trend["date"], trend["valence"])):
+            left = index * slot + slot * 0.15
+            top = middle - valence * (middle - 15)
+            canvas.create_rectangle(left, min(top, middle), left + slot * 0.7, max(top, middle), outline="",
+                                    fill="seagreen" if valence >= 0 else "indianred")
+        canvas.create_text(4, 4, anchor="nw", text="more positive", fill="gray")
+        canvas.create_text(4, height - 4, anchor="sw", text=f"more negative   ({trend['date'][0]} – {trend['date'][-1]})", fill="gray")
+
+        strongest = max(EMOTIONS, key=lambda emotion: summary[emotion])
+        emotions = ", ".join(f"{emotion} {summary[emotion]:.1f}" for emotion in EMOTIONS)
+        self.trend_summary_label.config(
+            text=f"{summary['count']} analyses, {summary['length']:.0f} words on average. Most present: {strongest}.\n"
+                 f"Emotion words per 100 words: {emotions}")
+
     def disable_analysis_buttons(self):
         """Disables the analysis buttons."""
         if hasattr(self, 'analyze_journal_button'):
@@ -204,7 +455,7 @@ class MindGuardianGUI(tk.Tk):
 
     def enable_analysis_buttons(self):
         """Enables the analysis buttons."""
-        if self.guardian and self.guardian.model:
+        if self.guardian and self.guardian.available:
             if hasattr(self, 'analyze_journal_button'):
                 self.analyze_journal_button.config(state='normal')
             if hasattr(self, 'analyze_voice_button'):
@@ -223,7 +474,7 @@ class MindGuardianGUI(tk.Tk):
 
 
     def analyze_journal_click(self):
-        if not self.guardian or not self.guardian.model:
+        if not self.guardian or not self.guardian.available:
             print("Analysis not available: MindGuardian or model not initialized.")
             self.update_output(self.journal_result_output, "Error: AI model not loaded.", self.analyze_journal_button)
             return
@@ -232,33 +483,33 @@ class MindGuardianGUI(tk.Tk):
         if text:
             self.analyze_journal_button.config(state='disabled', text="Analyzing...")
             self.update_output(self.journal_result_output, "Analyzing...", None)
-            thread = threading.Thread(target=self.run_analysis, args=(self.guardian.analyze_journal, text, self.journal_result_output, self.analyze_journal_button))
-            thread.start()
+            self.submit_task("journal", self.run_analysis, "journal", self.guardian.stream_journal, text, self.journal_result_output,
+                             self.analyze_journal_button, output_widget=self.journal_result_output, button=self.analyze_journal_button)
         else:
             self.update_output(self.journal_result_output, "Please enter text to analyze.", self.analyze_journal_button)
 
 
     def analyze_voice_click(self):
-        if not self.guardian or not self.guardian.model:
+        if not self.guardian or not self.guardian.available:
             print("Analysis not available: MindGuardian or model not initialized.")
             self.update_output(self.voice_result_output, "Error: AI model not loaded.", self.analyze_voice_button)
             return
 
-        # Ensure simpleaudio and speech_recognition are available for voice analysis
+        # Ensure a speech-to-text engine is configured for voice analysis
         # Removed simpleaudio check as playback is removed
-        if not sr:
-            error_message = "Voice analysis requires SpeechRecognition library."
+        if not self._ensure_stt_engine():
+            error_message = "Voice analysis requires a speech-to-text engine (see MIND_GUARDIAN_STT_ENGINE)."
             print(f"❌ Voice Analysis Error: {error_message}")
             self.update_output(self.voice_result_output, error_message, self.analyze_voice_button)
             return
 
 
-        if self._last_recorded_audio_path and os.path.exists(self._last_recorded_audio_path):
-             # Perform transcription in a separate thread to avoid blocking the GUI
+        if self._last_recording and self._last_recording.nbytes:
+             # Perform transcription on the worker pool to avoid blocking the GUI
              self.analyze_voice_button.config(state='disabled', text="Transcribing...")
              self.update_output(self.voice_result_output, "Transcribing audio...", None)
-             transcription_thread = threading.Thread(target=self._transcribe_and_analyze_voice)
-             transcription_thread.start()
+             self.submit_task("voice", self._transcribe_and_analyze_voice,
+                              output_widget=self.voice_result_output, button=self.analyze_voice_button)
 
         else:
              text_to_analyze = "No audio recorded. Please record a voice note first."
@@ -267,23 +518,26 @@ class MindGuardianGUI(tk.Tk):
              return
 
 
-    def _transcribe_and_analyze_voice(self):
-        """Transcribes the audio and then triggers analysis (runs in a separate thread)."""
-        if not self._last_recorded_audio_path or not os.path.exists(self._last_recorded_audio_path):
-             self.result_queue.put((self.voice_result_output, "Error: No audio file found for transcription.", self.analyze_voice_button))
+    def _transcribe_and_analyze_voice(self, token=None):
+        """Transcribes the audio and then triggers analysis (runs on the worker pool)."""
+        if not self._last_recording or not self._last_recording.nbytes:
+             self.result_queue.put((self.voice_result_output, "Error: No recorded audio found for transcription.", self.analyze_voice_button))
              return
 
-        if not self._recognizer:
-             self.result_queue.put((self.voice_result_output, "Error: Speech recognition library not loaded.", self.analyze_voice_button))
+        if not self._stt_engine:
+             self.result_queue.put((self.voice_result_output, "Error: Speech recognition engine not available.", self.analyze_voice_button))
              return
 
-        text_to_analyze = self.transcribe_audio(self._last_recorded_audio_path)
+        text_to_analyze = self.transcribe_audio(self._last_recording, self._transcriber)
         print(f"DEBUG: Transcribed text: {text_to_analyze[:100]}...")
+        if token and token.cancelled:
+             return
 
         if text_to_analyze and not text_to_analyze.startswith("Transcription failed:"):
             # Now run the analysis
             self.result_queue.put((self.voice_result_output, "Analyzing transcribed text...", None)) # Update status in GUI
-            self.run_analysis(self.guardian.analyze_audio_transcript, text_to_analyze, self.voice_result_output, self.analyze_voice_button)
+            self.run_analysis("audio_transcript", self.guardian.stream_audio_transcript, text_to_analyze,
+                              self.voice_result_output, self.analyze_voice_button, token)
         elif text_to_analyze: # It started with "Transcription failed:"
              self.result_queue.put((self.voice_result_output, text_to_analyze, self.analyze_voice_button)) # Show the error message
         else:
@@ -291,25 +545,52 @@ class MindGuardianGUI(tk.Tk):
 
 
     def analyze_moment_click(self):
-        if not self.guardian or not self.guardian.model:
+        if not self.guardian or not self.guardian.available:
             print("Analysis not available: MindGuardian or model not initialized.")
             self.update_output(self.moment_result_output, "Error: AI model not loaded.", self.analyze_moment_button)
             return
 
         text = self.moment_text_input.get("1.0", tk.END).strip()
-        if text:
+        # A photo still being decoded is passed by path; the backend then prepares it itself
+        image = self.loaded_image or self.loaded_image_path
+        if text or image:
             self.analyze_moment_button.config(state='disabled', text="Analyzing...")
             self.update_output(self.moment_result_output, "Analyzing...", None)
-            thread = threading.Thread(target=self.run_analysis, args=(self.guardian.analyze_moment, text, self.moment_result_output, self.analyze_moment_button))
-            thread.start()
+            self.submit_task("moment", functools.partial(self.run_analysis, image=image), "moment", self.guardian.stream_moment,
+                             text or "(no description, see the photo)", self.moment_result_output, self.analyze_moment_button,
+                             output_widget=self.moment_result_output, button=self.analyze_moment_button)
         else:
             self.update_output(self.moment_result_output, "Please enter text to analyze.", self.analyze_moment_button)
 
-    def run_analysis(self, analysis_func, text, output_widget, button):
-        """Runs the analysis and puts the result in a queue."""
+    def run_analysis(self, analysis_type, stream_func, text, output_widget, button, token=None, **stream_kwargs):
+        """
+        Runs a streaming analysis and puts each text delta in the queue as it arrives. A whole reflection
+        (not an error, a cut-short or a cancelled one) is saved to the history as `analysis_type`.
+        `stream_kwargs` (e.g. image) are passed on to stream_func.
+        Cancelling `token` stops generation in the backend at the next decoding step.
+        """
+        chunks = []
+        outcome = {}
         try:
-            result = analysis_func(text)
-            self.result_queue.put((output_widget, result, button))
+            # Long inputs are summarized part by part before the reflection; say so while that runs
+            plan = self.guardian.plan_input(text)
+            if plan["strategy"] == "map_reduce":
+                self.result_queue.put((output_widget, f"Long entry ({plan['input_tokens']} tokens): summarizing it in "
+                                                      f"{plan['chunks']} parts first...", None))
+            for delta in drain_stream(stream_func(text, cancel_event=token, **stream_kwargs), outcome):
+                if token and token.cancelled:
+                    break
+                if not chunks:
+                    # First token: replace the "Analyzing..." placeholder
+                    self.result_queue.put((output_widget, "", None))
+                chunks.append(delta)
+                self.result_queue.put((output_widget, delta, None, True))
+            # Final message carries the full text and re-enables the button
+            reflection = "".join(chunks).strip()
+            self.result_queue.put((output_widget, reflection, button))
+            complete = outcome.get("stop_reason") in COMPLETE_STOP_REASONS and not (token and token.cancelled)
+            if self.history and reflection and complete:
+                self.history.add(analysis_type, text, reflection)
         except Exception as e:
              self.result_queue.put((output_widget, f"An error occurred during analysis: {e}", button))
 
@@ -318,8 +599,12 @@ class MindGuardianGUI(tk.Tk):
         """Checks the queue for results and updates the GUI."""
         try:
             while True:
-                output_widget, result, button = self.result_queue.get_nowait()
-                self.update_output(output_widget, result, button)
+                item = self.result_queue.get_nowait()
+                # (widget, text, button) replaces the widget text; a 4th True element appends a stream delta
+                if len(item) == 4 and item[3]:
+                    self.append_output(item[0], item[1])
+                else:
+                    self.update_output(*item)
         except queue.Empty:
             pass
         finally:
@@ -344,18 +629,26 @@ class MindGuardianGUI(tk.Tk):
                  button.config(state='normal')
 
 
+    def append_output(self, output_widget, text):
+        """Appends a streamed text delta to an output widget without touching its button."""
+        output_widget.config(state='normal')
+        output_widget.insert(tk.END, text)
+        output_widget.see(tk.END)
+        output_widget.config(state='disabled')
+
+
     def start_recording(self):
         """Starts recording audio from the microphone."""
         print("Start recording button clicked.")
         # Check if PyAudio was initialized successfully
-        if not self._audio:
+        if not self._ensure_audio():
             error_message = "Audio recording is not available. PyAudio failed to initialize."
             print(f"❌ Recording Error: {error_message}")
             self.update_output(self.voice_result_output, error_message, self.record_button)
             # Removed audio_playback_button update
             return
 
-        if not self.guardian or not self.guardian.model:
+        if not self.guardian or not self.guardian.available:
             print("Recording not available: AI model not initialized.")
             self.update_output(self.voice_result_output, "Error: AI model not loaded, cannot record.", self.record_button)
             # Removed audio_playback_button update
@@ -364,27 +657,40 @@ class MindGuardianGUI(tk.Tk):
         try:
             # Removed check and stop for previous playback
 
-            self._stream = self._audio.open(format=FORMAT,
+            # Release the previous recording (memory or spill file) before capturing a new one
+            if self._last_recording:
+                self._last_recording.discard()
+                self._last_recording = None
+            if self._transcriber:
+                self._transcriber.cancel()
+            # Start transcribing in the background while the user is still speaking
+            engine = self._ensure_stt_engine()
+            self._transcriber = ChunkedTranscriber(engine, SPEECH_RATE, pool=self.pool) if engine else None
+            # Audio is stored at the speech rate: ~2.8x fewer bytes to keep, copy and transcribe
+            self._capture = AudioCaptureBuffer(SPEECH_RATE, SAMPLE_WIDTH, 1)
+            self._resampler = StreamingResampler(RATE, SPEECH_RATE, CHANNELS)
+            self._is_recording = True
+            # PyAudio calls back with every CHUNK on its own thread, so no pool worker is held while recording
+            self._stream = self._audio.open(format=self._audio.get_format_from_width(SAMPLE_WIDTH),
                                             channels=CHANNELS,
                                             rate=RATE,
                                             input=True,
-                                            frames_per_buffer=CHUNK)
-            self._is_recording = True
-            self._frames = []
-            self._last_recorded_audio_path = None
+                                            frames_per_buffer=CHUNK,
+                                            stream_callback=functools.partial(self._record_audio_chunk, self._capture,
+                                                                              self._resampler, self._transcriber))
 
             self.record_button.config(state='disabled')
             self.stop_button.config(state='normal')
             # Removed audio_playback_button update
             self.update_output(self.voice_result_output, "Recording...", None)
 
-            self._recording_thread = threading.Thread(target=self._record_audio_stream)
-            self._recording_thread.start()
-
         except Exception as e:
             error_message = f"Failed to start recording: {e}. Make sure microphone is available."
             print(f"❌ Recording Error: {error_message}")
             self._is_recording = False
+            if self._transcriber:
+                self._transcriber.cancel()
+                self._transcriber = None
             self.update_output(self.voice_result_output, error_message, self.record_button)
             # Removed audio_playback_button update
             self.record_button.config(state='normal')
@@ -400,32 +706,19 @@ class MindGuardianGUI(tk.Tk):
             # Note: We don't terminate self._audio here as it's initialized once
 
 
-    def _record_audio_stream(self):
-        """Reads audio data from the stream in a separate thread."""
-        print("Recording thread started.")
+    def _record_audio_chunk(self, capture, resampler, transcriber, in_data, frame_count, time_info, status):
+        """PyAudio stream callback: resamples one chunk into the capture (and live transcription)."""
         try:
-            # Read from stream until recording stops
-            while self._is_recording and self._stream:
-                 try:
-                     data = self._stream.read(CHUNK)
-                     self._frames.append(data)
-                 except IOError as e:
-                     # Handle potential input overflow or other stream errors
-                     print(f"❌ IOError during recording stream: {e}")
-                     # Attempt to gracefully stop recording
-                     self._is_recording = False
-                     # Put error message in queue to update GUI from main thread
-                     self.result_queue.put((self.voice_result_output, f"Recording stream error: {e}", self.record_button))
-                     # Removed audio_playback_button update
-                     break # Exit loop on error
-
+            pcm = resampler.process(in_data)
+            capture.write(pcm)
+            if transcriber:
+                transcriber.feed(pcm)
+            return None, pyaudio.paContinue
         except Exception as e:
-             print(f"❌ Error during recording stream: {e}")
-             # Put error message in queue to update GUI from main thread
-             self.result_queue.put((self.voice_result_output, f"Recording stream error: {e}", self.record_button))
-             # Removed audio_playback_button update
-        finally:
-             print("Recording thread finished.")
+            print(f"❌ Error during recording stream: {e}")
+            # Put error message in queue to update GUI from main thread; what was captured is kept on Stop
+            self.result_queue.put((self.voice_result_output, f"Recording stream error: {e}", self.record_button))
+            return None, pyaudio.paAbort
 
 
     def stop_recording(self):
@@ -438,67 +731,40 @@ class MindGuardianGUI(tk.Tk):
             self.after(0, self.stop_button.config, {'state': 'disabled'})
             return
 
-        self._is_recording = False # Signal the recording thread to stop
-
-        # Wait briefly for the recording thread to finish processing the last chunk
-        # This is a simple approach; a more robust method would involve event flags or queues
-        if self._recording_thread and self._recording_thread.is_alive():
-             self._recording_thread.join(timeout=1.0) # Wait for up to 1 second
-
+        self._is_recording = False
 
         try:
             if self._stream:
-                self._stream.stop_stream()
+                self._stream.stop_stream() # Returns once the stream callback has handled its last chunk
                 self._stream.close()
                 self._stream = None # Explicitly set to None after closing
 
             # Note: self._audio is NOT terminated here, it's kept for potential future recordings
 
-            # Save the recorded data to a WAV file
-            if self._frames:
-                print(f"DEBUG: Saving audio to {WAVE_OUTPUT_FILENAME}")
-                wf = None # Initialize wf to None
-                try:
-                    wf = wave.open(WAVE_OUTPUT_FILENAME, 'wb')
-                    wf.setnchannels(CHANNELS)
-                    # Use the sample width from the stream if available, otherwise default
-                    sampwidth = self._audio.get_sample_size(FORMAT) if self._audio else 2
-                    wf.setsampwidth(sampwidth)
-                    wf.setframerate(RATE)
-                    wf.writeframes(b''.join(self._frames))
-                    print(f"Audio saved to {WAVE_OUTPUT_FILENAME}")
-                    self._last_recorded_audio_path = WAVE_OUTPUT_FILENAME # Store the path
-
-                    # Clear frames after saving
-                    self._frames = []
-
-                    # Update GUI (from main thread)
-                    self.result_queue.put((self.voice_result_output, f"Recording stopped. Audio saved to {WAVE_OUTPUT_FILENAME}.\nReady to analyze.", self.record_button))
-                    # Removed playback button update
-
-                except Exception as e:
-                    error_message = f"Failed to save audio file: {e}"
-                    print(f"❌ File Save Error: {error_message}")
-                    self.result_queue.put((self.voice_result_output, error_message, self.record_button))
-                    self._last_recorded_audio_path = None # Error saving
-                    # Removed playback button update
-                finally:
-                     if wf:
-                         wf.close() # Ensure the wave file is closed
-
-
+            # Hand the captured audio to transcription in memory; nothing is written to disk
+            # unless the recording outgrew the capture buffer's memory budget
+            capture = self._capture
+            self._capture = None
+            if self._transcriber:
+                self._transcriber.close_input() # Only the final chunk is left to transcribe
+            if capture and capture.nbytes:
+                capture.finish()
+                self._last_recording = capture
+                where = f" (spilled to {capture.spill_path})" if capture.spilled else ""
+                print(f"Captured {capture.duration_seconds:.1f}s of audio{where}")
+                self.result_queue.put((self.voice_result_output, f"Recording stopped. Captured {capture.duration_seconds:.1f}s of audio.\nReady to analyze.", self.record_button))
             else:
                 print("No audio frames recorded.")
                 self.result_queue.put((self.voice_result_output, "Recording stopped. No audio captured.", self.record_button))
-                self._last_recorded_audio_path = None # No audio recorded
-                # Removed playback button update
+                if capture:
+                    capture.discard()
 
 
         except Exception as e:
             error_message = f"An unexpected error occurred during stop recording: {e}"
             print(f"❌ Stop Recording Error: {error_message}")
             self.result_queue.put((self.voice_result_output, error_message, self.record_button))
-            self._last_recorded_audio_path = None # Error during stop process
+            self._last_recording = None # Error during stop process
             # Removed playback button update
 
 
@@ -517,30 +783,34 @@ class MindGuardianGUI(tk.Tk):
     # Removed _play_audio_thread method
 
 
-    def transcribe_audio(self, audio_filepath):
-        """Transcribes audio from a given file path."""
-        print(f"Transcribing audio from {audio_filepath}")
-        if not self._recognizer:
-            return "Transcription failed: Speech recognition library not loaded."
+    def transcribe_audio(self, recording, transcriber=None):
+        """
+        Transcribes a finished AudioCaptureBuffer. If it was transcribed live while recording,
+        this just waits for the last chunk; otherwise its speech segments are sent to the engine.
+        """
+        print(f"Transcribing {recording.duration_seconds:.1f}s of recorded audio")
+        engine = self._ensure_stt_engine()
+        if not engine:
+            return "Transcription failed: Speech recognition engine not available."
 
         try:
-            with sr.AudioFile(audio_filepath) as source:
-                # Adjust for ambient noise and record the audio
-                self._recognizer.adjust_for_ambient_noise(source, duration=5) # Optional: adjust noise for 5 seconds
-                print("Adjusting for ambient noise...")
-                audio_data = self._recognizer.record(source)
-
-                # Use Google Web Speech API for transcription
-                print("Recognizing speech...")
-                text = self._recognizer.recognize_google(audio_data, language='pt-BR') # Using Portuguese for transcription
-                print(f"Recognition complete: {text[:100]}...")
-                return text
-        except sr.UnknownValueError:
-            return "Transcription failed: Could not understand audio."
-        except sr.RequestError as e:
-            return f"Transcription failed: Could not request results from Google Speech Recognition service; {e}"
+            if transcriber is not None:
+                text = transcriber.result(timeout=FINAL_WAIT_SECONDS) # A hung engine must not block Analyze
+            else:
+                # Only the speech segments go to the recognizer; the VAD estimates the noise floor from
+                # the quietest frames, so no part of the recording is spent on ambient noise calibration
+                speech, vad_stats = recording.speech_pcm()
+                print(f"Voice activity: {vad_stats['speech_seconds']:.1f}s of speech in {vad_stats['segments']} segment(s) "
+                      f"out of {vad_stats['recorded_seconds']:.1f}s recorded")
+                text = engine.transcribe(speech, recording.sample_rate) if speech else ""
+            if not text.strip():
+                return "Transcription failed: Could not understand audio."
+            print(f"Recognition complete: {text[:100]}...")
+            return text
+        except SpeechEngineError as e:
+            return f"Transcription failed: {e}"
         except FileNotFoundError:
-             return f"Transcription failed: Audio file not found at {audio_filepath}"
+             return f"Transcription failed: Audio file not found at {recording.spill_path}"
         except Exception as e:
             return f"Transcription failed: An unexpected error occurred; {e}"
 
@@ -548,7 +818,7 @@ class MindGuardianGUI(tk.Tk):
     def upload_image(self):
         """Handles image upload via file dialog."""
         print("Upload Image button clicked.")
-        if not self.guardian or not self.guardian.model:
+        if not self.guardian or not self.guardian.available:
             print("Image upload not available: AI model not initialized.")
             self.image_status_label.config(text="Error: AI model not loaded.", fg="red")
             return
@@ -558,10 +828,17 @@ class MindGuardianGUI(tk.Tk):
                 title="Select an Image",
                 filetypes=(("Image files", "*.jpg *.jpeg *.png *.gif"), ("All files", "*.*"))
             )
+            self.loaded_image = None
             if filepath:
                 self.loaded_image_path = filepath
                 print(f"Image selected: {filepath}")
-                self.image_status_label.config(text=f"Imagem carregada: {os.path.basename(filepath)}", fg="green")
+                if not self.guardian.supports_images:
+                    self.image_status_label.config(text=f"Imagem carregada: {os.path.basename(filepath)} "
+                                                        f"(o modelo atual analisa só a descrição)", fg="orange")
+                    return
+                # Decoding and resizing a large photo takes a while; it runs on the pool, not here
+                self.image_status_label.config(text=f"Preparando imagem: {os.path.basename(filepath)}...", fg="gray")
+                self.pool.submit(self.prepare_image, filepath, priority=INTERACTIVE, name="image-prepare")
             else:
                 self.loaded_image_path = None
                 self.image_status_label.config(text="Nenhuma imagem carregada.", fg="gray")
@@ -572,15 +849,68 @@ class MindGuardianGUI(tk.Tk):
             print(f"❌ Image Upload Error: {error_message}")
             self.image_status_label.config(text=f"Erro ao carregar imagem: {e}", fg="red")
 
-    def on_closing(self):
-        """Handles cleanup when the GUI window is closed."""
+    def prepare_image(self, filepath):
+        """Decodes, downscales and normalizes the uploaded photo. Runs on the pool."""
+        try:
+            prepared, error = self.guardian.prepare_image(filepath), None
+        except ImageError as e:
+            prepared, error = None, e
+        self.after(0, self.show_image_status, filepath, prepared, error)
+
+    def show_image_status(self, filepath, prepared, error):
+        if filepath != self.loaded_image_path:
+            return # Another photo was chosen meanwhile
+        if error:
+            print(f"❌ Image Upload Error: {error}")
+            self.loaded_image_path = None
+            self.image_status_label.config(text=f"Erro ao carregar imagem: {error}", fg="red")
+            return
+        self.loaded_image = prepared
+        width, height = prepared.source_size
+        self.image_status_label.config(text=f"Imagem carregada: {os.path.basename(filepath)} ({width}x{height})", fg="green")
+
+    def on_closing(self, drain=False):
+        """
+        Handles cleanup when the GUI window is closed. Outstanding pool tasks are cancelled
+        (generation stops at the next token), or allowed to finish first with drain=True.
+        """
         print("Closing application...")
+        with self._backend_lock:
+            self._closing = True # A backend still loading is closed by initialize_backend
         # Stop any ongoing recording
         if self._is_recording:
-            self.stop_recording() # This will attempt to stop the stream and save the file
+            self.stop_recording() # This will attempt to stop the stream and keep the capture
+
+        if self._transcriber and not drain:
+            self._transcriber.cancel()
 
         # Removed stop any ongoing playback
 
+        self.pool.shutdown(cancel=not drain, timeout=30.0 if drain else 5.0)
+        print(f"Worker pool: {self.pool.report()}")
+
+        # Commit the history records still queued for the writer thread
+        if self.history:
+            self.history.close()
+        # ...which folds them into the mood features (saved so the next start only scores new records)
+        # and queues them for the embedding index
+        if self.similar_entries:
+            self.similar_entries.close()
+        if self.analytics:
+            try:
+                self.analytics.save()
+            except OSError as e:
+                print(f"Could not save mood analytics: {e}")
+
+        # Free the last recording and delete its spill file, if any
+        if self._last_recording:
+            self._last_recording.discard()
+            self._last_recording = None
+
+        # Stop the backend's inference scheduler thread
+        if self.guardian:
+            self.guardian.close()
+
         # Terminate PyAudio instance
         if self._audio:
             try:
@@ -593,13 +923,10 @@ class MindGuardianGUI(tk.Tk):
         self.destroy()
 
 
-# Add the protocol for handling window closing
 # To run the application (this will fail in Colab/non-GUI environments)
 if __name__ == "__main__":
     try:
         app = MindGuardianGUI()
-        # Bind the closing protocol to the on_closing method
-        app.protocol("WM_DELETE_WINDOW", app.on_closing)
         app.mainloop()
     except tk.TclError as e:
         print(f"Failed to start GUI. This is expected in a non-GUI environment. Error: {e}")
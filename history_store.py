@@ -0,0 +1,200 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Local history of every analysis: the journal entry, transcript or moment and the reflection it got.
+# Records live in one SQLite file with an FTS5 index over both texts. Writes are queued and committed
+# in batches by a background thread, so saving never blocks the UI; reads page with keyset pagination
+# (WHERE id < last_seen_id ORDER BY id DESC LIMIT n), so every page costs the same however deep it is
+# and the history view never loads more than one page into memory.
+HISTORY_PATH = os.environ.get("MIND_GUARDIAN_HISTORY_DB") or os.path.join(os.path.expanduser("~"), ".mind_guardian", "history.sqlite3")
+PAGE_SIZE = 50
+FLUSH_INTERVAL_SECONDS = 0.5 # Writes arriving within this window share one transaction
+MAX_WRITE_BATCH = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    analysis TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS entries_kind ON entries (kind, id);
+"""
+
+# External-content FTS table: the index stores only tokens, the texts stay in `entries`.
+# remove_diacritics lets "ansiedade" match "Ansiedade" and "coracao" match "coração".
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    text, analysis, content='entries', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, text, analysis) VALUES (new.id, new.text, new.analysis);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, text, analysis) VALUES ('delete', old.id, old.text, old.analysis);
+END;
+"""
+
+COLUMNS = "id, created_at, kind, text, analysis"
+
+
+def fts_query(text: str) -> str:
+    """Turns free text into an FTS5 query: every word must match, the last one as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += "*" # Matches while the user is still typing the word
+    return " ".join(terms)
+
+
+class HistoryStore:
+    """
+    add() queues a record and returns immediately; a writer thread commits queued records in
+    batches. page() and search() return (records, cursor): records are dicts, newest first, and
+    passing the cursor back as `before` fetches the next page (None once there are no more).
+    Each thread gets its own SQLite connection; WAL mode lets reads run while a batch commits.
+    """
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError as e: # SQLite built without FTS5
+            print(f"History search falls back to substring matching: {e}")
+            self.full_text = False
+        self._writes = queue.Queue()
+        self._listeners = []
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def add(self, kind: str, text: str, analysis: str = "", created_at=None):
+        """Queues one record for the writer thread."""
+        self._writes.put((created_at or time.time(), kind, text, analysis))
+
+    def add_listener(self, callback):
+        """`callback(records)` runs on the writer thread after every committed batch, with the records (ids included)."""
+        self._listeners.append(callback)
+
+    def flush(self):
+        """Blocks until every record added so far is committed."""
+        self._writes.join()
+
+    def page(self, before=None, limit=PAGE_SIZE, kind=None):
+        """Newest records with id < `before`, optionally of one kind; returns (records, cursor)."""
+        clauses, params = [], []
+        if before is not None:
+            clauses.append("id < ?")
+            params.append(before)
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._query(f"SELECT {COLUMNS} FROM entries {where} ORDER BY id DESC LIMIT ?", params, limit, "page")
+
+    def search(self, text: str, before=None, limit=PAGE_SIZE):
+        """Records whose entry or reflection contains every word of `text`, newest first; returns (records, cursor)."""
+        if not text.strip():
+            return self.page(before, limit)
+        params = []
+        if self.full_text:
+            sql = f"SELECT {COLUMNS} FROM entries WHERE id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?"
+            params.append(fts_query(text))
+            if before is not None:
+                sql += " AND rowid < ?"
+                params.append(before)
+            sql += " ORDER BY rowid DESC LIMIT ?) ORDER BY id DESC LIMIT ?"
+            params.append(limit + 1)
+        else:
+            pattern = "%" + text.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            sql = f"SELECT {COLUMNS} FROM entries WHERE (text LIKE ? ESCAPE '\\' OR analysis LIKE ? ESCAPE '\\')"
+            params += [pattern, pattern]
+            if before is not None:
+                sql += " AND id < ?"
+                params.append(before)
+            sql += " ORDER BY id DESC LIMIT ?"
+        return self._query(sql, params, limit, "search")
+
+    def after(self, after_id=0, limit=PAGE_SIZE):
+        """Records with id > `after_id`, oldest first; returns (records, cursor) for catching up on new records."""
+        return self._query(f"SELECT {COLUMNS} FROM entries WHERE id > ? ORDER BY id LIMIT ?", [after_id], limit, "after")
+
+    def get(self, ids) -> list:
+        """The records with the given ids that exist, in no particular order."""
+        ids = list(ids)
+        if not ids:
+            return []
+        rows = self._connection().execute(f"SELECT {COLUMNS} FROM entries WHERE id IN ({', '.join('?' * len(ids))})", ids).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        """Commits pending writes and stops the writer thread."""
+        self._writes.put(None)
+        self._writer.join(timeout=10.0)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10.0)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL") # WAL keeps the file consistent; at worst the last batch is lost
+            self._local.connection = connection
+        return connection
+
+    def _query(self, sql, params, limit, operation):
+        started = time.perf_counter()
+        # One extra row tells whether another page follows without a COUNT query
+        rows = self._connection().execute(sql, params + [limit + 1]).fetchall()
+        metrics.REGISTRY.observe("history_query", time.perf_counter() - started, operation=operation)
+        records = [dict(row) for row in rows[:limit]]
+        cursor = records[-1]["id"] if len(rows) > limit else None
+        return records, cursor
+
+    def _write_loop(self):
+        connection = self._connection()
+        stopping = False
+        while not stopping:
+            batch = [self._writes.get()]
+            deadline = time.perf_counter() + FLUSH_INTERVAL_SECONDS
+            while len(batch) < MAX_WRITE_BATCH and batch[-1] is not None:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._writes.get(timeout=remaining) if remaining > 0 else self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+            records = [item for item in batch if item is not None]
+            started = time.perf_counter()
+            try:
+                with connection: # One transaction per batch
+                    ids = [connection.execute("INSERT INTO entries (created_at, kind, text, analysis) VALUES (?, ?, ?, ?)", record).lastrowid
+                           for record in records]
+                metrics.REGISTRY.observe("history_write_batch", time.perf_counter() - started)
+                metrics.REGISTRY.increment("history_records_written", len(records))
+                if records:
+                    committed = [dict(zip(("id", "created_at", "kind", "text", "analysis"), (record_id,) + record))
+                                 for record_id, record in zip(ids, records)]
+                    for listener in self._listeners:
+                        try:
+                            listener(committed)
+                        except Exception as e:
+                            print(f"History listener failed: {e}")
+            except sqlite3.Error as e:
+                print(f"❌ Could not save {len(records)} history record(s): {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+        connection.close()
@@ -0,0 +1,134 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+
+import metrics
+import profiling
+
+# Photos for moment analysis are decoded, downscaled and normalized once, off the UI thread, into the
+# float32 CHW array the vision encoder takes. Both that array and the encoder's output (see
+# MindGuardian) are cached by the SHA-256 of the file's bytes, so the same photo analyzed again, even
+# with a different description or from a renamed copy, is neither decoded nor encoded again.
+IMAGE_SIZE = int(os.environ.get("MIND_GUARDIAN_IMAGE_SIZE", "768")) # Gemma 3n's vision encoder takes 256, 512 or 768
+# SigLIP-style normalization to [-1, 1]; replaced by the checkpoint's image processor settings when it has them
+IMAGE_MEAN = (0.5, 0.5, 0.5)
+IMAGE_STD = (0.5, 0.5, 0.5)
+PREPARED_CACHE_SIZE = 4 # Pixel arrays are IMAGE_SIZE² x 3 float32 (7 MB at 768)
+HASH_BLOCK_BYTES = 1024 * 1024
+
+# Pillow and NumPy are imported on first use by import_image_dependencies()
+Image = None
+ImageOps = None
+np = None
+
+
+def import_image_dependencies():
+    """Imports Pillow and NumPy on first use, so importing this module stays cheap for the GUI."""
+    global Image, ImageOps, np
+    if Image is None:
+        import numpy
+        np = numpy
+        ImageOps = profiling.timed_import("PIL.ImageOps")
+        Image = profiling.timed_import("PIL.Image")
+
+
+class ImageError(Exception):
+    pass
+
+
+class LRUCache:
+    """Thread-safe, bounded mapping that evicts the least recently used entry."""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class PreparedImage:
+    """A photo ready for the vision encoder: `pixel_values` is float32 (3, size, size); `digest` identifies its content."""
+    def __init__(self, digest, pixel_values, source_size, path=None):
+        self.digest = digest
+        self.pixel_values = pixel_values
+        self.source_size = source_size # (width, height) of the original photo
+        self.path = path
+
+
+def file_digest(path) -> str:
+    """SHA-256 of the file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImagePipeline:
+    """
+    prepare(path) returns a PreparedImage. Large photos are scaled down while they are decoded
+    (JPEG decodes at 1/2, 1/4 or 1/8 scale directly) and then halved with box filters before the
+    final resize, so a full-resolution copy of a 12-megapixel photo is never held in memory.
+    """
+    def __init__(self, size=IMAGE_SIZE, mean=IMAGE_MEAN, std=IMAGE_STD, cache_size=PREPARED_CACHE_SIZE):
+        import_image_dependencies()
+        self.size = size
+        self._mean = np.asarray(mean, dtype=np.float32).reshape(3, 1, 1)
+        self._std = np.asarray(std, dtype=np.float32).reshape(3, 1, 1)
+        self.cache = LRUCache(cache_size)
+
+    def prepare(self, path) -> PreparedImage:
+        """Decodes, downscales and normalizes the photo at `path`; raises ImageError if it cannot be read."""
+        started = time.perf_counter()
+        try:
+            digest = file_digest(path)
+        except OSError as e:
+            raise ImageError(f"Could not read {path}: {e}") from e
+        prepared = self.cache.get(digest)
+        cached = prepared is not None
+        if not cached:
+            pixel_values, source_size = self._decode(path)
+            prepared = PreparedImage(digest, pixel_values, source_size, path)
+            self.cache.put(digest, prepared)
+        metrics.REGISTRY.observe("image_prepare", time.perf_counter() - started, result="hit" if cached else "miss")
+        return prepared
+
+    def _decode(self, path):
+        try:
+            with Image.open(path) as image:
+                source_size = image.size
+                # JPEG only: decode at the smallest 1/2^n scale still at least `size` on each side
+                image.draft("RGB", (self.size, self.size))
+                image = ImageOps.exif_transpose(image) # Phone photos are often stored rotated
+                image = image.convert("RGB")
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise ImageError(f"Could not decode {path}: {e}") from e
+        # Halve with a box filter while still at least twice the target; then one high-quality resize
+        while min(image.size) >= 2 * self.size:
+            image = image.reduce(2)
+        image = image.resize((self.size, self.size), Image.Resampling.BICUBIC)
+        pixels = np.asarray(image, dtype=np.float32).transpose(2, 0, 1) * (1.0 / 255.0)
+        return np.ascontiguousarray((pixels - self._mean) / self._std), source_size
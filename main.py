@@ -1,11 +1,40 @@
-import tkinter as tk
-from gui import MindGuardianGUI
+import argparse
+
+import profiling
+
+# Only the lightweight GUI shell is imported here; torch, transformers, pyaudio and
+# SpeechRecognition are deferred until the subsystem that needs them is first used.
+with profiling.phase("import tkinter"):
+    import tkinter as tk
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mind Guardian: a Gemma-powered well-being assistant.")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report per-import and per-phase wall time for startup (printed once the AI model is ready).",
+    )
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.profile_startup:
+        profiling.enable()
+
     try:
-        app = MindGuardianGUI()
+        with profiling.phase("import gui"):
+            from gui import MindGuardianGUI
+        with profiling.phase("create window"):
+            app = MindGuardianGUI()
+        # Runs once the event loop has drawn the window for the first time
+        app.after_idle(profiling.mark, "window painted")
         app.mainloop()
     except tk.TclError as e:
         print(f"Failed to start GUI. This is expected in a non-GUI environment. Error: {e}")
     except Exception as e:
-        print(f"An unexpected error occurred during GUI execution: {e}")      
\ No newline at end of file
+        print(f"An unexpected error occurred during GUI execution: {e}")
+    finally:
+        # Covers runs where the window was closed before the backend finished loading
+        profiling.print_report()
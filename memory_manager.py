@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Keeps the model resident only while it is earning its memory. After MIND_GUARDIAN_IDLE_UNLOAD_SECONDS
+# without an analysis, or as soon as the process exceeds MIND_GUARDIAN_MEMORY_BUDGET_BYTES (once the
+# model has been idle for MIN_RESIDENT_SECONDS), the model is unloaded or offloaded; the next analysis
+# reloads it. Float weights are reloaded from memory-mapped files, so that reload mostly hits the page
+# cache. int8 dynamic quantized CPU models are snapshotted on their first unload and reloaded from it:
+# no float load or quantization, but the quantized layers repack their weights into private memory,
+# so such a reload reads and copies the int8 weights (about a quarter of the float size).
+IDLE_UNLOAD_SECONDS = float(os.environ.get("MIND_GUARDIAN_IDLE_UNLOAD_SECONDS", "900")) # 0 = never unload when idle
+MEMORY_BUDGET_BYTES = int(os.environ.get("MIND_GUARDIAN_MEMORY_BUDGET_BYTES", "0")) # 0 = no budget
+MIN_RESIDENT_SECONDS = 30.0 # Over budget, a model used this recently is kept anyway (avoids unload/reload thrash)
+CHECK_INTERVAL_SECONDS = 5.0
+
+WARM = "warm"
+COLD = "cold"
+RELOADING = "reloading"
+
+
+class ModelReloadError(Exception):
+    pass
+
+
+def resident_bytes():
+    """Resident set size of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def model_bytes(model) -> int:
+    """Bytes held by the parameters and buffers of a torch module."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelMemoryManager:
+    """
+    Tracks when the model is in use and unloads it when idle. Callers wrap every use in
+    `with manager.in_use():`, which reloads a cold model first (other callers wait for that
+    reload) and keeps it resident until the block exits. `unload` and `reload` are callables
+    supplied by the owner; `measure` returns the memory compared against `budget_bytes`.
+    Listeners registered with add_listener() are called with the new state on every change.
+    """
+    def __init__(self, unload, reload, measure=resident_bytes, idle_timeout=IDLE_UNLOAD_SECONDS,
+                 budget_bytes=MEMORY_BUDGET_BYTES, name="model"):
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self.budget_bytes = budget_bytes
+        self.state = WARM
+        self.stats = {"unloads": 0, "reloads": 0, "reload_seconds": 0.0, "last_reload_seconds": None,
+                      "idle_unloads": 0, "budget_unloads": 0}
+        self._unload = unload
+        self._reload = reload
+        self._measure = measure
+        self._listeners = []
+        self._active = 0
+        self._last_used = time.monotonic()
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        metrics.REGISTRY.set_gauge("model_resident", 1, model=name)
+        if idle_timeout or budget_bytes:
+            interval = min(CHECK_INTERVAL_SECONDS, idle_timeout / 2) if idle_timeout else CHECK_INTERVAL_SECONDS
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name=f"{name}-memory", daemon=True)
+            self._watcher.start()
+
+    def add_listener(self, callback):
+        """`callback(state)` runs on the thread that changed the state; GUIs should hop to their own thread."""
+        self._listeners.append(callback)
+
+    @contextmanager
+    def in_use(self):
+        """Keeps the model resident for the duration of the block, reloading it first if it is cold (ModelReloadError on failure)."""
+        self._acquire()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._last_used = time.monotonic()
+
+    def unload(self, reason="manual") -> bool:
+        """Unloads now unless the model is in use or already cold; returns whether it was unloaded."""
+        with self._condition:
+            if self.state != WARM or self._active:
+                return False
+            self._unload()
+            self.state = COLD
+            self.stats["unloads"] += 1
+            if reason in ("idle", "budget"):
+                self.stats[f"{reason}_unloads"] += 1
+        metrics.REGISTRY.set_gauge("model_resident", 0, model=self.name)
+        metrics.REGISTRY.increment("model_unloads", model=self.name, reason=reason)
+        print(f"Model unloaded ({reason}); it will be reloaded on the next analysis.")
+        self._notify(COLD)
+        return True
+
+    def report(self) -> dict:
+        with self._condition:
+            report = dict(self.stats, state=self.state, in_use=self._active,
+                          idle_seconds=time.monotonic() - self._last_used)
+        report["resident_bytes"] = self._measure()
+        report["budget_bytes"] = self.budget_bytes or None
+        report["idle_timeout_seconds"] = self.idle_timeout or None
+        return report
+
+    def close(self):
+        self._stopped.set()
+
+    def _acquire(self):
+        with self._condition:
+            self._active += 1
+            self._last_used = time.monotonic()
+            while self.state == RELOADING:
+                self._condition.wait()
+            if self.state == WARM:
+                return
+            self.state = RELOADING # This caller reloads; later ones wait above
+        self._notify(RELOADING)
+
+        started = time.perf_counter()
+        try:
+            self._reload()
+        except Exception as e:
+            with self._condition:
+                self._active -= 1
+                self.state = COLD # The next caller tries again
+                self._condition.notify_all()
+            self._notify(COLD)
+            raise ModelReloadError(f"Could not reload the model: {e}") from e
+        seconds = time.perf_counter() - started
+        with self._condition:
+            self.state = WARM
+            self.stats["reloads"] += 1
+            self.stats["reload_seconds"] += seconds
+            self.stats["last_reload_seconds"] = seconds
+            self._condition.notify_all()
+        metrics.REGISTRY.observe("model_reload", seconds, model=self.name)
+        metrics.REGISTRY.set_gauge("model_resident", 1, model=self.name)
+        print(f"Model reloaded in {seconds:.2f}s.")
+        self._notify(WARM)
+
+    def _watch(self, interval):
+        while not self._stopped.wait(interval):
+            with self._condition:
+                if self.state != WARM or self._active:
+                    continue
+                idle = time.monotonic() - self._last_used
+            if self.idle_timeout and idle >= self.idle_timeout:
+                self.unload("idle")
+            elif self.budget_bytes and idle >= MIN_RESIDENT_SECONDS:
+                used = self._measure()
+                if used is not None and used > self.budget_bytes:
+                    print(f"Memory use {used / 2**20:.0f} MiB is over the {self.budget_bytes / 2**20:.0f} MiB budget.")
+                    self.unload("budget")
+
+    def _notify(self, state):
+        for callback in self._listeners:
+            try:
+                callback(state)
+            except Exception as e:
+                print(f"❌ Model state listener failed: {e}")
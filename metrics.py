@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Optional exporters, configured from the environment by configure_from_env()
+METRICS_JSONL_PATH = os.environ.get("MIND_GUARDIAN_METRICS_JSONL") or None
+METRICS_PORT = int(os.environ.get("MIND_GUARDIAN_METRICS_PORT", "0")) # 0 = no Prometheus endpoint
+METRICS_WINDOW = int(os.environ.get("MIND_GUARDIAN_METRICS_WINDOW", "1000"))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    In-process metrics: stage timings (kept in a rolling window per stage and label set for
+    quantiles, plus lifetime count/sum), counters, and gauges. Every recorded event is also
+    passed to the registered hooks, which is how the JSONL exporter and other sinks plug in.
+    """
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._timings = {} # (stage, label_key) -> deque of recent durations
+        self._timing_totals = {} # (stage, label_key) -> [count, sum]
+        self._counters = {} # (name, label_key) -> value
+        self._gauges = {} # (name, label_key) -> value
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """Registers `hook(event)`, called with a dict for every recorded event."""
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def observe(self, stage: str, seconds: float, **labels):
+        key = (stage, _label_key(labels))
+        with self._lock:
+            self._timings.setdefault(key, deque(maxlen=self.window)).append(seconds)
+            totals = self._timing_totals.setdefault(key, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+        self._emit({"type": "timing", "name": stage, "seconds": seconds, "labels": labels})
+
+    def increment(self, name: str, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._emit({"type": "counter", "name": name, "amount": amount, "labels": labels})
+
+    def set_gauge(self, name: str, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+        self._emit({"type": "gauge", "name": name, "value": value, "labels": labels})
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """Times the block as `stage`; extra labels can be added to the yielded dict inside the block."""
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(stage, time.perf_counter() - started, **labels)
+
+    def summary(self) -> dict:
+        """Quantiles over the rolling window plus lifetime totals, for every stage and label set."""
+        with self._lock:
+            stages = {}
+            for (stage, label_key), values in self._timings.items():
+                ordered = sorted(values)
+                count, total = self._timing_totals[(stage, label_key)]
+                entry = {"labels": dict(label_key), "count": count, "sum": total}
+                for quantile in QUANTILES:
+                    entry[f"p{int(quantile * 100)}"] = ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+                stages.setdefault(stage, []).append(entry)
+            counters = [{"name": name, "labels": dict(key), "value": value} for (name, key), value in self._counters.items()]
+            gauges = [{"name": name, "labels": dict(key), "value": value} for (name, key), value in self._gauges.items()]
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def prometheus_text(self, prefix="mind_guardian") -> str:
+        """Renders the registry in the Prometheus text exposition format."""
+        def labels_text(labels, extra=None):
+            items = sorted(labels.items()) + (extra or [])
+            if not items:
+                return ""
+            return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in items) + "}"
+
+        summary = self.summary()
+        lines = []
+        for stage, entries in sorted(summary["stages"].items()):
+            metric = f"{prefix}_{stage}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for entry in entries:
+                for quantile in QUANTILES:
+                    value = entry[f"p{int(quantile * 100)}"]
+                    lines.append(f"{metric}{labels_text(entry['labels'], [('quantile', quantile)])} {value}")
+                lines.append(f"{metric}_count{labels_text(entry['labels'])} {entry['count']}")
+                lines.append(f"{metric}_sum{labels_text(entry['labels'])} {entry['sum']}")
+        for kind, entries in (("counter", summary["counters"]), ("gauge", summary["gauges"])):
+            declared = set()
+            for entry in sorted(entries, key=lambda entry: entry["name"]):
+                metric = f"{prefix}_{entry['name']}" + ("_total" if kind == "counter" else "")
+                if metric not in declared:
+                    lines.append(f"# TYPE {metric} {kind}")
+                    declared.add(metric)
+                value = entry["value"]
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    lines.append(f"{metric}{labels_text(entry['labels'])} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _emit(self, event):
+        event["ts"] = time.time()
+        with self._lock:
+            hooks = list(self._hooks)
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                print(f"Metrics hook {hook!r} failed: {e}")
+
+
+class JsonlExporter:
+    """Hook that appends every metrics event to a JSON Lines file."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def serve_prometheus(registry, port: int, host="127.0.0.1"):
+    """Serves `registry` at http://host:port/metrics from a daemon thread; returns the server."""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Keep scrapes out of the console output
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Prometheus metrics available at http://{host}:{port}/metrics")
+    return server
+
+
+# Process-wide registry used by the backend
+REGISTRY = MetricsRegistry()
+_configured = False
+
+
+def configure_from_env(registry=REGISTRY):
+    """Attaches the exporters selected through environment variables (once per process)."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    if METRICS_JSONL_PATH:
+        registry.add_hook(JsonlExporter(METRICS_JSONL_PATH))
+        print(f"Writing metrics events to {METRICS_JSONL_PATH}")
+    if METRICS_PORT:
+        try:
+            serve_prometheus(registry, METRICS_PORT)
+        except OSError as e:
+            print(f"Could not start the metrics endpoint on port {METRICS_PORT}: {e}")
@@ -0,0 +1,185 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import profiling
+
+# Directory holding manifest.json (and, optionally, the checkpoints themselves)
+MODEL_DIR = os.environ.get("MIND_GUARDIAN_MODEL_DIR") or os.path.join(os.path.expanduser("~"), ".mind_guardian", "models")
+# With offline mode on, a model that is not registered and verified locally is an error instead of a download
+OFFLINE = os.environ.get("MIND_GUARDIAN_OFFLINE") == "1"
+
+
+class ModelRegistryError(Exception):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def has_safetensors(path: str) -> bool:
+    return any(name.endswith(".safetensors") for name in os.listdir(path))
+
+
+class ModelRegistry:
+    """
+    Local registry of model checkpoints, described by `manifest.json` in `model_dir`.
+    Each entry maps a model handle to a checkpoint directory plus the size, mtime and
+    sha256 of every file in it. resolve() never touches the network when a verified copy
+    is registered: files whose size and mtime still match the manifest are trusted without
+    rehashing, and only changed files are hashed again.
+    """
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, model_dir=MODEL_DIR, offline=OFFLINE):
+        self.model_dir = model_dir
+        self.offline = offline
+        self.manifest_path = os.path.join(model_dir, self.MANIFEST_NAME)
+        self._lock = threading.Lock()
+
+    def resolve(self, handle: str) -> str:
+        """Returns the local checkpoint directory for `handle`, downloading it only if needed."""
+        entry = self._load_manifest().get(handle)
+        if entry:
+            path = self._entry_path(entry)
+            with profiling.phase("model verify"):
+                verified = self.verify(handle)
+            if verified:
+                print(f"Using verified local model for {handle} at {path}")
+                return path
+            print(f"Local copy of {handle} failed verification.")
+
+        if self.offline:
+            raise ModelRegistryError(
+                f"Model {handle} is not available locally and offline mode is on. "
+                f"Register a copy with: python model_registry.py register {handle} <path>"
+            )
+
+        with profiling.phase("model download"):
+            path = self._download(handle)
+        self.register(handle, path)
+        return path
+
+    def register(self, handle: str, path: str):
+        """Hashes every file of the checkpoint at `path` and records it under `handle`."""
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            raise ModelRegistryError(f"Checkpoint directory not found: {path}")
+        print(f"Registering {handle} from {path} (computing checksums)...")
+        files = {}
+        for name in self._checkpoint_files(path):
+            full_path = os.path.join(path, name)
+            stat = os.stat(full_path)
+            files[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_sha256(full_path)}
+
+        with self._lock:
+            manifest = self._load_manifest()
+            manifest[handle] = {"path": self._portable_path(path), "files": files}
+            self._save_manifest(manifest)
+        print(f"Registered {handle} ({len(files)} files).")
+
+    def verify(self, handle: str, full=False) -> bool:
+        """Checks the registered files of `handle`; `full` rehashes every file regardless of mtime."""
+        with self._lock:
+            manifest = self._load_manifest()
+            entry = manifest.get(handle)
+            if not entry:
+                return False
+            path = self._entry_path(entry)
+            changed = False
+            for name, expected in entry["files"].items():
+                full_path = os.path.join(path, name)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    print(f"Missing model file: {full_path}")
+                    return False
+                if stat.st_size != expected["size"]:
+                    print(f"Size mismatch for model file: {full_path}")
+                    return False
+                if full or stat.st_mtime != expected["mtime"]:
+                    if file_sha256(full_path) != expected["sha256"]:
+                        print(f"Checksum mismatch for model file: {full_path}")
+                        return False
+                    expected["mtime"] = stat.st_mtime
+                    changed = True
+            if changed:
+                self._save_manifest(manifest)
+            return True
+
+    def fingerprint(self, handle: str):
+        """sha256 over the recorded hashes of every file of `handle`, or None if it is not registered."""
+        entry = self._load_manifest().get(handle)
+        if not entry:
+            return None
+        digest = hashlib.sha256()
+        for name in sorted(entry["files"]):
+            digest.update(f"{name}:{entry['files'][name]['sha256']}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _download(self, handle):
+        # kagglehub is only needed (and only imported) when a model has to be fetched
+        kagglehub = profiling.timed_import("kagglehub")
+        print(f"Attempting to download model from KaggleHub using path: {handle} ...")
+        path = kagglehub.model_download(handle)
+        print(f"Model downloaded to: {path}")
+        return path
+
+    def _checkpoint_files(self, path):
+        for root, _, names in os.walk(path):
+            for name in names:
+                yield os.path.relpath(os.path.join(root, name), path)
+
+    def _portable_path(self, path):
+        # Checkpoints inside model_dir are stored relative to it, so the whole directory can be copied between hosts
+        model_dir = os.path.abspath(self.model_dir)
+        if os.path.commonpath([path, model_dir]) == model_dir:
+            return os.path.relpath(path, model_dir)
+        return path
+
+    def _entry_path(self, entry):
+        return os.path.join(self.model_dir, entry["path"])
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Ignoring unreadable model manifest {self.manifest_path}: {e}")
+            return {}
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.model_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local Mind Guardian model registry.")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    register_parser = subparsers.add_parser("register", help="Record checksums for a local checkpoint directory.")
+    register_parser.add_argument("handle")
+    register_parser.add_argument("path")
+    verify_parser = subparsers.add_parser("verify", help="Rehash every file of a registered model.")
+    verify_parser.add_argument("handle")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.model_dir)
+    if args.command == "register":
+        registry.register(args.handle, args.path)
+    else:
+        ok = registry.verify(args.handle, full=True)
+        print(f"{args.handle}: {'verified' if ok else 'FAILED verification'}")
+        raise SystemExit(0 if ok else 1)
@@ -0,0 +1,339 @@
+import os
+import re
+import threading
+import time
+
+import metrics
+from audio_capture import import_numpy
+
+# Mood trends over the saved analyses. Each history record is reduced once, when it is committed, to a
+# few numbers (entry length and emotion scores from the entry and its reflection) kept in columnar NumPy
+# arrays. Per-day aggregates are updated as each record arrives, so daily and weekly trends read a few
+# hundred bucket rows instead of re-scanning, let alone re-analyzing, the history. The columns are saved
+# to a small .npz file; on startup only the records added since then are scored.
+ANALYTICS_PATH = os.environ.get("MIND_GUARDIAN_ANALYTICS_PATH") or os.path.join(os.path.expanduser("~"), ".mind_guardian", "mood_features.npz")
+INITIAL_CAPACITY = 1024 # Columns double when full, so appends are amortized O(1)
+SYNC_PAGE_SIZE = 500
+
+KINDS = ("journal", "audio_transcript", "moment")
+# Words counted for each emotion, in the entry and in the reflection (which names the emotions the model
+# inferred, e.g. "you sound anxious"). Whole words with their inflections, English then Portuguese,
+# written without accents; prefixes would also count "happened", "chores" or "solid".
+EMOTION_WORDS = {
+    "joy": (
+        "happy happier happiest happily happiness joy joyful joyous glad gladly grateful gratitude thankful "
+        "excited exciting excitement hopeful proud love loved loving lovely delighted cheerful "
+        "feliz felizes felicidade alegre alegres alegria grato grata gratos gratas gratidao esperancoso "
+        "esperancosa orgulho orgulhoso orgulhosa amor animado animada"
+    ),
+    "calm": (
+        "calm calmer calmly calmness relax relaxed relaxing relaxation peace peaceful relieved relief tranquil "
+        "serene serenity rested "
+        "calmo calma calmos calmas tranquilo tranquila tranquilidade paz aliviado aliviada alivio relaxado "
+        "relaxada descansado descansada sereno serena"
+    ),
+    "sadness": (
+        "sad sadder saddest sadly sadness lonely loneliness tears tearful cry cried cries crying grief grieve "
+        "grieving hopeless hopelessness empty emptiness depressed depressing depression miserable heartbroken "
+        "triste tristes tristeza sozinho sozinha solidao solitario solitaria chorar chorei chorou chorando "
+        "choro vazio vazia deprimido deprimida depressao"
+    ),
+    "anxiety": (
+        "anxious anxiety anxieties worry worried worries worrying nervous nervousness stress stressed stressful "
+        "panic panicked panicking fear fears feared afraid scared overwhelmed overwhelming tense tension uneasy "
+        "ansioso ansiosa ansiedade preocupado preocupada preocupacao medo estresse estressado estressada "
+        "nervoso nervosa panico tenso tensa"
+    ),
+    "anger": (
+        "anger angry angrier angrily frustrated frustrating frustration irritated irritating irritation "
+        "irritable annoyed annoying annoyance furious fury resent resentful resentment rage "
+        "raiva irritado irritada irritante frustrado frustrada frustracao furioso furiosa zangado zangada"
+    ),
+}
+EMOTIONS = tuple(EMOTION_WORDS)
+_WORD_EMOTIONS = {word: index for index, words in reversed(list(enumerate(EMOTION_WORDS.values()))) for word in words.split()}
+SCORING_VERSION = 2 # Saved features scored by another version are rebuilt from the history
+POSITIVE = ("joy", "calm")
+FEATURES = EMOTIONS + ("valence",) # Valence: (positive - negative) / emotional words, in [-1, 1]; 0 with none
+_WORD = re.compile(r"\w+")
+_ACCENTS = str.maketrans("áàâãäéèêëíìîïóòôõöúùûüç", "aaaaaeeeeiiiiooooouuuuc")
+
+
+def word_emotion(word: str):
+    """Index in EMOTIONS of the emotion `word` (lowercase, without accents) expresses, or None."""
+    return _WORD_EMOTIONS.get(word)
+
+
+def entry_features(text: str, analysis: str = ""):
+    """(word count of the entry, [emotion words per 100 words for each of EMOTIONS] + [valence])."""
+    entry_words = _WORD.findall(text.lower().translate(_ACCENTS))
+    all_words = entry_words + _WORD.findall(analysis.lower().translate(_ACCENTS))
+    hits = [0] * len(EMOTIONS)
+    for word in all_words:
+        index = word_emotion(word)
+        if index is not None:
+            hits[index] += 1
+    total_words = max(len(all_words), 1)
+    positive = sum(count for emotion, count in zip(EMOTIONS, hits) if emotion in POSITIVE)
+    emotional = sum(hits)
+    valence = (2 * positive - emotional) / emotional if emotional else 0.0
+    return len(entry_words), [100.0 * count / total_words for count in hits] + [valence]
+
+
+def local_day(timestamp: float) -> int:
+    """Days since 1970-01-01 in local time, so entries bucket by the user's calendar day."""
+    return int((timestamp + time.localtime(timestamp).tm_gmtoff) // 86400)
+
+
+def week_of(days):
+    """Monday-based week number of day numbers (1970-01-01 was a Thursday)."""
+    return (days + 3) // 7
+
+
+class MoodAnalytics:
+    """
+    Per-entry features in columns (id, created_at, day, kind, length, FEATURES) plus running per-day
+    sums, both appended to as records are committed. attach() subscribes to a HistoryStore's commits
+    and sync() catches up on records it has not seen. summary() and trend() answer range and bucket
+    queries with vectorized NumPy operations; both return plain dicts of lists. Thread-safe.
+    """
+    def __init__(self, path=ANALYTICS_PATH):
+        np = import_numpy()
+        self.path = path
+        self.last_id = 0 # Highest history id folded in; records arrive in id order
+        self._history = None
+        self._lock = threading.Lock()
+        self._size = 0
+        self._ids = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self._times = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self._days = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self._kinds = np.zeros(INITIAL_CAPACITY, dtype=np.int8)
+        self._lengths = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self._features = np.zeros((INITIAL_CAPACITY, len(FEATURES)), dtype=np.float32)
+        self._time_sorted = True # False after an out-of-order created_at, until the next query re-sorts
+        # Rolling per-day aggregates, sorted by day
+        self._bucket_days = np.zeros(0, dtype=np.int32)
+        self._bucket_counts = np.zeros(0, dtype=np.int64)
+        self._bucket_lengths = np.zeros(0, dtype=np.float64)
+        self._bucket_sums = np.zeros((0, len(FEATURES)), dtype=np.float64)
+        if path and os.path.exists(path):
+            try:
+                self._load()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Mood analytics will be rebuilt from the history: {e}")
+
+    def __len__(self):
+        return self._size
+
+    def attach(self, history):
+        """Folds in every record `history` commits from now on; call sync() to catch up on older ones."""
+        self._history = history
+        history.add_listener(self._on_committed)
+
+    def sync(self):
+        """Scores the attached history's records newer than last_id, a page at a time; returns how many were added."""
+        added = 0
+        while self._history is not None:
+            records, cursor = self._history.after(self.last_id, limit=SYNC_PAGE_SIZE)
+            added += self.add(records)
+            if cursor is None:
+                break
+        return added
+
+    def add(self, records):
+        """Folds history records (dicts with id, created_at, kind, text, analysis) in; ones already seen are skipped."""
+        records = [record for record in records if record["id"] > self.last_id]
+        if not records:
+            return 0
+        started = time.perf_counter()
+        rows = [(record["id"], record["created_at"], local_day(record["created_at"]), record["kind"])
+                + entry_features(record["text"], record.get("analysis", "")) for record in records]
+        with self._lock:
+            rows = [row for row in rows if row[0] > self.last_id] # A concurrent sync() may have added them
+            if rows:
+                self._append(rows)
+        metrics.REGISTRY.observe("analytics_update", time.perf_counter() - started)
+        return len(rows)
+
+    def summary(self, start=None, end=None, kind=None) -> dict:
+        """Entry count, mean length and mean FEATURES of the entries created in [start, end)."""
+        np = import_numpy()
+        started = time.perf_counter()
+        with self._lock:
+            selection = self._select(start, end, kind)
+            lengths = self._lengths[selection].copy()
+            features = self._features[selection].copy()
+        count = len(lengths)
+        result = {"count": count, "length": float(lengths.mean()) if count else 0.0}
+        means = features.mean(axis=0, dtype=np.float64) if count else np.zeros(len(FEATURES))
+        result.update(zip(FEATURES, means.tolist()))
+        metrics.REGISTRY.observe("analytics_query", time.perf_counter() - started, operation="summary")
+        return result
+
+    def trend(self, bucket="day", start=None, end=None, kind=None) -> dict:
+        """
+        Per-bucket entry count, mean length and mean FEATURES for bucket "day" or "week" (starting Monday),
+        over whole local days: from the day of `start` up to, not including, the day of `end`.
+        Buckets without entries are omitted; "date" is each bucket's first day.
+        """
+        np = import_numpy()
+        if bucket not in ("day", "week"):
+            raise ValueError(f"Unknown trend bucket '{bucket}'.")
+        started = time.perf_counter()
+        with self._lock:
+            if kind is None:
+                # Every kind: read the rolling per-day aggregates
+                low = 0 if start is None else np.searchsorted(self._bucket_days, local_day(start))
+                high = len(self._bucket_days) if end is None else np.searchsorted(self._bucket_days, local_day(end))
+                days = self._bucket_days[low:high].copy() # Copies: new records update the buckets in place
+                counts = self._bucket_counts[low:high].copy()
+                lengths = self._bucket_lengths[low:high].copy()
+                sums = self._bucket_sums[low:high].copy()
+            else:
+                self._sort_by_time()
+                day_column = self._days[:self._size] # Sorted along with the times
+                low = 0 if start is None else int(np.searchsorted(day_column, local_day(start)))
+                high = self._size if end is None else int(np.searchsorted(day_column, local_day(end)))
+                rows = low + np.flatnonzero(self._kinds[low:high] == KINDS.index(kind))
+                days, counts, lengths, sums = _day_sums(self._days[rows], self._lengths[rows], self._features[rows])
+        if bucket == "week" and len(days):
+            weeks = week_of(days)
+            first = np.flatnonzero(np.diff(weeks, prepend=weeks[0] - 1)) # Days are sorted, so weeks are too
+            days = weeks[first] * 7 - 3
+            counts = np.add.reduceat(counts, first)
+            lengths = np.add.reduceat(lengths, first)
+            sums = np.add.reduceat(sums, first, axis=0)
+        divisor = np.maximum(counts, 1)
+        result = {
+            "date": days.astype("datetime64[D]").astype(str).tolist(),
+            "count": counts.tolist(),
+            "length": (lengths / divisor).tolist(),
+        }
+        means = sums / divisor[:, None]
+        for index, feature in enumerate(FEATURES):
+            result[feature] = means[:, index].tolist()
+        metrics.REGISTRY.observe("analytics_query", time.perf_counter() - started, operation=f"trend_{bucket}")
+        return result
+
+    def save(self):
+        """Writes the feature columns to `path` (atomically), so the next start only scores new records."""
+        np = import_numpy()
+        if not self.path:
+            return
+        with self._lock:
+            size = self._size
+            columns = dict(ids=self._ids[:size], times=self._times[:size], days=self._days[:size], kinds=self._kinds[:size],
+                           lengths=self._lengths[:size], features=self._features[:size], last_id=np.int64(self.last_id),
+                           feature_names=np.array(FEATURES), scoring_version=np.int64(SCORING_VERSION))
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temporary = self.path + ".tmp.npz"
+            np.savez(temporary, **columns)
+            os.replace(temporary, self.path)
+
+    def _on_committed(self, records):
+        if records and records[0]["id"] > self.last_id + 1 and self._history is not None:
+            self.sync() # Records before this batch have not been folded in yet; sync() fetches them all in order
+        else:
+            self.add(records)
+
+    def _append(self, rows):
+        """Appends feature rows and updates the per-day aggregates. Caller holds the lock."""
+        np = import_numpy()
+        count = len(rows)
+        if self._size + count > len(self._ids):
+            self._grow(max(2 * len(self._ids), self._size + count))
+        ids, times, days, kinds, lengths, features = zip(*rows)
+        end = self._size + count
+        self._ids[self._size:end] = ids
+        self._times[self._size:end] = times
+        self._days[self._size:end] = days
+        self._kinds[self._size:end] = [KINDS.index(kind) if kind in KINDS else -1 for kind in kinds]
+        self._lengths[self._size:end] = lengths
+        self._features[self._size:end] = features
+        previous = self._times[self._size - 1] if self._size else -np.inf
+        if self._time_sorted and (times[0] < previous or any(b < a for a, b in zip(times, times[1:]))):
+            self._time_sorted = False
+        self._merge_days(*_day_sums(self._days[self._size:end], self._lengths[self._size:end], self._features[self._size:end]))
+        self._size = end
+        self.last_id = max(self.last_id, max(ids))
+
+    def _merge_days(self, days, counts, lengths, sums):
+        """Adds per-day sums to the rolling aggregates; new entries almost always land in the last day."""
+        np = import_numpy()
+        positions = np.searchsorted(self._bucket_days, days)
+        existing = np.zeros(len(days), dtype=bool)
+        inside = positions < len(self._bucket_days)
+        existing[inside] = self._bucket_days[positions[inside]] == days[inside]
+        self._bucket_counts[positions[existing]] += counts[existing]
+        self._bucket_lengths[positions[existing]] += lengths[existing]
+        self._bucket_sums[positions[existing]] += sums[existing]
+        new = ~existing
+        if new.any():
+            self._bucket_days = np.insert(self._bucket_days, positions[new], days[new])
+            self._bucket_counts = np.insert(self._bucket_counts, positions[new], counts[new])
+            self._bucket_lengths = np.insert(self._bucket_lengths, positions[new], lengths[new])
+            self._bucket_sums = np.insert(self._bucket_sums, positions[new], sums[new], axis=0)
+
+    def _grow(self, capacity):
+        np = import_numpy()
+        for name in ("_ids", "_times", "_days", "_kinds", "_lengths", "_features"):
+            column = getattr(self, name)
+            grown = np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def _sort_by_time(self):
+        """Re-sorts the columns by created_at after out-of-order records (e.g. imported archives). Caller holds the lock."""
+        np = import_numpy()
+        if not self._time_sorted:
+            order = np.argsort(self._times[:self._size], kind="stable")
+            for name in ("_ids", "_times", "_days", "_kinds", "_lengths", "_features"):
+                column = getattr(self, name)
+                column[:self._size] = column[:self._size][order]
+            self._time_sorted = True
+
+    def _select(self, start, end, kind):
+        """Row slice (or index array, with `kind`) of the entries created in [start, end). Caller holds the lock."""
+        np = import_numpy()
+        self._sort_by_time()
+        times = self._times[:self._size]
+        low = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        high = self._size if end is None else int(np.searchsorted(times, end, side="left"))
+        selection = slice(low, max(low, high))
+        if kind is not None:
+            return low + np.flatnonzero(self._kinds[selection] == KINDS.index(kind))
+        return selection
+
+    def _load(self):
+        np = import_numpy()
+        with np.load(self.path) as data:
+            version = int(data["scoring_version"]) if "scoring_version" in data.files else 1
+            if tuple(data["feature_names"].tolist()) != FEATURES or version != SCORING_VERSION:
+                raise ValueError("the saved features are from another version")
+            size = len(data["ids"])
+            self._grow(max(INITIAL_CAPACITY, 2 * size))
+            self._ids[:size] = data["ids"]
+            self._times[:size] = data["times"]
+            self._days[:size] = data["days"]
+            self._kinds[:size] = data["kinds"]
+            self._lengths[:size] = data["lengths"]
+            self._features[:size] = data["features"]
+            self.last_id = int(data["last_id"])
+        self._size = size
+        self._time_sorted = bool(np.all(np.diff(self._times[:size]) >= 0))
+        self._bucket_days, self._bucket_counts, self._bucket_lengths, self._bucket_sums = \
+            _day_sums(self._days[:size], self._lengths[:size], self._features[:size])
+
+
+def _day_sums(days, lengths, features):
+    """(sorted distinct days, entries, summed lengths, summed features) per day, with one sort and reduceat."""
+    np = import_numpy()
+    if not len(days):
+        return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64),
+                np.zeros((0, len(FEATURES)), dtype=np.float64))
+    order = np.argsort(days, kind="stable")
+    days = days[order]
+    first = np.flatnonzero(np.diff(days, prepend=days[0] - 1))
+    return (days[first].astype(np.int32), np.diff(np.append(first, len(days))).astype(np.int64),
+            np.add.reduceat(lengths[order].astype(np.float64), first),
+            np.add.reduceat(features[order].astype(np.float64), first, axis=0))
@@ -0,0 +1,521 @@
+import collections
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+from model_registry import MODEL_DIR
+
+# Process-pool inference for many-core CPU hosts: N worker processes, each pinned to its own
+# subset of physical cores and running its own MindGuardian (and so its own batching scheduler).
+# The weights are written once as a single torch.save file that every worker memory-maps, so the
+# read-only tensors live once in the page cache instead of once per process. The parent routes
+# each analysis to the worker with the fewest requests in flight.
+#
+#   MIND_GUARDIAN_PROCESS_WORKERS=8 python server.py      (or: python server.py --process-workers 8)
+PROCESS_WORKERS = int(os.environ.get("MIND_GUARDIAN_PROCESS_WORKERS", "0")) # 0 = single-process mode
+CORES_PER_WORKER = int(os.environ.get("MIND_GUARDIAN_CORES_PER_WORKER", "0")) # 0 = split the cores evenly
+SHARED_WEIGHTS_DIR = os.environ.get("MIND_GUARDIAN_SHARED_WEIGHTS_DIR") or os.path.join(MODEL_DIR, "shared")
+WORKER_START_TIMEOUT = 600.0
+WATCH_INTERVAL = 0.5 # Seconds between checks that the worker processes are still alive
+PACKED_PARAMS = "._packed_params._packed_params" # State dict key suffix of int8 dynamic quantized linear layers
+
+
+def physical_cpus() -> list:
+    """One logical CPU per physical core this process may use, ordered by socket then core."""
+    try:
+        logical = sorted(os.sched_getaffinity(0))
+    except AttributeError: # Not available on macOS/Windows
+        return list(range(os.cpu_count() or 1))
+    seen = {}
+    for cpu in logical:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(os.path.join(topology, "physical_package_id")) as f:
+                package = int(f.read())
+            with open(os.path.join(topology, "core_id")) as f:
+                core = int(f.read())
+        except (OSError, ValueError):
+            package, core = 0, cpu
+        seen.setdefault((package, core), cpu) # Hyper-threaded siblings map to the same core
+    return [seen[key] for key in sorted(seen)]
+
+
+def core_groups(workers, cores_per_worker=CORES_PER_WORKER) -> list:
+    """Disjoint lists of CPUs, one per worker (neighbouring cores, so a worker stays on one socket)."""
+    cpus = physical_cpus()
+    per_worker = cores_per_worker or max(1, len(cpus) // workers)
+    if per_worker * workers > len(cpus):
+        print(f"Only {len(cpus)} physical cores for {workers} workers x {per_worker}; workers will share cores.")
+    return [sorted({cpus[(i * per_worker + j) % len(cpus)] for j in range(per_worker)}) for i in range(workers)]
+
+
+def export_shared_snapshot(model, tokenizer, directory):
+    """
+    Writes config, tokenizer and all weights (one torch.save file) for workers to memory-map, plus
+    the buffers the state dict leaves out (e.g. rotary frequencies), which the loader cannot recompute.
+    """
+    import torch
+
+    weights_path = os.path.join(directory, "weights.pt")
+    buffers_path = os.path.join(directory, "buffers.pt")
+    if os.path.exists(weights_path) and os.path.exists(buffers_path):
+        return directory
+    os.makedirs(directory, exist_ok=True)
+    model.config.save_pretrained(directory)
+    tokenizer.save_pretrained(directory)
+    state_dict = model.state_dict()
+    for path, tensors in ((buffers_path, {name: buffer for name, buffer in model.named_buffers() if name not in state_dict}),
+                          (weights_path, state_dict)):
+        tmp_path = path + ".tmp"
+        torch.save(tensors, tmp_path)
+        os.replace(tmp_path, path)
+    print(f"Shared weights written to {weights_path}")
+    return directory
+
+
+def load_shared_model(directory):
+    """
+    Builds the model of a snapshot with its parameters backed by the memory-mapped weights file.
+    The skeleton is created on the meta device, so no private copy of the weights is ever allocated
+    or initialized: every parameter is the mapped tensor itself. Snapshots of int8 dynamic quantized
+    models (see cpu_inference) get their quantized linear layers back; those repack their weights into
+    private memory, but from the int8 data, without a float load or quantizing again.
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    state_dict = torch.load(os.path.join(directory, "weights.pt"), mmap=True, weights_only=True)
+    dtype = next(tensor.dtype for tensor in state_dict.values() if torch.is_tensor(tensor) and tensor.is_floating_point())
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(directory), torch_dtype=dtype)
+    quantized = [key[:-len(PACKED_PARAMS)] for key in state_dict if key.endswith(PACKED_PARAMS)]
+    for name in quantized:
+        # One layer at a time, so only one placeholder of the quantized weights exists at once
+        linear = model.get_submodule(name)
+        layer = torch.ao.nn.quantized.dynamic.Linear(linear.in_features, linear.out_features,
+                                                     bias_=linear.bias is not None, dtype=torch.qint8)
+        prefix = name + "."
+        layer_state = collections.OrderedDict((key[len(prefix):], state_dict.pop(key)) for key in list(state_dict) if key.startswith(prefix))
+        # The serialization version in the metadata tells the layer how its weights were saved
+        layer_state._metadata = {key[len(prefix):] if key != name else "": value for key, value in state_dict._metadata.items()
+                                 if key == name or key.startswith(prefix)}
+        layer.load_state_dict(layer_state)
+        parent, _, child = name.rpartition(".")
+        setattr(model.get_submodule(parent), child, layer)
+    if quantized:
+        # load_state_dict would look for the consumed keys of the quantized layers: adopt the rest directly
+        unexpected = []
+        for key, tensor in state_dict.items():
+            module_name, _, attribute = key.rpartition(".")
+            module = model.get_submodule(module_name)
+            if attribute in module._parameters:
+                module._parameters[attribute] = torch.nn.Parameter(tensor, requires_grad=False)
+            elif attribute in module._buffers:
+                module._buffers[attribute] = tensor
+            else:
+                unexpected.append(key)
+    else:
+        # assign=True adopts the mapped tensors instead of copying them into the (unallocated) parameters
+        unexpected = model.load_state_dict(state_dict, assign=True).unexpected_keys
+    for name, buffer in torch.load(os.path.join(directory, "buffers.pt"), weights_only=True).items():
+        module_name, _, buffer_name = name.rpartition(".")
+        model.get_submodule(module_name).register_buffer(buffer_name, buffer, persistent=False)
+    if not quantized: # A quantized output layer is no longer tied to the embeddings
+        model.tie_weights()
+    missing = [name for name, tensor in itertools.chain(model.named_parameters(), model.named_buffers()) if tensor.is_meta]
+    if missing or unexpected:
+        raise RuntimeError(f"The snapshot in {directory} does not match its config: "
+                           f"missing {', '.join(missing) or 'nothing'}, unexpected {', '.join(unexpected) or 'nothing'}.")
+    return model.eval()
+
+
+def load_shared_snapshot(directory):
+    """Returns (model, tokenizer) of a snapshot written by export_shared_snapshot."""
+    from transformers import AutoTokenizer
+
+    return load_shared_model(directory), AutoTokenizer.from_pretrained(directory)
+
+
+def _worker_main(index, cores, snapshot_dir, deterministic, requests, results):
+    """Entry point of a worker process: serves analyses from `requests` until it receives None."""
+    # Exporters (JSONL file, Prometheus port) belong to the parent process
+    metrics.METRICS_JSONL_PATH = None
+    metrics.METRICS_PORT = 0
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    from cpu_inference import configure_threads
+    configure_threads(len(cores) if cores else 0)
+    from backend import MindGuardian, drain_stream
+
+    try:
+        model, tokenizer = load_shared_snapshot(snapshot_dir)
+        # The pool owns process lifetimes; a worker dropping its mapped weights would gain nothing
+        guardian = MindGuardian(deterministic=deterministic, model=model, tokenizer=tokenizer, cache_responses=False,
+                                idle_unload_seconds=0, memory_budget_bytes=0)
+    except Exception as e:
+        results.put((index, None, "failed", str(e)))
+        return
+    results.put((index, None, "ready", None))
+
+    cancel_events = {}
+    # Concurrent requests reach this worker's scheduler together, so they can still be batched
+    executor = ThreadPoolExecutor(max_workers=guardian.max_batch_size, thread_name_prefix=f"worker-{index}")
+
+    def handle(request_id, method, args):
+        try:
+            if method.startswith("stream_"):
+                # Streams take the cancel event second: stream_moment(text, cancel_event, image)
+                outcome = {}
+                for delta in drain_stream(getattr(guardian, method)(args[0], cancel_events[request_id], *args[1:]), outcome):
+                    results.put((index, request_id, "delta", delta))
+                results.put((index, request_id, "done", outcome["stop_reason"]))
+            else:
+                results.put((index, request_id, "done", getattr(guardian, method)(*args)))
+        except Exception as e:
+            results.put((index, request_id, "error", str(e)))
+        finally:
+            cancel_events.pop(request_id, None)
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        kind, request_id, method, args = message
+        if kind == "cancel":
+            if request_id in cancel_events:
+                cancel_events[request_id].set()
+            continue
+        cancel_events[request_id] = threading.Event()
+        executor.submit(handle, request_id, method, args)
+    executor.shutdown(wait=True)
+    guardian.close()
+    results.put((index, None, "stopped", dict(guardian.scheduler.stats)))
+
+
+class WorkerState:
+    """Parent-side bookkeeping for one worker process."""
+    def __init__(self, index, cores, process, requests):
+        self.index = index
+        self.cores = cores
+        self.process = process
+        self.requests = requests
+        self.ready = False
+        self.exited = False # The process died (or was stopped); its requests have been failed
+        self.in_flight = 0
+        self.completed = 0
+        self.output_tokens = 0
+        self.busy_seconds = 0.0
+        self.busy_since = None
+
+
+class ProcessPoolGuardian:
+    """
+    Same analysis interface as MindGuardian (analyze_*, stream_*, analyze_batch, count_tokens,
+    inference_report, close), served by `workers` processes that share memory-mapped weights.
+    `model` and `tokenizer` inject a pre-built model (e.g. benchmark.build_tiny_model); otherwise
+    Gemma is loaded once in the CPU float dtype, snapshotted to SHARED_WEIGHTS_DIR and released.
+    """
+    def __init__(self, workers=None, cores_per_worker=CORES_PER_WORKER, deterministic=None, model=None, tokenizer=None,
+                 registry=None):
+        from backend import DETERMINISTIC_GENERATION
+
+        workers = workers or PROCESS_WORKERS or 2
+        self.deterministic = DETERMINISTIC_GENERATION if deterministic is None else deterministic
+        self._temp_dir = None
+        snapshot_dir, self.tokenizer = self._prepare_snapshot(model, tokenizer, registry)
+
+        context = multiprocessing.get_context("spawn") # Fresh interpreters: no forked torch thread pools
+        self._results = context.Queue()
+        self._workers = []
+        for index, cores in enumerate(core_groups(workers, cores_per_worker)):
+            requests = context.Queue()
+            process = context.Process(
+                target=_worker_main, name=f"mind-guardian-worker-{index}", daemon=True,
+                args=(index, cores, snapshot_dir, self.deterministic, requests, self._results),
+            )
+            process.start()
+            self._workers.append(WorkerState(index, cores, process, requests))
+            print(f"Started inference worker {index} (pid {process.pid}) on cores {cores}")
+
+        self._pending = {} # request_id -> (worker, Future or delta queue)
+        self._closing = False
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.started_at = time.perf_counter()
+        self._collector = threading.Thread(target=self._collect, name="process-pool-results", daemon=True)
+        self._collector.start()
+        if not self._ready.wait(WORKER_START_TIMEOUT):
+            print("❌ No inference worker became ready.")
+
+    @property
+    def model(self):
+        """Truthy once at least one worker is serving (mirrors MindGuardian.model checks)."""
+        return any(worker.ready for worker in self._workers)
+
+    def _prepare_snapshot(self, model, tokenizer, registry):
+        if model is not None and tokenizer is not None:
+            self._temp_dir = tempfile.mkdtemp(prefix="mind_guardian_shared_")
+            return export_shared_snapshot(model, tokenizer, self._temp_dir), tokenizer
+
+        from backend import GEMMA_MODEL_HANDLE, import_dependencies
+        import backend
+        from cpu_inference import best_float_dtype, load_cpu_model
+        from model_registry import ModelRegistry, has_safetensors
+
+        import_dependencies()
+        registry = registry or ModelRegistry()
+        path = registry.resolve(GEMMA_MODEL_HANDLE)
+        dtype = best_float_dtype() # int8 dynamic quantization would give every worker private weights
+        snapshot_dir = os.path.join(SHARED_WEIGHTS_DIR, GEMMA_MODEL_HANDLE.replace("/", "--") + f"-{dtype}")
+        tokenizer = backend.AutoTokenizer.from_pretrained(path, local_files_only=True)
+        if not all(os.path.exists(os.path.join(snapshot_dir, name)) for name in ("weights.pt", "buffers.pt")):
+            load_kwargs = dict(local_files_only=True, low_cpu_mem_usage=True)
+            if has_safetensors(path):
+                load_kwargs["use_safetensors"] = True
+            model, _ = load_cpu_model(backend.AutoModelForCausalLM, path, load_kwargs, mode=dtype)
+            export_shared_snapshot(model, tokenizer, snapshot_dir)
+            del model # The parent only routes requests; the workers hold the (shared) weights
+        return snapshot_dir, tokenizer
+
+    # Analysis interface (same names as MindGuardian)
+
+    def analyze_journal(self, journal_text: str) -> str:
+        return self._call("analyze_journal", journal_text)
+
+    def analyze_audio_transcript(self, transcript_text: str) -> str:
+        return self._call("analyze_audio_transcript", transcript_text)
+
+    def analyze_moment(self, moment_description: str, image=None) -> str:
+        """`image` is best given as a path: each worker decodes and encodes photos with its own caches."""
+        return self._call("analyze_moment", moment_description, image)
+
+    def stream_journal(self, journal_text: str, cancel_event=None):
+        return self._stream("stream_journal", journal_text, cancel_event)
+
+    def stream_audio_transcript(self, transcript_text: str, cancel_event=None):
+        return self._stream("stream_audio_transcript", transcript_text, cancel_event)
+
+    def stream_moment(self, moment_description: str, cancel_event=None, image=None):
+        return self._stream("stream_moment", moment_description, cancel_event, image)
+
+    def analyze_batch(self, analysis_type: str, texts) -> list:
+        """
+        Splits the texts into one contiguous slice per ready worker; results come back in input order.
+        Like MindGuardian.analyze_batch, failures are returned as messages in place of the replies.
+        """
+        texts = list(texts)
+        if not self.model:
+            from backend import UNAVAILABLE_MESSAGE
+            return [UNAVAILABLE_MESSAGE] * len(texts)
+        ready = [worker for worker in self._workers if worker.ready] or self._workers
+        size = -(-len(texts) // len(ready)) if texts else 0
+        slices = []
+        for start in range(0, len(texts), size or 1):
+            future = Future()
+            try:
+                future = self._submit("analyze_batch", (analysis_type, texts[start:start + size]))[2]
+            except RuntimeError as e: # The last worker exited since the check above
+                future.set_exception(e)
+            slices.append((len(texts[start:start + size]), future))
+        results = []
+        for count, future in slices:
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                results.extend([f"An error occurred during text generation: {e}"] * count)
+        return results
+
+    def count_tokens(self, texts) -> list:
+        return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    def inference_report(self) -> dict:
+        """Aggregate throughput and per-worker utilization since the pool started."""
+        elapsed = time.perf_counter() - self.started_at
+        now = time.perf_counter()
+        workers = []
+        with self._lock:
+            for worker in self._workers:
+                busy = worker.busy_seconds + (now - worker.busy_since if worker.busy_since is not None else 0.0)
+                workers.append({
+                    "worker": worker.index,
+                    "pid": worker.process.pid,
+                    "cores": worker.cores,
+                    "ready": worker.ready,
+                    "in_flight": worker.in_flight,
+                    "completed": worker.completed,
+                    "utilization": busy / elapsed if elapsed else 0.0,
+                })
+            completed = sum(worker.completed for worker in self._workers)
+            output_tokens = sum(worker.output_tokens for worker in self._workers)
+        for entry in workers:
+            metrics.REGISTRY.set_gauge("process_worker_utilization", entry["utilization"], worker=entry["worker"])
+        return {
+            "device": "cpu",
+            "mode": "process_pool",
+            "workers": workers,
+            "requests_per_second": completed / elapsed if elapsed else 0.0,
+            "tokens_per_second": output_tokens / elapsed if elapsed else 0.0,
+        }
+
+    def close(self):
+        """Lets every worker finish its in-flight requests, then stops the processes."""
+        self._closing = True
+        for worker in self._workers:
+            worker.requests.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=30.0)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        if self._temp_dir:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+
+    # Dispatch
+
+    def _call(self, method, *args):
+        if not self.model:
+            from backend import UNAVAILABLE_MESSAGE
+            return UNAVAILABLE_MESSAGE
+        try:
+            return self._submit(method, args)[2].result()
+        except Exception as e:
+            return f"An error occurred during text generation: {e}"
+
+    def _stream(self, method, text, cancel_event, *args):
+        if not self.model:
+            from backend import UNAVAILABLE_MESSAGE
+            yield UNAVAILABLE_MESSAGE
+            return "error"
+        deltas = queue.Queue()
+        try:
+            request_id, worker, _ = self._submit(method, (text, *args), deltas)
+        except RuntimeError as e:
+            yield f"An error occurred during text generation: {e}"
+            return "error"
+        cancel_sent = False
+        finished = False
+        try:
+            while True:
+                try:
+                    kind, value = deltas.get(timeout=0.1)
+                except queue.Empty:
+                    if cancel_event is not None and cancel_event.is_set() and not cancel_sent:
+                        worker.requests.put(("cancel", request_id, None, None))
+                        cancel_sent = True
+                    continue
+                if kind == "delta":
+                    yield value
+                elif kind == "error":
+                    finished = True
+                    yield f"\nAn error occurred during text generation: {value}"
+                    return "error"
+                else:
+                    finished = True
+                    return value # The worker's stop reason
+        finally:
+            if not finished and not cancel_sent and not worker.exited:
+                # The consumer closed the generator early: stop generating a reply nobody reads
+                worker.requests.put(("cancel", request_id, None, None))
+
+    def _submit(self, method, args, deltas=None):
+        """Sends a request to the least-loaded ready worker; returns (request_id, worker, Future or None)."""
+        future = None if deltas is not None else Future()
+        with self._lock:
+            candidates = [worker for worker in self._workers if worker.ready] or \
+                [worker for worker in self._workers if not worker.exited]
+            if not candidates:
+                raise RuntimeError("No inference worker is running.")
+            worker = min(candidates, key=lambda worker: (worker.in_flight, worker.busy_seconds))
+            request_id = next(self._ids)
+            self._pending[request_id] = (worker, future if future is not None else deltas)
+            if worker.in_flight == 0:
+                worker.busy_since = time.perf_counter()
+            worker.in_flight += 1
+        worker.requests.put(("run", request_id, method, args))
+        return request_id, worker, future
+
+    def _collect(self):
+        """Resolves futures and forwards stream deltas as worker messages arrive; notices dead workers."""
+        next_check = time.perf_counter() + WATCH_INTERVAL
+        while True:
+            if time.perf_counter() >= next_check:
+                self._reap_exited_workers()
+                next_check = time.perf_counter() + WATCH_INTERVAL
+            try:
+                index, request_id, kind, value = self._results.get(timeout=WATCH_INTERVAL)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            worker = self._workers[index]
+            if request_id is None:
+                if kind == "ready":
+                    worker.ready = True
+                    self._ready.set()
+                    print(f"Inference worker {index} ready.")
+                elif kind == "failed":
+                    print(f"❌ Inference worker {index} failed to start: {value}")
+                    if not any(worker.process.is_alive() for worker in self._workers if not worker.ready):
+                        self._ready.set() # Nothing left to wait for
+                elif kind == "stopped":
+                    worker.ready = False
+                continue
+
+            with self._lock:
+                _, target = self._pending.get(request_id, (None, None))
+                if kind != "delta" and request_id in self._pending: # Not already failed by _reap_exited_workers
+                    self._pending.pop(request_id, None)
+                    worker.in_flight -= 1
+                    worker.completed += 1
+                    if worker.in_flight == 0 and worker.busy_since is not None:
+                        worker.busy_seconds += time.perf_counter() - worker.busy_since
+                        worker.busy_since = None
+            if kind == "delta":
+                worker.output_tokens += len(self.tokenizer(value, add_special_tokens=False)["input_ids"])
+            elif kind == "done" and isinstance(value, str) and not isinstance(target, queue.Queue): # Not a stop reason
+                worker.output_tokens += len(self.tokenizer(value, add_special_tokens=False)["input_ids"])
+            if isinstance(target, queue.Queue):
+                target.put((kind, value))
+            elif target is not None:
+                if kind == "error":
+                    target.set_exception(RuntimeError(value))
+                else:
+                    target.set_result(value)
+
+    def _reap_exited_workers(self):
+        """Fails the pending requests of workers whose process has exited (crash, out of memory, kill)."""
+        running = [worker for worker in self._workers if not worker.exited]
+        exited = multiprocessing.connection.wait([worker.process.sentinel for worker in running], timeout=0)
+        for worker in running:
+            if worker.process.sentinel not in exited:
+                continue
+            worker.exited = True
+            worker.ready = False
+            error = f"Inference worker {worker.index} exited (exit code {worker.process.exitcode})."
+            with self._lock:
+                lost = [(request_id, target) for request_id, (owner, target) in self._pending.items() if owner is worker]
+                for request_id, _ in lost:
+                    del self._pending[request_id]
+                worker.in_flight = 0
+                if worker.busy_since is not None:
+                    worker.busy_seconds += time.perf_counter() - worker.busy_since
+                    worker.busy_since = None
+            if not self._closing:
+                print(f"❌ {error} {len(lost)} request(s) in flight failed.")
+                metrics.REGISTRY.increment("process_worker_exits", worker=worker.index)
+            for _, target in lost:
+                if isinstance(target, queue.Queue):
+                    target.put(("error", error))
+                else:
+                    target.set_exception(RuntimeError(error))
+            if not any(worker.process.is_alive() for worker in self._workers if not worker.ready):
+                self._ready.set() # No worker left that could still become ready
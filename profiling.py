@@ -0,0 +1,80 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Startup profiling: records how long each deferred import and startup phase takes.
+# Recording is always on (it is cheap); the report is only printed once enable() was called,
+# which main.py does for --profile-startup.
+
+_process_start = time.perf_counter()
+_enabled = False
+_reported = False
+_records = [] # (kind, name, started_at, seconds, thread name)
+_lock = threading.Lock()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _record(kind, name, started, seconds):
+    with _lock:
+        _records.append((kind, name, started - _process_start, seconds, threading.current_thread().name))
+    # Startup phases and imports (including model load stages) also feed the metrics registry
+    if kind == "phase":
+        metrics.REGISTRY.observe("startup_phase", seconds, phase=name)
+    elif kind == "import":
+        metrics.REGISTRY.observe("startup_import", seconds, module=name)
+
+
+def timed_import(module_name: str):
+    """Imports `module_name` and records the wall time it took (zero if it was already imported)."""
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _record("import", module_name, started, time.perf_counter() - started)
+    return module
+
+
+@contextmanager
+def phase(name: str):
+    """Records the wall time spent inside the block as a startup phase."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record("phase", name, started, time.perf_counter() - started)
+
+
+def mark(name: str):
+    """Records a point in time, e.g. when the window first painted."""
+    now = time.perf_counter()
+    _record("mark", name, now, 0.0)
+
+
+def report() -> str:
+    with _lock:
+        records = sorted(_records, key=lambda record: record[2])
+    lines = ["Startup profile (seconds since process start):"]
+    for kind, name, offset, seconds, thread_name in records:
+        if kind == "mark":
+            lines.append(f"  {offset:8.3f}s  mark    {name} [{thread_name}]")
+        else:
+            lines.append(f"  {offset:8.3f}s  {kind:<6}  {name}: {seconds:.3f}s [{thread_name}]")
+    return "\n".join(lines)
+
+
+def print_report(force=False):
+    """Prints the report once when profiling is enabled; `force` prints it again."""
+    global _reported
+    if not _enabled or (_reported and not force):
+        return
+    _reported = True
+    print(report())
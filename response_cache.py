@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes user text so trivially different copies of an entry share a cache key."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_cache_key(analysis_type: str, text: str, model_id: str, generation_params: dict) -> str:
+    """Builds a stable key from everything that determines the generated reply."""
+    payload = json.dumps(
+        [analysis_type, normalize_text(text), model_id, generation_params],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of generated replies, keyed by make_cache_key.
+    With `cache_dir` set, entries are also written to disk so they survive restarts;
+    the in-memory tier stays limited to `max_entries`. Identical requests that arrive
+    while the first one is still generating wait for its result instead of generating again.
+    """
+    def __init__(self, max_entries=256, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._in_flight = {} # key -> Future of the request currently generating it
+        self._lock = threading.Lock()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key: str):
+        """Returns the cached reply for `key`, or None, updating the hit/miss counters."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._remember(key, value)
+        self._write_to_disk(key, value)
+
+    def get_or_compute(self, key: str, compute, cacheable=None):
+        """
+        Returns the cached reply for `key`, calling `compute()` at most once per key at a time.
+        If `cacheable(value)` is false the value is returned (also to coalesced waiters) but not stored.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except Exception as e:
+            # Failures are not cached; waiting duplicates see the same error
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        if cacheable is None or cacheable(value):
+            self.put(key, value)
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _lookup(self, key):
+        """Memory tier first, then disk; must be called with the lock held."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        value = self._read_from_disk(key)
+        if value is not None:
+            self._remember(key, value)
+            self.hits += 1
+            self.disk_hits += 1
+        return value
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False) # Evict the least recently used reply
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)["response"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_to_disk(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file and rename so a crash never leaves a truncated entry
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"response": value}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write response cache entry: {e}")
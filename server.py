@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Headless entry point: serves one loaded MindGuardian to many local clients over HTTP.
+#
+#   python server.py --port 8765
+#   curl -s localhost:8765/ready
+#   curl -s -X POST localhost:8765/v1/analyze/journal -d '{"text": "Today was long."}'
+#   curl -sN -X POST localhost:8765/v1/analyze/journal -d '{"text": "Today was long.", "stream": true}'
+#
+# Streamed responses are newline-delimited JSON: {"delta": ...} lines, then {"done": true, "result": ...}.
+
+ANALYSES = {
+    "journal": ("analyze_journal", "stream_journal"),
+    "audio_transcript": ("analyze_audio_transcript", "stream_audio_transcript"),
+    "moment": ("analyze_moment", "stream_moment"),
+}
+
+MAX_BODY_BYTES = 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MindGuardianServer:
+    """
+    asyncio HTTP front end for MindGuardian. Generation runs on a bounded thread pool so the
+    event loop never blocks; concurrent requests reach the backend's batching scheduler together.
+    At most `max_pending` analyses may be running or waiting at once; beyond that requests are
+    rejected with 503 and a Retry-After header instead of queuing without bound.
+    """
+    def __init__(self, guardian_factory, workers=8, max_pending=32):
+        self.guardian_factory = guardian_factory
+        self.guardian = None
+        self.state = "loading" # loading -> ready | failed
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+
+    def start_loading(self):
+        """Loads the model on a background thread; /ready reports 200 once it is done."""
+        threading.Thread(target=self._load, name="backend-init", daemon=True).start()
+
+    def _load(self):
+        try:
+            guardian = self.guardian_factory()
+            self.guardian = guardian
+            self.state = "ready" if guardian.model else "failed"
+        except Exception as e:
+            print(f"❌ Critical Error: Failed to initialize MindGuardian backend: {e}")
+            self.state = "failed"
+        metrics.REGISTRY.set_gauge("server_ready", self.state == "ready")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, body = await self._read_request(reader)
+            await self._route(method, path, body, writer)
+        except HttpError as e:
+            await self._send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # Client went away
+        except Exception as e:
+            print(f"❌ Server Error: {e}")
+            try:
+                await self._send_json(writer, 500, {"error": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body, writer):
+        if path == "/health":
+            await self._send_json(writer, 200, {"status": "ok", "model": self.state, "pending": self.pending})
+        elif path == "/ready":
+            status = 200 if self.state == "ready" else 503
+            await self._send_json(writer, status, {"ready": self.state == "ready", "model": self.state})
+        elif path == "/metrics":
+            await self._send(writer, 200, "text/plain; version=0.0.4", metrics.REGISTRY.prometheus_text().encode("utf-8"))
+        elif path.startswith("/v1/analyze/"):
+            if method != "POST":
+                raise HttpError(405, "Use POST.")
+            analysis_type = path[len("/v1/analyze/"):]
+            if analysis_type not in ANALYSES:
+                raise HttpError(404, f"Unknown analysis '{analysis_type}'. Expected one of: {', '.join(ANALYSES)}.")
+            await self._analyze(analysis_type, body, writer)
+        else:
+            raise HttpError(404, "Not found.")
+
+    async def _analyze(self, analysis_type, body, writer):
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Body must be JSON.")
+        text = payload.get("text") if isinstance(payload, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            raise HttpError(400, "Field 'text' is required.")
+        if self.state != "ready":
+            raise HttpError(503, f"Model is {self.state}.")
+        # Backpressure: refuse new work once max_pending analyses are running or queued
+        if self.pending >= self.max_pending:
+            metrics.REGISTRY.increment("server_rejected", analysis=analysis_type)
+            await self._send_json(writer, 503, {"error": "Server busy, retry later."}, {"Retry-After": "1"})
+            return
+
+        self.pending += 1
+        metrics.REGISTRY.set_gauge("server_pending", self.pending)
+        try:
+            blocking_name, stream_name = ANALYSES[analysis_type]
+            if payload.get("stream"):
+                await self._stream(getattr(self.guardian, stream_name), text, writer)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, getattr(self.guardian, blocking_name), text)
+                await self._send_json(writer, 200, {"analysis": analysis_type, "result": result})
+        finally:
+            self.pending -= 1
+            metrics.REGISTRY.set_gauge("server_pending", self.pending)
+
+    async def _stream(self, stream_func, text, writer):
+        """
+        Drains the backend's delta generator on a worker thread and relays it as chunked NDJSON.
+        If the client disconnects or the task is cancelled, generation stops at the next token.
+        """
+        loop = asyncio.get_running_loop()
+        deltas = asyncio.Queue()
+        done = object()
+        cancel_event = threading.Event()
+
+        def produce():
+            stream = stream_func(text, cancel_event=cancel_event)
+            try:
+                for delta in stream:
+                    if cancel_event.is_set():
+                        break
+                    loop.call_soon_threadsafe(deltas.put_nowait, delta)
+            finally:
+                stream.close() # Releases the model (and a request still queued) right away
+                loop.call_soon_threadsafe(deltas.put_nowait, done)
+
+        producer = loop.run_in_executor(self.executor, produce)
+        chunks = []
+        try:
+            writer.write(self._head(200, "application/x-ndjson", {"Transfer-Encoding": "chunked"}))
+            while True:
+                delta = await deltas.get()
+                if delta is done:
+                    break
+                chunks.append(delta)
+                await self._write_chunk(writer, json.dumps({"delta": delta}) + "\n")
+        except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
+            metrics.REGISTRY.increment("server_streams_abandoned")
+            cancel_event.set()
+            raise
+        finally:
+            # The slot stays counted until the backend has really stopped generating
+            await producer
+        await self._write_chunk(writer, json.dumps({"done": True, "result": "".join(chunks).strip()}) + "\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _write_chunk(self, writer, text):
+        data = text.encode("utf-8")
+        writer.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        await writer.drain()
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            raise ConnectionError("Empty request")
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line.")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0") or 0)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "Request body too large.")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], body
+
+    def _head(self, status, content_type, extra_headers=None):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in (extra_headers or {}).items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send(self, writer, status, content_type, body, extra_headers=None):
+        headers = dict(extra_headers or {}, **{"Content-Length": str(len(body))})
+        writer.write(self._head(status, content_type, headers) + body)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload, extra_headers=None):
+        await self._send(writer, status, "application/json", json.dumps(payload).encode("utf-8"), extra_headers)
+
+
+async def serve(server, host, port):
+    server.start_loading()
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"Mind Guardian service listening on http://{host}:{port} (model {server.state})")
+    async with listener:
+        await listener.serve_forever()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Mind Guardian analyses over a local HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (local only by default).")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=8, help="Threads running analyses concurrently.")
+    parser.add_argument("--max-pending", type=int, default=32, help="Analyses running or waiting before requests get 503.")
+    parser.add_argument("--model", choices=["gemma", "tiny"], default="gemma",
+                        help="'tiny' serves the benchmark stand-in model, for offline smoke tests.")
+    parser.add_argument("--process-workers", type=int, default=None,
+                        help="Serve from N inference processes sharing memory-mapped weights "
+                             "(default: MIND_GUARDIAN_PROCESS_WORKERS, 0 = one in-process model).")
+    return parser.parse_args(argv)
+
+
+def guardian_factory(model_name, process_workers=0):
+    def create():
+        from backend import MindGuardian
+        model = tokenizer = None
+        if model_name == "tiny":
+            from benchmark import build_tiny_model
+            model, tokenizer = build_tiny_model()
+        if process_workers:
+            from process_pool import ProcessPoolGuardian
+            return ProcessPoolGuardian(workers=process_workers, model=model, tokenizer=tokenizer)
+        return MindGuardian(model=model, tokenizer=tokenizer)
+    return create
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    from process_pool import PROCESS_WORKERS
+    process_workers = PROCESS_WORKERS if args.process_workers is None else args.process_workers
+    server = MindGuardianServer(guardian_factory(args.model, process_workers), workers=args.workers, max_pending=args.max_pending)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        print("Shutting down.")
+    finally:
+        if server.guardian:
+            server.guardian.close()
+        server.executor.shutdown(wait=False)
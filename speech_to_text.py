@@ -0,0 +1,269 @@
+import json
+import os
+import threading
+import time
+
+import metrics
+import profiling
+from audio_capture import SPEECH_RATE, VAD_FRAME_MS, VAD_MIN_SPEECH_DB, import_numpy, trim_silence
+from model_registry import OFFLINE
+from worker_pool import INTERACTIVE, SerialQueue
+
+# Speech-to-text for voice notes. Engines share one small interface (load / transcribe PCM),
+# so the recognizer can be swapped without touching the GUI:
+#
+#   MIND_GUARDIAN_STT_ENGINE=vosk   offline, Kaldi models (default; https://alphacephei.com/vosk/models).
+#                                   MIND_GUARDIAN_VOSK_MODEL points at an unpacked model; without it the
+#                                   language's model is downloaded on first use, which MIND_GUARDIAN_OFFLINE=1
+#                                   (see model_registry.py) turns into an error, as it does the google engine
+#   MIND_GUARDIAN_STT_ENGINE=sphinx offline, CMU PocketSphinx through SpeechRecognition
+#   MIND_GUARDIAN_STT_ENGINE=google Google Web Speech API (needs the network; the previous behaviour)
+#
+# ChunkedTranscriber feeds an engine fixed-size chunks on background pool tasks while the user is
+# still recording, so only the last chunk is left to transcribe when they press Stop.
+STT_ENGINE = os.environ.get("MIND_GUARDIAN_STT_ENGINE", "vosk")
+STT_LANGUAGE = os.environ.get("MIND_GUARDIAN_STT_LANGUAGE", "pt-BR")
+VOSK_MODEL_PATH = os.environ.get("MIND_GUARDIAN_VOSK_MODEL") or None
+CHUNK_SECONDS = float(os.environ.get("MIND_GUARDIAN_STT_CHUNK_SECONDS", "5"))
+# How long Analyze waits for the chunks still being transcribed after Stop before giving up on a hung engine
+FINAL_WAIT_SECONDS = float(os.environ.get("MIND_GUARDIAN_STT_FINAL_WAIT_SECONDS", "120"))
+CUT_SEARCH_SECONDS = 1.0 # Chunks end at the quietest frame of their last second, not mid-word
+
+
+class SpeechEngineError(Exception):
+    pass
+
+
+class SpeechEngine:
+    """Base class: `transcribe` takes 16-bit mono PCM at `sample_rate` and returns its text ('' for none)."""
+    name = "base"
+    offline = True
+
+    def __init__(self, language=None):
+        self.language = language or STT_LANGUAGE
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        """Imports the engine and loads its model once; raises SpeechEngineError if unavailable."""
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def transcribe(self, pcm: bytes, sample_rate: int) -> str:
+        raise NotImplementedError
+
+    def _load(self):
+        pass
+
+
+class VoskEngine(SpeechEngine):
+    """
+    Offline Kaldi recognizer. Uses MIND_GUARDIAN_VOSK_MODEL, or the Vosk model for the language
+    (downloaded on first use unless `allow_download` is off, as it is with MIND_GUARDIAN_OFFLINE=1).
+    """
+    name = "vosk"
+
+    def __init__(self, language=None, model_path=None, allow_download=not OFFLINE):
+        super().__init__(language)
+        self.model_path = model_path or VOSK_MODEL_PATH
+        self.allow_download = allow_download
+        self._vosk = None
+        self._model = None
+
+    def _load(self):
+        if not self.model_path and not self.allow_download:
+            raise SpeechEngineError("Offline mode (MIND_GUARDIAN_OFFLINE=1) needs a local Vosk model: "
+                                    "set MIND_GUARDIAN_VOSK_MODEL to an unpacked model directory.")
+        try:
+            self._vosk = profiling.timed_import("vosk")
+        except ImportError:
+            raise SpeechEngineError("The vosk engine requires the vosk package (pip install vosk).")
+        self._vosk.SetLogLevel(-1)
+        try:
+            with profiling.phase("Vosk model load"):
+                if self.model_path:
+                    self._model = self._vosk.Model(self.model_path)
+                else:
+                    # Looks the language up in Vosk's model cache (downloading it the first time)
+                    self._model = self._vosk.Model(lang=self.language.split("-")[0].lower())
+        except Exception as e:
+            raise SpeechEngineError(f"Could not load a Vosk model for {self.language}: {e}. "
+                                    f"Set MIND_GUARDIAN_VOSK_MODEL to an unpacked model directory.")
+
+    def transcribe(self, pcm, sample_rate):
+        self.load()
+        recognizer = self._vosk.KaldiRecognizer(self._model, sample_rate)
+        recognizer.AcceptWaveform(bytes(pcm))
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+class _SpeechRecognitionEngine(SpeechEngine):
+    """Shared plumbing for recognizers reached through the SpeechRecognition package."""
+    def _load(self):
+        try:
+            self._sr = profiling.timed_import("speech_recognition")
+        except ImportError:
+            raise SpeechEngineError(f"The {self.name} engine requires SpeechRecognition (pip install SpeechRecognition).")
+        self._recognizer = self._sr.Recognizer()
+
+    def transcribe(self, pcm, sample_rate):
+        self.load()
+        audio = self._sr.AudioData(bytes(pcm), sample_rate, 2)
+        try:
+            return self._recognize(audio)
+        except self._sr.UnknownValueError:
+            return ""
+        except self._sr.RequestError as e:
+            raise SpeechEngineError(f"{self.name} recognition request failed: {e}")
+
+
+class SphinxEngine(_SpeechRecognitionEngine):
+    name = "sphinx"
+
+    def _recognize(self, audio):
+        return self._recognizer.recognize_sphinx(audio, language=self.language)
+
+
+class GoogleEngine(_SpeechRecognitionEngine):
+    name = "google"
+    offline = False
+
+    def _recognize(self, audio):
+        return self._recognizer.recognize_google(audio, language=self.language)
+
+
+ENGINES = {engine.name: engine for engine in (VoskEngine, SphinxEngine, GoogleEngine)}
+
+
+def create_engine(name=None, language=None, offline=OFFLINE) -> SpeechEngine:
+    """Builds the configured engine (cheap: the model is loaded on first use)."""
+    name = name or STT_ENGINE
+    if name not in ENGINES:
+        raise SpeechEngineError(f"Unknown speech engine '{name}'. Expected one of: {', '.join(ENGINES)}.")
+    if offline and not ENGINES[name].offline:
+        raise SpeechEngineError(f"The {name} engine needs the network, which offline mode (MIND_GUARDIAN_OFFLINE=1) rules out.")
+    return ENGINES[name](language)
+
+
+def quietest_cut(pcm, sample_rate, search_seconds=CUT_SEARCH_SECONDS):
+    """Byte offset of the quietest VAD frame within the last `search_seconds` of `pcm`."""
+    np = import_numpy()
+    frame = sample_rate * VAD_FRAME_MS // 1000
+    samples = np.frombuffer(pcm, dtype="<i2")
+    search = min(len(samples), int(search_seconds * sample_rate)) // frame * frame
+    if search == 0:
+        return len(pcm)
+    tail = samples[len(samples) - search:].reshape(-1, frame).astype(np.float32)
+    quietest = int(np.argmin(np.mean(tail * tail, axis=1)))
+    return (len(samples) - search + quietest * frame + frame // 2) * 2
+
+
+class ChunkedTranscriber:
+    """
+    Transcribes a recording while it is being captured. feed() is called from the recording thread
+    with resampled PCM; every `chunk_seconds` of audio is cut at a quiet point, stripped of silence,
+    and transcribed in order on background tasks of `pool` (a WorkerPool; a thread of its own when
+    None), which only hold a worker while chunks are waiting. close_input() queues the remainder
+    and result() waits for the transcript, which by then usually only lacks that last chunk.
+    """
+    def __init__(self, engine, sample_rate=SPEECH_RATE, chunk_seconds=CHUNK_SECONDS, pool=None):
+        self.engine = engine
+        self.sample_rate = sample_rate
+        self.chunk_bytes = int(chunk_seconds * sample_rate) * 2
+        self.chunk_stats = [] # One dict per transcribed chunk: audio/speech seconds, latencies
+        self.error = None
+        # Lowest noise floor measured so far; a chunk that is speech from end to end has none of its own
+        self.noise_floor_db = None
+        self._pending = bytearray()
+        self._texts = []
+        self._closed_at = None
+        self._lock = threading.Lock() # feed() runs on the recording thread, close_input() on the UI thread
+        self._chunks = SerialQueue(self._transcribe, pool, name="stt-chunk", priority=INTERACTIVE)
+        self._chunks.put(None) # Model loading overlaps with the first seconds of recording
+
+    def feed(self, pcm: bytes):
+        with self._lock:
+            if self._closed_at is not None:
+                return
+            self._pending += pcm
+            if len(self._pending) >= self.chunk_bytes:
+                cut = quietest_cut(self._pending, self.sample_rate)
+                self._submit(bytes(self._pending[:cut]))
+                del self._pending[:cut]
+
+    def close_input(self):
+        """No more audio: queues what is left as the final chunk (does not wait)."""
+        with self._lock:
+            if self._closed_at is not None:
+                return
+            self._closed_at = time.perf_counter()
+            if self._pending:
+                self._submit(bytes(self._pending))
+                self._pending = bytearray()
+
+    def result(self, timeout=None) -> str:
+        """Waits for every chunk and returns the joined transcript; raises SpeechEngineError on failure."""
+        self.close_input()
+        if not self._chunks.join(timeout):
+            self.cancel() # The chunks still queued behind the one that hung are dropped
+            raise SpeechEngineError(f"Transcription timed out after {timeout:.0f}s.")
+        if self._chunks.token.cancelled:
+            raise SpeechEngineError("Transcription was cancelled.")
+        if self.error:
+            raise self.error
+        final_wait = time.perf_counter() - self._closed_at
+        latencies = [stats["latency_seconds"] for stats in self.chunk_stats]
+        if latencies:
+            print(f"Transcribed {len(latencies)} chunk(s) with {self.engine.name}: "
+                  f"mean chunk latency {sum(latencies) / len(latencies):.2f}s, max {max(latencies):.2f}s, "
+                  f"{final_wait:.2f}s left after recording stopped")
+        metrics.REGISTRY.observe("stt_final_wait", final_wait, engine=self.engine.name)
+        return " ".join(text for text in self._texts if text)
+
+    def cancel(self):
+        self.close_input()
+        self._chunks.cancel()
+
+    def _submit(self, pcm):
+        self._chunks.put((time.perf_counter(), pcm))
+
+    def _transcribe(self, item):
+        """Handles one queued item: None loads the engine, (submitted_at, pcm) is a chunk."""
+        if item is None:
+            try:
+                self.engine.load()
+            except SpeechEngineError as e:
+                self.error = e
+            return
+        if self.error:
+            return # Drop the chunk; result() reports the error
+        submitted_at, pcm = item
+        speech, vad_stats = trim_silence(pcm, self.sample_rate, noise_floor_db=self.noise_floor_db)
+        chunk_floor_db = vad_stats["noise_floor_db"]
+        if chunk_floor_db is not None and (self.noise_floor_db is None or chunk_floor_db < self.noise_floor_db):
+            self.noise_floor_db = chunk_floor_db
+        if not speech and (vad_stats["peak_db"] or 0.0) > VAD_MIN_SPEECH_DB:
+            speech = pcm # Nothing stood out from the floor, but the chunk is not silent: let the engine decide
+        started = time.perf_counter()
+        try:
+            text = self.engine.transcribe(speech, self.sample_rate) if speech else ""
+        except SpeechEngineError as e:
+            self.error = e
+            return
+        except Exception as e:
+            self.error = SpeechEngineError(f"{self.engine.name} failed on chunk {len(self.chunk_stats)}: {e}")
+            return
+        finished = time.perf_counter()
+        self._texts.append(text.strip())
+        stats = {
+            "audio_seconds": vad_stats["recorded_seconds"],
+            "speech_seconds": vad_stats["speech_seconds"],
+            "processing_seconds": finished - started,
+            "latency_seconds": finished - submitted_at, # Includes waiting behind earlier chunks
+        }
+        self.chunk_stats.append(stats)
+        metrics.REGISTRY.observe("stt_chunk", stats["processing_seconds"], engine=self.engine.name)
+        print(f"STT chunk {len(self.chunk_stats)}: {stats['audio_seconds']:.1f}s audio "
+              f"({stats['speech_seconds']:.1f}s speech) in {stats['processing_seconds']:.2f}s")
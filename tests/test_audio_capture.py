@@ -0,0 +1,83 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from audio_capture import detect_speech, trim_silence
+
+RATE = 16000
+
+
+def pcm(signal):
+    return np.clip(np.rint(signal), -32768, 32767).astype("<i2").tobytes()
+
+
+def tone(seconds, amplitude=8000.0, frequency=220.0):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def speech_like(seconds, floor=0.2, seed=0):
+    """Noise under a 4 Hz syllable envelope that never drops below `floor`."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * RATE)) / RATE
+    envelope = floor + (1 - floor) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    return 6000.0 * envelope * rng.standard_normal(len(t))
+
+
+def room_noise(seconds, seed=1):
+    return 20.0 * np.random.default_rng(seed).standard_normal(int(seconds * RATE))
+
+
+@pytest.mark.parametrize("signal", [tone(5), speech_like(5), speech_like(5, floor=0.5)], ids=["tone", "envelope-0.2", "envelope-0.5"])
+def test_continuous_sound_is_kept_whole(signal):
+    speech, stats = trim_silence(pcm(signal), RATE)
+    assert stats["speech_seconds"] == pytest.approx(stats["recorded_seconds"], abs=0.05)
+    assert len(speech) >= len(pcm(signal)) - RATE * 0.05 * 2
+
+
+def test_steady_tone_has_no_floor_of_its_own():
+    assert trim_silence(pcm(tone(2)), RATE)[1]["noise_floor_db"] is None
+
+
+def test_long_pauses_are_cut_down():
+    signal = np.concatenate([room_noise(1), speech_like(1), room_noise(3), speech_like(1), room_noise(1)])
+    speech, stats = trim_silence(pcm(signal), RATE)
+    assert stats["noise_floor_db"] is not None
+    assert stats["segments"] == 2
+    assert 2.0 <= stats["speech_seconds"] < 3.0
+
+
+def test_carried_floor_applies_to_a_clip_without_silence():
+    quiet_then_loud = np.concatenate([room_noise(1), speech_like(1)])
+    _, stats = trim_silence(pcm(quiet_then_loud), RATE)
+    segments = detect_speech(pcm(speech_like(3)), RATE, noise_floor_db=stats["noise_floor_db"])
+    assert segments == [(0, 3 * RATE)]
+
+
+def test_digital_silence_has_no_speech():
+    speech, stats = trim_silence(bytes(RATE * 2 * 2), RATE)
+    assert speech == b""
+    assert stats["segments"] == 0
+
+
+def test_spilled_recording_is_trimmed_without_reading_it_whole(tmp_path, monkeypatch):
+    import wave
+    import audio_capture
+    from audio_capture import AudioCaptureBuffer
+
+    recording = pcm(np.concatenate([room_noise(1), speech_like(2), room_noise(2, seed=2), speech_like(1, seed=3)]))
+    buffer = AudioCaptureBuffer(RATE, max_memory_bytes=RATE, spill_dir=str(tmp_path))
+    for start in range(0, len(recording), 3200):
+        buffer.write(recording[start:start + 3200])
+    buffer.finish()
+    assert buffer.spilled
+    expected = trim_silence(recording, RATE)
+    monkeypatch.setattr(audio_capture, "VAD_BLOCK_FRAMES", 7) # Energies computed over many blocks
+    def readframes(self, count):
+        raise AssertionError("the spilled recording must not be read into memory")
+    monkeypatch.setattr(wave.Wave_read, "readframes", readframes)
+    speech, stats = buffer.speech_pcm()
+    assert (speech, stats) == expected
+    assert stats["segments"] == 2
+    buffer.discard()
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import backend
+from benchmark import build_tiny_model
+
+ENTRY = "I could not sleep again and kept thinking about work."
+
+
+class CountingRetrieval:
+    """Stands in for SimilarEntries: counts lookups, versioned like the real index."""
+
+    def __init__(self):
+        self.calls = 0
+        self.entries = 1
+
+    def related(self, text):
+        self.calls += 1
+        return [f"2024-01-0{i + 1}: an earlier entry" for i in range(self.entries)]
+
+    def version(self):
+        return str(self.entries)
+
+
+@pytest.fixture
+def guardian(monkeypatch):
+    monkeypatch.setattr(backend, "RESPONSE_CACHE_DIR", None)
+    model, tokenizer = build_tiny_model()
+    guardian = backend.MindGuardian(deterministic=True, model=model, tokenizer=tokenizer, cache_responses=True)
+    retrieval = CountingRetrieval()
+    guardian.related_entries = retrieval.related
+    guardian.related_entries_version = retrieval.version
+    yield guardian, retrieval
+    guardian.close()
+
+
+def test_cache_hit_skips_related_entries(guardian):
+    guardian, retrieval = guardian
+    first = str(guardian.analyze_journal(ENTRY))
+    assert retrieval.calls == 1
+    assert str(guardian.analyze_journal(ENTRY)) == first
+    assert "".join(guardian.stream_journal(ENTRY)) == first
+    assert retrieval.calls == 1
+
+
+def test_new_entries_invalidate_the_cached_reply(guardian):
+    guardian, retrieval = guardian
+    guardian.analyze_journal(ENTRY)
+    retrieval.entries = 2
+    guardian.analyze_journal(ENTRY)
+    assert retrieval.calls == 2
+
+
+def test_unversioned_retrieval_still_keys_on_the_entries(guardian):
+    guardian, retrieval = guardian
+    guardian.related_entries_version = None
+    guardian.analyze_journal(ENTRY)
+    guardian.analyze_journal(ENTRY)
+    assert retrieval.calls == 2
+
+
+def test_stream_returns_its_stop_reason(guardian):
+    guardian, _ = guardian
+    outcome = {}
+    reply = "".join(backend.drain_stream(guardian.stream_journal(ENTRY), outcome))
+    assert outcome["stop_reason"] == guardian.analyze_journal(ENTRY).stop_reason
+    assert "".join(backend.drain_stream(guardian.stream_journal(ENTRY), outcome)) == reply
+    assert outcome["stop_reason"] in ("eos", "stop_string", "budget", "deadline")
+
+
+def test_different_models_do_not_share_cached_replies(guardian):
+    guardian, _ = guardian
+    model, tokenizer = build_tiny_model(seed=1) # Same architecture and config, other weights
+    other = backend.MindGuardian(deterministic=True, model=model, tokenizer=tokenizer, cache_responses=True)
+    try:
+        assert other.model_id != guardian.model_id
+        assert other._cache_key("journal", ENTRY) != guardian._cache_key("journal", ENTRY)
+    finally:
+        other.close()
+    model, tokenizer = build_tiny_model()
+    same = backend.MindGuardian(deterministic=True, model=model, tokenizer=tokenizer, cache_responses=True)
+    try:
+        assert same.model_id == guardian.model_id
+    finally:
+        same.close()
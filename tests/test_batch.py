@@ -0,0 +1,25 @@
+import json
+
+import batch
+
+
+class UnloadedGuardian:
+    """Answers like MindGuardian while its model is unloaded by the memory manager: no scheduler."""
+    scheduler = None
+
+    def count_tokens(self, texts):
+        return [len(text.split()) for text in texts]
+
+    def analyze_batch(self, analysis_type, texts):
+        return [f"reflection on {text}" for text in texts]
+
+
+def test_progress_does_not_depend_on_the_scheduler(tmp_path, capsys):
+    source = tmp_path / "entries.jsonl"
+    source.write_text("".join(json.dumps({"id": i, "text": f"entry {i}"}) + "\n" for i in range(5)), encoding="utf-8")
+    output = tmp_path / "reflections.jsonl"
+    args = batch.parse_args([str(source), str(output), "--window", "2", "--batch-size", "2"])
+    batch.run(args, UnloadedGuardian())
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert [record["id"] for record in records] == [str(i) for i in range(5)]
+    assert "5 entries done" in capsys.readouterr().out
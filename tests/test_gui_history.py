@@ -0,0 +1,49 @@
+import queue
+import types
+
+import pytest
+
+pytest.importorskip("tkinter")
+
+from backend import TRUNCATED_MARKER, UNAVAILABLE_MESSAGE
+from gui import MindGuardianGUI
+
+
+class FakeHistory:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, analysis_type, text, reflection):
+        self.rows.append((analysis_type, text, reflection))
+
+
+def fake_stream(deltas, stop_reason):
+    def stream_journal(text, cancel_event=None):
+        yield from deltas
+        return stop_reason
+    return stream_journal
+
+
+def run(stream_func):
+    history = FakeHistory()
+    gui = types.SimpleNamespace(guardian=types.SimpleNamespace(plan_input=lambda text: {"strategy": "direct"}),
+                                result_queue=queue.Queue(), history=history)
+    MindGuardianGUI.run_analysis(gui, "journal", stream_func, "A long day.", "output", "button")
+    return history.rows
+
+
+def test_whole_reply_is_saved():
+    assert run(fake_stream(["You sound ", "tired."], "eos")) == [("journal", "A long day.", "You sound tired.")]
+    assert run(fake_stream(["You sound tired."], "cached")) == [("journal", "A long day.", "You sound tired.")]
+
+
+@pytest.mark.parametrize("deltas, stop_reason", [
+    (["You sound ", "\nAn error occurred during text generation: out of memory"], "error"),
+    ([UNAVAILABLE_MESSAGE], "error"),
+    (["You sound", TRUNCATED_MARKER], "budget"),
+    (["You sound", TRUNCATED_MARKER], "deadline"),
+    (["You sound"], "cancelled"),
+    (["You sound tired."], None), # A stream that does not report how it ended
+])
+def test_failed_reply_is_not_saved(deltas, stop_reason):
+    assert run(fake_stream(deltas, stop_reason)) == []
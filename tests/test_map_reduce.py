@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import backend
+from benchmark import build_tiny_model
+
+LONG_ENTRY = " ".join(f"Day {day}: I walked to the river and felt a little lighter." for day in range(1, 9))
+
+
+@pytest.fixture
+def guardian(monkeypatch):
+    # Chunks so small that their summaries are longer than the chunks: the reduce step never shrinks the text
+    monkeypatch.setattr(backend, "CHUNK_TOKENS", 4)
+    monkeypatch.setattr(backend, "MAX_DIRECT_TOKENS", 32)
+    monkeypatch.setattr(backend, "MAX_REDUCE_LEVELS", 2)
+    model, tokenizer = build_tiny_model()
+    guardian = backend.MindGuardian(deterministic=True, model=model, tokenizer=tokenizer, cache_responses=False)
+    yield guardian
+    guardian.close()
+
+
+def test_reduce_stops_when_summaries_do_not_shrink(guardian):
+    assert guardian.count_tokens([LONG_ENTRY])[0] > backend.MAX_DIRECT_TOKENS
+    [(text, plan)] = guardian._condense("journal", [LONG_ENTRY])
+    assert plan["strategy"] == "map_reduce"
+    assert plan["truncated"]
+    assert plan["levels"] <= backend.MAX_REDUCE_LEVELS
+    summaries = text.split("\n\n", 1)[1]
+    assert guardian.count_tokens([summaries])[0] <= backend.MAX_DIRECT_TOKENS
+
+
+def test_short_entries_are_not_summarized(guardian):
+    [(text, plan)] = guardian._condense("journal", ["A quiet day."])
+    assert text == "A quiet day."
+    assert plan == {"strategy": "direct", "input_tokens": guardian.count_tokens(["A quiet day."])[0]}
@@ -0,0 +1,19 @@
+from model_registry import ModelRegistry
+
+
+def checkpoint(directory, weights):
+    directory.mkdir()
+    (directory / "config.json").write_text("{}")
+    (directory / "model.safetensors").write_bytes(weights)
+    return str(directory)
+
+
+def test_fingerprint_follows_the_checkpoint_contents(tmp_path):
+    registry = ModelRegistry(model_dir=str(tmp_path / "models"), offline=True)
+    assert registry.fingerprint("gemma") is None
+    registry.register("gemma", checkpoint(tmp_path / "a", b"weights"))
+    first = registry.fingerprint("gemma")
+    registry.register("gemma", checkpoint(tmp_path / "b", b"weights"))
+    assert registry.fingerprint("gemma") == first # Same files, other directory
+    registry.register("gemma", checkpoint(tmp_path / "c", b"other weights"))
+    assert registry.fingerprint("gemma") != first
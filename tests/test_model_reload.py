@@ -0,0 +1,40 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import backend
+from benchmark import build_tiny_model
+from cpu_inference import CpuInferenceConfig
+
+ENTRY = "Another restless night, but the morning walk helped."
+
+
+def int8_guardian(checkpoint_path=None):
+    backend.import_dependencies()
+    model, tokenizer = build_tiny_model()
+    model = torch.ao.quantization.quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+    guardian = backend.MindGuardian(deterministic=True, model=model, tokenizer=tokenizer, cache_responses=False,
+                                    idle_unload_seconds=0, memory_budget_bytes=0)
+    if checkpoint_path is not None:
+        # As if loaded from a Gemma checkpoint in the int8 CPU mode
+        guardian._checkpoint_path = checkpoint_path
+        guardian.cpu_config = CpuInferenceConfig("int8", "fp32", 1, 1, quantized=True)
+    return guardian
+
+
+@pytest.mark.parametrize("from_checkpoint", [False, True])
+def test_int8_model_reloads_from_its_snapshot(tmp_path, monkeypatch, from_checkpoint):
+    guardian = int8_guardian(str(tmp_path) if from_checkpoint else None)
+    def load_gemma():
+        raise AssertionError("an int8 model must not be loaded and quantized again")
+    monkeypatch.setattr(guardian, "_load_gemma", load_gemma)
+    try:
+        before = guardian.analyze_journal(ENTRY)
+        assert guardian.memory.unload()
+        assert guardian.model is None
+        assert guardian.analyze_journal(ENTRY) == before
+        assert guardian.memory.stats["reloads"] == 1
+        assert any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in guardian.model.modules())
+    finally:
+        guardian.close()
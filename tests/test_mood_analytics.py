@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from mood_analytics import EMOTIONS, MoodAnalytics, entry_features, word_emotion
+
+NEUTRAL_WORDS = ["happened", "happen", "chores", "solid", "solidly", "relied", "relies", "joystick", "glade",
+                 "chord", "angle", "resentar", "sadhu"]
+
+
+@pytest.mark.parametrize("word", NEUTRAL_WORDS)
+def test_neutral_words_score_zero(word):
+    assert word_emotion(word) is None
+    length, features = entry_features(word)
+    assert all(value == 0 for value in features)
+
+
+def test_neutral_sentence_scores_zero():
+    _, features = entry_features("It happened while I did the chores; the plan was solid and I relied on it.")
+    assert features == [0.0] * (len(EMOTIONS) + 1)
+
+
+@pytest.mark.parametrize("word, emotion", [
+    ("happy", "joy"), ("relieved", "calm"), ("chorei", "sadness"), ("solidão", "sadness"),
+    ("worried", "anxiety"), ("ansiosa", "anxiety"), ("frustrated", "anger"), ("tranquila", "calm"),
+])
+def test_emotion_words_and_inflections(word, emotion):
+    _, features = entry_features(word)
+    assert features[EMOTIONS.index(emotion)] == 100.0
+    assert features[-1] == (1.0 if emotion in ("joy", "calm") else -1.0)
+
+
+def test_saved_features_from_older_scoring_are_rebuilt(tmp_path):
+    path = str(tmp_path / "features.npz")
+    analytics = MoodAnalytics(path)
+    analytics.add([{"id": 1, "created_at": 0.0, "kind": "journal", "text": "happy", "analysis": ""}])
+    analytics.save()
+    assert len(MoodAnalytics(path)) == 1
+    import numpy as np
+    with np.load(path) as data:
+        columns = {name: data[name] for name in data.files if name != "scoring_version"}
+    np.savez(path, **columns)
+    assert len(MoodAnalytics(path)) == 0
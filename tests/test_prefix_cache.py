@@ -0,0 +1,39 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import backend
+from backend import PROMPT_TEMPLATES, PrefixCache
+from benchmark import build_tiny_model
+
+TEXTS = ["calm", "I felt calm today.", " leading space", "Três dias sem dormir bem.\n\nDepois melhorou."]
+
+
+@pytest.fixture(scope="module")
+def prefix_cache():
+    backend.import_dependencies()
+    model, tokenizer = build_tiny_model()
+    return PrefixCache(model.eval(), tokenizer, "cpu"), tokenizer
+
+
+@pytest.mark.parametrize("analysis_type", sorted(PROMPT_TEMPLATES))
+@pytest.mark.parametrize("text", TEXTS)
+def test_cached_prefix_tokenizes_like_the_whole_prompt(prefix_cache, analysis_type, text):
+    cache, tokenizer = prefix_cache
+    prompt = PROMPT_TEMPLATES[analysis_type].format(text=text)
+    inputs = cache.build_inputs(analysis_type, prompt)
+    assert inputs is not None
+    prefix_ids = cache._entries[analysis_type][1][0].tolist()
+    suffix_ids = inputs["input_ids"][0, len(prefix_ids):].tolist()
+    assert prefix_ids + suffix_ids == tokenizer(prompt).input_ids
+    assert inputs["past_key_values"].get_seq_length() == len(prefix_ids)
+
+
+@pytest.mark.parametrize("analysis_type", sorted(PROMPT_TEMPLATES))
+def test_prefix_stops_before_the_text_label(prefix_cache, analysis_type):
+    cache, _ = prefix_cache
+    cache.prefill(analysis_type)
+    prefix_text = cache._entries[analysis_type][0]
+    assert prefix_text.endswith("\n")
+    assert "{text}" not in prefix_text
@@ -0,0 +1,41 @@
+import types
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import backend
+from benchmark import build_tiny_model
+from process_pool import ProcessPoolGuardian, export_shared_snapshot, load_shared_model
+
+
+def test_snapshot_loads_into_the_mapped_weights(tmp_path):
+    model, tokenizer = build_tiny_model()
+    model.eval()
+    export_shared_snapshot(model, tokenizer, str(tmp_path))
+    loaded = load_shared_model(str(tmp_path))
+    assert not any(tensor.is_meta for tensor in list(loaded.parameters()) + list(loaded.buffers()))
+    ids = tokenizer("I slept well for once.", return_tensors="pt").input_ids
+    with torch.no_grad():
+        assert torch.equal(model(ids).logits, loaded(ids).logits)
+
+
+def pool_with_workers(*workers):
+    pool = ProcessPoolGuardian.__new__(ProcessPoolGuardian) # Dispatch only: no processes are started
+    pool._workers = list(workers)
+    return pool
+
+
+def test_analyze_batch_without_workers_returns_messages():
+    pool = pool_with_workers()
+    assert pool.analyze_batch("journal", ["a", "b"]) == [backend.UNAVAILABLE_MESSAGE] * 2
+
+
+def test_analyze_batch_reports_a_failed_slice_per_text():
+    pool = pool_with_workers(types.SimpleNamespace(ready=True))
+    def submit(method, args):
+        raise RuntimeError("No inference worker is running.")
+    pool._submit = submit
+    assert pool.analyze_batch("journal", ["a", "b"]) == \
+        ["An error occurred during text generation: No inference worker is running."] * 2
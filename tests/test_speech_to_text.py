@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from speech_to_text import ChunkedTranscriber, SpeechEngine, SpeechEngineError, VoskEngine, create_engine
+from worker_pool import WorkerPool
+from test_audio_capture import RATE, pcm, room_noise, speech_like
+
+
+class CountingEngine(SpeechEngine):
+    """Transcribes every chunk as the number of seconds of audio it was given."""
+    name = "counting"
+
+    def load(self):
+        pass
+
+    def transcribe(self, pcm, sample_rate):
+        return f"{len(pcm) / 2 / sample_rate:.1f}"
+
+
+def transcribe(signal, chunk_seconds=5):
+    transcriber = ChunkedTranscriber(CountingEngine(), sample_rate=RATE, chunk_seconds=chunk_seconds)
+    data = pcm(signal)
+    for start in range(0, len(data), RATE // 5 * 2): # 200 ms blocks, as the recorder feeds them
+        transcriber.feed(data[start:start + RATE // 5 * 2])
+    return transcriber, [float(seconds) for seconds in transcriber.result(timeout=30).split()]
+
+
+def test_chunks_of_continuous_speech_are_transcribed():
+    # A pause in the first chunk gives a floor; the chunks after it are speech from end to end
+    transcriber, seconds = transcribe(np.concatenate([room_noise(2), speech_like(18)]))
+    assert transcriber.noise_floor_db is not None
+    assert len(seconds) == len(transcriber.chunk_stats) >= 4
+    assert all(value > 0 for value in seconds)
+    assert sum(seconds) >= 17.5
+
+
+def test_recording_without_any_pause_is_transcribed():
+    transcriber, seconds = transcribe(speech_like(12, floor=0.5))
+    assert sum(seconds) == pytest.approx(12, abs=0.3)
+
+
+def test_chunks_are_transcribed_on_a_worker_pool():
+    pool = WorkerPool(workers=1)
+    transcriber = ChunkedTranscriber(CountingEngine(), sample_rate=RATE, chunk_seconds=2, pool=pool)
+    data = pcm(speech_like(7, floor=0.5))
+    for start in range(0, len(data), RATE // 5 * 2):
+        transcriber.feed(data[start:start + RATE // 5 * 2])
+    assert sum(float(seconds) for seconds in transcriber.result(timeout=30).split()) == pytest.approx(7, abs=0.3)
+    assert pool.submit(lambda: "free").future.result(timeout=5) == "free" # No worker is held between chunks
+    pool.shutdown()
+
+
+def test_final_wait_gives_up_on_a_hung_engine():
+    release = threading.Event()
+
+    class HungEngine(CountingEngine):
+        def transcribe(self, pcm, sample_rate):
+            release.wait(10)
+            return super().transcribe(pcm, sample_rate)
+
+    transcriber = ChunkedTranscriber(HungEngine(), sample_rate=RATE, chunk_seconds=1)
+    transcriber.feed(pcm(speech_like(3, floor=0.5)))
+    with pytest.raises(SpeechEngineError, match="timed out"):
+        transcriber.result(timeout=0.2)
+    release.set()
+
+
+def test_offline_mode_never_downloads_a_speech_model(monkeypatch):
+    monkeypatch.setattr("speech_to_text.VOSK_MODEL_PATH", None)
+    with pytest.raises(SpeechEngineError, match="MIND_GUARDIAN_VOSK_MODEL"):
+        VoskEngine(model_path=None, allow_download=False).load()
+    with pytest.raises(SpeechEngineError, match="offline mode"):
+        create_engine("google", offline=True)
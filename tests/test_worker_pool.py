@@ -0,0 +1,76 @@
+import threading
+
+from worker_pool import SerialQueue, WorkerPool
+
+
+def test_items_are_handled_in_order_without_holding_a_worker():
+    pool = WorkerPool(workers=1)
+    handled = []
+    serial = SerialQueue(handled.append, pool)
+    for item in range(50):
+        serial.put(item)
+    assert serial.join(timeout=10)
+    assert handled == list(range(50))
+    # The drain task has ended: the only worker is free for other work
+    assert pool.submit(lambda: "free").future.result(timeout=5) == "free"
+    pool.shutdown()
+
+
+def test_join_handles_items_left_by_a_shut_down_pool():
+    pool = WorkerPool(workers=1)
+    pool.shutdown()
+    handled = []
+    serial = SerialQueue(handled.append, pool)
+    serial.put(1) # Refused by the pool: waits for join()
+    serial.put(2)
+    assert handled == []
+    assert serial.join(timeout=5)
+    assert handled == [1, 2]
+
+
+def test_queued_drain_cancelled_by_shutdown_leaves_items_to_join():
+    pool = WorkerPool(workers=1)
+    release = threading.Event()
+    pool.submit(release.wait, 10) # Keeps the worker busy while the drain task waits behind it
+    handled = []
+    serial = SerialQueue(handled.append, pool)
+    serial.put("entry")
+    pool.shutdown(cancel=True, timeout=0) # The drain task is skipped once the worker gets to it
+    release.set()
+    assert serial.join(timeout=5)
+    assert handled == ["entry"]
+
+
+def test_cancel_drops_pending_items():
+    started, release = threading.Event(), threading.Event()
+    handled = []
+
+    def handler(item):
+        started.set()
+        release.wait(10)
+        handled.append(item)
+
+    serial = SerialQueue(handler)
+    serial.put(1)
+    started.wait(5)
+    serial.put(2)
+    serial.cancel()
+    serial.put(3)
+    release.set()
+    assert serial.join(timeout=5)
+    assert 2 not in handled and 3 not in handled
+
+
+def test_handler_errors_do_not_stop_the_queue():
+    handled = []
+
+    def handler(item):
+        if item == 1:
+            raise ValueError("bad item")
+        handled.append(item)
+
+    serial = SerialQueue(handler)
+    for item in range(3):
+        serial.put(item)
+    assert serial.join(timeout=5)
+    assert handled == [0, 2]
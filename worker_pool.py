@@ -0,0 +1,239 @@
+import collections
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+import metrics
+
+# Background work of the GUI (backend loading, recording, transcription, analyses) runs on one
+# bounded pool instead of a new thread per click. Lower priority values run first.
+INTERACTIVE = 0 # The user is waiting on it: analyses, recording, transcription
+BACKGROUND = 10 # Loading, warm-up and maintenance jobs
+
+POOL_WORKERS = int(os.environ.get("MIND_GUARDIAN_POOL_WORKERS", "4"))
+POOL_MAX_PENDING = int(os.environ.get("MIND_GUARDIAN_POOL_MAX_PENDING", "16"))
+
+
+class PoolFullError(Exception):
+    pass
+
+
+class CancellationToken(threading.Event):
+    """
+    Set when the task it belongs to should stop. It is a threading.Event, so it can be handed
+    straight to the backend (e.g. `cancel_event=` of the stream_* methods) and checked with
+    is_set() inside long-running loops.
+    """
+    def cancel(self):
+        self.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.is_set()
+
+
+class Task:
+    """A unit of work in the pool: its future, its cancellation token and when it was queued."""
+    def __init__(self, fn, args, kwargs, priority, name, token):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.name = name or getattr(fn, "__name__", "task")
+        self.token = token or CancellationToken()
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+    def cancel(self):
+        self.token.cancel()
+
+
+class WorkerPool:
+    """
+    Fixed set of worker threads fed from a priority queue (FIFO within a priority). At most
+    `max_pending` tasks may be queued or running; submit() raises PoolFullError beyond that,
+    and tasks submitted with a `key` are refused while another task with that key is active,
+    so repeated clicks cannot pile up work. Each task carries a CancellationToken; cancelling
+    a queued task skips it, and running tasks are expected to poll or forward their token.
+    """
+    def __init__(self, workers=POOL_WORKERS, max_pending=POOL_MAX_PENDING, name="gui"):
+        self.name = name
+        self.max_pending = max_pending
+        self.stats = {"submitted": 0, "started": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0, "wait_seconds": 0.0}
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._active = {} # Task -> key, for every queued or running task
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._run, name=f"{name}-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn, *args, priority=BACKGROUND, key=None, name=None, token=None, **kwargs) -> Task:
+        """Queues fn(*args, **kwargs); returns its Task. Raises PoolFullError if refused."""
+        task = Task(fn, args, kwargs, priority, name, token)
+        with self._lock:
+            if self._closed:
+                raise PoolFullError("Worker pool is shut down.")
+            if key is not None and key in self._active.values():
+                self.stats["rejected"] += 1
+                raise PoolFullError(f"'{key}' is already running.")
+            if len(self._active) >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise PoolFullError(f"Too many tasks pending ({len(self._active)}).")
+            self._active[task] = key
+            self.stats["submitted"] += 1
+            self._queue.put((priority, next(self._sequence), task))
+        metrics.REGISTRY.set_gauge("pool_queue_depth", self.queue_depth(), pool=self.name)
+        return task
+
+    def queue_depth(self) -> int:
+        """Tasks waiting for a worker (not counting running ones)."""
+        return self._queue.qsize()
+
+    def report(self) -> dict:
+        with self._lock:
+            report = dict(self.stats, queue_depth=self.queue_depth(), active=len(self._active))
+        report["mean_wait_seconds"] = report["wait_seconds"] / report["started"] if report["started"] else 0.0
+        return report
+
+    def shutdown(self, cancel=False, timeout=5.0):
+        """
+        Stops accepting work. With cancel=False queued tasks still run (drain); with cancel=True
+        every queued and running task is cancelled. Waits up to `timeout` seconds for the workers.
+        """
+        with self._lock:
+            self._closed = True
+            active = list(self._active)
+        if cancel:
+            for task in active:
+                task.cancel()
+        for _ in self._workers:
+            self._queue.put((float("inf"), next(self._sequence), None)) # Sorted after any real task
+        deadline = time.perf_counter() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.perf_counter()))
+        still_running = [worker.name for worker in self._workers if worker.is_alive()]
+        if still_running:
+            print(f"Worker pool '{self.name}': {len(still_running)} worker(s) still busy after {timeout:.1f}s.")
+        return not still_running
+
+    def _run(self):
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                return
+            wait = time.perf_counter() - task.enqueued_at
+            metrics.REGISTRY.set_gauge("pool_queue_depth", self.queue_depth(), pool=self.name)
+            if task.token.cancelled:
+                task.future.set_exception(CancelledError())
+                self._finish(task, "cancelled")
+                continue
+            metrics.REGISTRY.observe("pool_wait", wait, pool=self.name, priority=task.priority, task=task.name)
+            with self._lock:
+                self.stats["started"] += 1
+                self.stats["wait_seconds"] += wait
+            try:
+                task.future.set_result(task.fn(*task.args, **task.kwargs))
+                self._finish(task, "cancelled" if task.token.cancelled else "completed")
+            except Exception as e:
+                print(f"❌ Task '{task.name}' failed: {e}")
+                task.future.set_exception(e)
+                self._finish(task, "failed")
+
+    def _finish(self, task, outcome):
+        with self._lock:
+            self._active.pop(task, None)
+            self.stats[outcome] += 1
+        metrics.REGISTRY.increment("pool_tasks", pool=self.name, outcome=outcome, task=task.name)
+
+
+class SerialQueue:
+    """
+    Runs `handler(item)` for every item put, one at a time and in order, on tasks of a WorkerPool
+    (on a short-lived thread of its own when `pool` is None). A task is only submitted while items
+    are waiting and ends once they are handled, so an ordered stream of work (transcription chunks,
+    index updates) never holds a pool worker while idle. cancel() drops the items not yet handled;
+    items left behind by a task the pool cancelled or refused are handled by the next put() or join().
+    """
+    def __init__(self, handler, pool=None, name="serial", priority=BACKGROUND):
+        self.handler = handler
+        self.pool = pool
+        self.name = name
+        self.priority = priority
+        self.token = CancellationToken()
+        self._items = collections.deque()
+        self._draining = False # A task (or thread) is handling the items
+        self._idle = threading.Condition()
+
+    def put(self, item):
+        with self._idle:
+            if self.token.cancelled:
+                return
+            self._items.append(item)
+            if self._draining:
+                return
+            self._draining = True
+        if self.pool is None:
+            threading.Thread(target=self._drain, name=self.name, daemon=True).start()
+            return
+        token = CancellationToken() # Cancelled by the pool's shutdown(cancel=True), not by cancel()
+        try:
+            task = self.pool.submit(self._drain, token, priority=self.priority, name=self.name, token=token)
+        except PoolFullError:
+            self._stopped()
+            return
+        task.future.add_done_callback(self._skipped)
+
+    def join(self, timeout=None) -> bool:
+        """
+        Waits until every item put so far is handled (or dropped by cancel()); returns False on
+        timeout. Items no pool task is left to handle are handled on the calling thread.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._draining and not self.token.cancelled:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            if self.token.cancelled or not self._items:
+                return True
+            self._draining = True
+        self._drain()
+        return True
+
+    def cancel(self):
+        self.token.cancel()
+        with self._idle:
+            self._items.clear()
+            self._idle.notify_all()
+
+    def _drain(self, token=None):
+        while True:
+            with self._idle:
+                if self.token.cancelled:
+                    self._items.clear()
+                if not self._items or self.token.cancelled or (token and token.cancelled):
+                    self._draining = False
+                    self._idle.notify_all()
+                    return
+                item = self._items.popleft()
+            try:
+                self.handler(item)
+            except Exception as e:
+                print(f"❌ '{self.name}' failed on an item: {e}")
+
+    def _skipped(self, future):
+        if isinstance(future.exception(), CancelledError): # Cancelled while queued: _drain() never ran
+            self._stopped()
+
+    def _stopped(self):
+        with self._idle:
+            self._draining = False
+            self._idle.notify_all()